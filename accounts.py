@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import os
+import time
+from urllib.parse import parse_qs, urlparse
+
+from telegram import Update
+from telegram.ext import ContextTypes, ConversationHandler
+
+import task_cache
+from auth import SCOPES, load_client_config, user_credentials
+from sync import engine
+
+ASK_LINK_CODE = 8
+
+# Google не поддерживает OOB-авторизацию, поэтому используется loopback:
+# браузер после входа откроет http://localhost/?code=..., страница не
+# загрузится, а пользователь пришлёт боту её адрес.
+OAUTH_REDIRECT_URI = os.getenv("OAUTH_REDIRECT_URI", "http://localhost")
+LINK_TIMEOUT = 600
+LINK_HINT = "🔗 Сначала подключи свой Google-аккаунт: /link"
+
+# Flow хранит code_verifier и не сериализуется, поэтому ожидающие
+# подключения живут в памяти процесса, а не в user_data.
+_pending = {}
+
+
+def _expire_pending():
+    # Брошенные подключения: пользователь так и не прислал адрес
+    now = time.monotonic()
+    for user_id in [user_id for user_id, (started, _, _) in _pending.items() if now - started > LINK_TIMEOUT]:
+        del _pending[user_id]
+
+
+def _extract_code(text):
+    text = text.strip()
+    if "code=" not in text:
+        return text, None
+    query = parse_qs(urlparse(text).query)
+    return query.get("code", [None])[0], query.get("state", [None])[0]
+
+
+async def link_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not user_credentials.store.enabled:
+        await update.message.reply_text("⚠️ Подключение своих аккаунтов не настроено (нет TOKEN_STORE_KEY).")
+        return ConversationHandler.END
+    from google_auth_oauthlib.flow import Flow
+
+    flow = Flow.from_client_config(load_client_config(), SCOPES, redirect_uri=OAUTH_REDIRECT_URI)
+    url, state = flow.authorization_url(access_type="offline", prompt="consent")
+    _expire_pending()
+    _pending[update.effective_user.id] = (time.monotonic(), state, flow)
+    await update.message.reply_text(
+        "🔗 Подключение Google-аккаунта:\n"
+        f"1. Открой ссылку и разреши доступ: {url}\n"
+        "2. Браузер перейдёт на адрес localhost, который не откроется — это нормально.\n"
+        "3. Скопируй адрес этой страницы целиком и пришли его сюда."
+    )
+    return ASK_LINK_CODE
+
+
+async def received_link_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    started, state, flow = _pending.pop(user_id, (0, None, None))
+    if flow is None or time.monotonic() - started > LINK_TIMEOUT:
+        await update.message.reply_text("⌛ Ссылка устарела. Начни заново: /link")
+        return ConversationHandler.END
+
+    code, returned_state = _extract_code(update.message.text)
+    if not code or (returned_state is not None and returned_state != state):
+        await update.message.reply_text("❌ Это не похоже на адрес из браузера. Начни заново: /link")
+        return ConversationHandler.END
+    try:
+        # Код одноразовый — сообщение с ним в чате больше не нужно
+        await update.message.delete()
+    except Exception:
+        pass
+
+    try:
+        await asyncio.to_thread(flow.fetch_token, code=code)
+    except Exception as e:
+        logging.warning(f"Не удалось подключить аккаунт пользователя {user_id}: {e}")
+        await update.effective_chat.send_message("❌ Google не принял код. Попробуй ещё раз: /link")
+        return ConversationHandler.END
+
+    await user_credentials.link(user_id, flow.credentials)
+    _forget(user_id)
+    await update.effective_chat.send_message("✅ Google-аккаунт подключён! Задачи и встречи теперь берутся из него.")
+    return ConversationHandler.END
+
+
+async def unlink(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    await user_credentials.unlink(user_id)
+    _forget(user_id)
+    await update.message.reply_text("🔌 Google-аккаунт отключён.")
+
+
+def _forget(user_id):
+    # Зеркала и кэш относятся к прежнему аккаунту
+    engine.forget(user_id)
+    task_cache.cache.invalidate(user_id)
@@ -0,0 +1,398 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import aclosing, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.error import BadRequest
+
+import metrics
+from outbound import TELEGRAM_LIMIT
+
+AI_MODEL = os.getenv("AI_MODEL", "distilgpt2")
+AI_MAX_NEW_TOKENS = int(os.getenv("AI_MAX_NEW_TOKENS", "100"))
+# Сколько генераций идёт одновременно на весь бот (для AI_BACKEND=local
+# вместо этого работает AI_MAX_BATCH).
+AI_CONCURRENCY = int(os.getenv("AI_CONCURRENCY", "4"))
+# Сколько запросов один пользователь может держать в очереди.
+AI_USER_QUEUE_LIMIT = int(os.getenv("AI_USER_QUEUE_LIMIT", "3"))
+# Не чаще одного редактирования сообщения за интервал (лимиты Telegram).
+EDIT_INTERVAL = float(os.getenv("AI_EDIT_INTERVAL", "1.0"))
+
+# remote — Hugging Face Inference API, local — модель в процессе на CPU.
+AI_BACKEND = os.getenv("AI_BACKEND", "remote")
+# Окно, в течение которого одновременные запросы собираются в один батч.
+AI_BATCH_WINDOW = float(os.getenv("AI_BATCH_WINDOW", "0.05"))
+AI_MAX_BATCH = int(os.getenv("AI_MAX_BATCH", "8"))
+# Кэш готовых ответов: время жизни и общий размер текстов в байтах.
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", "3600"))
+AI_CACHE_MAX_BYTES = int(os.getenv("AI_CACHE_MAX_BYTES", str(4 * 1024 * 1024)))
+
+
+class RemoteBackend:
+    batched = False
+
+    def __init__(self, model=AI_MODEL):
+        self.model = model
+        self._client = None
+
+    async def start(self):
+        pass
+
+    async def stream(self, prompt):
+        # Клиент создаётся при первом запросе /ai, а не при импорте бота.
+        if self._client is None:
+            from huggingface_hub import AsyncInferenceClient
+
+            self._client = AsyncInferenceClient(model=self.model, token=os.getenv("HF_TOKEN"))
+        stream = await self._client.text_generation(prompt, max_new_tokens=AI_MAX_NEW_TOKENS, stream=True)
+        async for token in stream:
+            yield token
+
+    async def close(self):
+        self._client = None
+
+
+class LocalBackend:
+    # Модель загружается один раз при старте и прогревается; запросы,
+    # пришедшие в пределах AI_BATCH_WINDOW, генерируются одним батчем.
+    batched = True
+
+    def __init__(self, model=AI_MODEL):
+        self.model_name = model
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ai-local")
+        self._tasks = []
+
+    def _load(self):
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        started = time.monotonic()
+        self._torch = torch
+        self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self._tokenizer.pad_token = self._tokenizer.eos_token
+        self._tokenizer.padding_side = "left"
+        # Длинный запрос обрезается слева: конец вопроса важнее начала
+        self._tokenizer.truncation_side = "left"
+        self._model = AutoModelForCausalLM.from_pretrained(self.model_name).eval()
+        context = getattr(self._model.config, "max_position_embeddings", None) or self._tokenizer.model_max_length
+        self._max_prompt_tokens = max(1, context - AI_MAX_NEW_TOKENS)
+        self._generate_batch(["Hello"])
+        metrics.set_gauge("ai_model_load_seconds", time.monotonic() - started)
+        logging.info(f"Локальная модель {self.model_name} загружена и прогрета")
+
+    def _generate_batch(self, prompts):
+        inputs = self._tokenizer(
+            prompts, return_tensors="pt", padding=True, truncation=True, max_length=self._max_prompt_tokens,
+        )
+        with self._torch.inference_mode():
+            output = self._model.generate(
+                **inputs,
+                max_new_tokens=AI_MAX_NEW_TOKENS,
+                do_sample=True,
+                top_p=0.95,
+                pad_token_id=self._tokenizer.eos_token_id,
+            )
+        generated = output[:, inputs["input_ids"].shape[1]:]
+        return self._tokenizer.batch_decode(generated, skip_special_tokens=True)
+
+    async def start(self):
+        # Загрузка идёт в фоне: остальные команды бота доступны сразу.
+        self._tasks.append(asyncio.create_task(self._load_and_serve()))
+
+    async def _load_and_serve(self):
+        loop = asyncio.get_running_loop()
+        load_error = None
+        try:
+            await loop.run_in_executor(self._executor, self._load)
+        except Exception as e:
+            # Без модели запросы /ai завершаются ошибкой, а не висят в очереди.
+            logging.error(f"Не удалось загрузить локальную модель {self.model_name}: {e}")
+            load_error = e
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + AI_BATCH_WINDOW
+            while len(batch) < AI_MAX_BATCH:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Отменённые через /cancel запросы в батч не попадают.
+            batch = [(prompt, future) for prompt, future in batch if not future.done()]
+            if not batch:
+                continue
+            metrics.inc("ai_local_batches")
+            metrics.set_gauge("ai_local_batch_size", len(batch))
+            try:
+                if load_error is not None:
+                    raise load_error
+                results = await loop.run_in_executor(
+                    self._executor, self._generate_batch, [prompt for prompt, _ in batch]
+                )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), text in zip(batch, results):
+                if not future.done():
+                    future.set_result(text)
+
+    async def stream(self, prompt):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((prompt, future))
+        yield await future
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = LocalBackend() if AI_BACKEND == "local" else RemoteBackend()
+    return _backend
+
+
+async def start():
+    await get_backend().start()
+
+
+async def stop():
+    if _backend is not None:
+        await _backend.close()
+
+
+async def stream_tokens(prompt):
+    async for token in get_backend().stream(prompt):
+        yield token
+
+
+def normalize_prompt(prompt):
+    return " ".join(prompt.casefold().split())
+
+
+class _Generation:
+    def __init__(self):
+        self.tokens = []
+        self.done = False
+        self.error = None
+        self.listeners = 0
+        self.changed = asyncio.Condition()
+        self.task = None
+
+
+class ResponseCache:
+    # Ответы хранятся по нормализованному промпту с вытеснением по LRU, TTL
+    # и общему размеру. Одинаковые промпты, пришедшие во время генерации,
+    # подписываются на уже идущую генерацию вместо запуска новой.
+    def __init__(self, ttl=AI_CACHE_TTL, max_bytes=AI_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._inflight = {}
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, text, size = entry
+        if expires < time.monotonic():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return text
+
+    def put(self, key, text):
+        size = len(text.encode())
+        if size > self.max_bytes:
+            return
+        self._drop(key)
+        self._entries[key] = (time.monotonic() + self.ttl, text, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            metrics.inc("ai_cache_evictions")
+        metrics.set_gauge("ai_cache_bytes", self._bytes)
+        metrics.set_gauge("ai_cache_entries", len(self._entries))
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    async def stream(self, prompt, produce):
+        key = normalize_prompt(prompt)
+        text = self.get(key)
+        if text is not None:
+            metrics.inc("ai_cache_hits")
+            yield text
+            return
+        generation = self._inflight.get(key)
+        if generation is None:
+            metrics.inc("ai_cache_misses")
+            generation = self._inflight[key] = _Generation()
+            generation.task = asyncio.create_task(self._produce(key, prompt, generation, produce))
+        else:
+            metrics.inc("ai_cache_coalesced")
+
+        generation.listeners += 1
+        seen = 0
+        try:
+            while True:
+                async with generation.changed:
+                    await generation.changed.wait_for(lambda: len(generation.tokens) > seen or generation.done)
+                    tokens = generation.tokens[seen:]
+                seen += len(tokens)
+                for token in tokens:
+                    yield token
+                if generation.done and seen == len(generation.tokens):
+                    if generation.error is not None:
+                        raise generation.error
+                    return
+        finally:
+            generation.listeners -= 1
+            # Если ответа больше никто не ждёт, генерацию можно прервать.
+            if generation.listeners == 0 and not generation.done:
+                generation.task.cancel()
+                if self._inflight.get(key) is generation:
+                    del self._inflight[key]
+
+    async def _produce(self, key, prompt, generation, produce):
+        try:
+            async for token in produce(prompt):
+                async with generation.changed:
+                    generation.tokens.append(token)
+                    generation.changed.notify_all()
+            text = "".join(generation.tokens).strip()
+            if text:
+                self.put(key, text)
+        except Exception as e:
+            generation.error = e
+        finally:
+            if self._inflight.get(key) is generation:
+                del self._inflight[key]
+            generation.done = True
+            async with generation.changed:
+                generation.changed.notify_all()
+
+    def stats(self):
+        snapshot = metrics.snapshot()["counters"]
+        hits = snapshot.get(("ai_cache_hits", ()), 0)
+        coalesced = snapshot.get(("ai_cache_coalesced", ()), 0)
+        misses = snapshot.get(("ai_cache_misses", ()), 0)
+        total = hits + coalesced + misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": int(hits),
+            "coalesced": int(coalesced),
+            "misses": int(misses),
+            "hit_rate": (hits + coalesced) / total if total else 0.0,
+        }
+
+
+response_cache = ResponseCache()
+
+
+class AIPipeline:
+    def __init__(self, concurrency=AI_CONCURRENCY, queue_limit=AI_USER_QUEUE_LIMIT):
+        self.queue_limit = queue_limit
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._user_locks = {}
+        self._tasks = {}
+
+    async def submit(self, user_id, prompt, message, application):
+        tasks = self._tasks.get(user_id, ())
+        if len(tasks) >= self.queue_limit:
+            await message.reply_text("⏳ Слишком много запросов в очереди. Дождись ответа или отправь /cancel.")
+            return
+        placeholder = await message.reply_text("⏳ В очереди..." if tasks else "🤖 Думаю...")
+        task = application.create_task(self._run(user_id, prompt, placeholder))
+        self._tasks.setdefault(user_id, set()).add(task)
+        task.add_done_callback(lambda done: self._finished(user_id, done))
+
+    def _finished(self, user_id, task):
+        # Очередь пользователя опустела — его записи больше не нужны
+        tasks = self._tasks.get(user_id)
+        if tasks is None:
+            return
+        tasks.discard(task)
+        if not tasks:
+            del self._tasks[user_id]
+            self._user_locks.pop(user_id, None)
+
+    def cancel(self, user_id):
+        tasks = self._tasks.get(user_id, ())
+        for task in list(tasks):
+            task.cancel()
+        return len(tasks)
+
+    async def _run(self, user_id, prompt, placeholder):
+        # Запросы одного пользователя выполняются по очереди.
+        lock = self._user_locks.setdefault(user_id, asyncio.Lock())
+        try:
+            async with lock:
+                metrics.inc("ai_requests")
+                await self._generate(prompt, placeholder)
+        except asyncio.CancelledError:
+            metrics.inc("ai_cancelled")
+            await _safe_edit(placeholder, "❌ Генерация отменена.")
+            raise
+        except Exception as e:
+            logging.error(f"Ошибка генерации ИИ: {e}")
+            metrics.inc("ai_errors")
+            await _safe_edit(placeholder, "⚠️ Не удалось получить ответ от ИИ. Попробуй позже.")
+
+    async def _upstream(self, prompt):
+        # Семафор ограничивает число одновременных генераций модели, а не
+        # число ожидающих ответа: ответы из кэша и подписки его не занимают.
+        # Локальная модель сама генерирует по одному батчу за раз, и семафор
+        # не дал бы батчу вырасти больше AI_CONCURRENCY, поэтому её он не касается.
+        async with nullcontext() if get_backend().batched else self._semaphore:
+            metrics.inc("ai_generations")
+            async for token in stream_tokens(prompt):
+                yield token
+
+    async def _generate(self, prompt, placeholder):
+        started = time.monotonic()
+        text = ""
+        shown = ""
+        last_edit = 0.0
+        async with aclosing(response_cache.stream(prompt, self._upstream)) as tokens:
+            async for token in tokens:
+                if not text:
+                    metrics.set_gauge("ai_first_token_seconds", time.monotonic() - started)
+                text += token
+                # Первый фрагмент показываем сразу, дальше — пачками раз в EDIT_INTERVAL.
+                if text.strip() and (not shown or time.monotonic() - last_edit >= EDIT_INTERVAL):
+                    shown = text[:TELEGRAM_LIMIT]
+                    await _safe_edit(placeholder, shown)
+                    last_edit = time.monotonic()
+        final = text.strip()[:TELEGRAM_LIMIT] or "🤷 ИИ ничего не ответил."
+        if final != shown:
+            await _safe_edit(placeholder, final)
+        metrics.set_gauge("ai_generation_seconds", time.monotonic() - started)
+
+
+async def _safe_edit(message, text):
+    try:
+        await message.edit_text(text)
+    except BadRequest as e:
+        # "Message is not modified" и пустой текст — не ошибки для пользователя.
+        logging.debug(f"Не удалось обновить сообщение ИИ: {e}")
+
+
+pipeline = AIPipeline()
@@ -1,32 +1,225 @@
-import os
-import pickle
+import asyncio
 import base64
 import io
-from google_auth_oauthlib.flow import InstalledAppFlow
+import json
+import logging
+import os
+import pickle
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from google.auth.exceptions import RefreshError
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 
+import metrics
+from token_store import TokenStore
+
 SCOPES = [
     "https://www.googleapis.com/auth/calendar",
     "https://www.googleapis.com/auth/tasks",
 ]
 
-def get_credentials():
-    creds = None
-    encoded_token = os.getenv("GOOGLE_TOKEN")
-    if encoded_token:
+# Обновляем токен заранее, чтобы обработчики не ждали refresh.
+REFRESH_MARGIN = timedelta(minutes=5)
+RETRY_DELAY = 60
+# Сколько расшифрованных учётных данных пользователей держать в памяти.
+TOKEN_CACHE_SIZE = int(os.getenv("GOOGLE_TOKEN_CACHE_SIZE", "1000"))
+
+
+class NotLinked(Exception):
+    pass
+
+
+def _needs_refresh(creds):
+    if not creds.valid:
+        return True
+    if creds.expiry is None:
+        return False
+    return creds.expiry - datetime.utcnow() < REFRESH_MARGIN
+
+
+class CredentialManager:
+    def __init__(self):
+        self._creds = None
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def _load(self):
+        encoded_token = os.getenv("GOOGLE_TOKEN")
+        if not encoded_token:
+            raise RuntimeError("GOOGLE_TOKEN не задан. Получите токен командой: python auth.py")
+        token_data = base64.b64decode(encoded_token)
+        self._creds = pickle.load(io.BytesIO(token_data))
+        logging.info("Токен Google загружен из GOOGLE_TOKEN")
+        return self._creds
+
+    async def get(self):
+        creds = self._creds or self._load()
+        if _needs_refresh(creds):
+            await self.refresh()
+        return self._creds
+
+    async def refresh(self):
+        # Single-flight: конкурентные вызовы ждут одно и то же обновление.
+        async with self._lock:
+            creds = self._creds or self._load()
+            if not _needs_refresh(creds):
+                return
+            if not creds.refresh_token:
+                raise RuntimeError("Токен Google истёк, а refresh_token отсутствует")
+            await asyncio.to_thread(creds.refresh, Request())
+            logging.info(f"Токен Google обновлён, действует до {creds.expiry}")
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await self.refresh()
+                delay = RETRY_DELAY
+                if self._creds.expiry is not None:
+                    left = self._creds.expiry - datetime.utcnow() - REFRESH_MARGIN
+                    delay = max(left.total_seconds(), RETRY_DELAY)
+            except Exception as e:
+                logging.error(f"Ошибка обновления токена: {e}")
+                delay = RETRY_DELAY
+            await asyncio.sleep(delay)
+
+    def start(self):
+        # Общий аккаунт из GOOGLE_TOKEN необязателен, если пользователи
+        # подключают свои через /link.
+        if self._task is None and os.getenv("GOOGLE_TOKEN"):
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Отметка в LRU для пользователей без подключённого аккаунта: повторные
+# запросы не ходят в хранилище, пока не будет /link.
+_NOT_LINKED = object()
+
+
+class UserCredentials:
+    # Учётные данные пользователей: LRU расшифрованных Credentials перед
+    # зашифрованным хранилищем. Для «горячего» пользователя запрос не
+    # трогает ни диск, ни расшифровку.
+    def __init__(self, store, size=TOKEN_CACHE_SIZE):
+        self.store = store
+        self.size = size
+        self._creds = OrderedDict()
+        self._loading = {}
+
+    def _remember(self, user_id, creds):
+        self._creds[user_id] = creds
+        self._creds.move_to_end(user_id)
+        while len(self._creds) > self.size:
+            self._creds.popitem(last=False)
+            metrics.inc("google_token_cache_evictions")
+
+    async def get(self, user_id):
+        creds = self._creds.get(user_id)
+        if creds is not None and (creds is _NOT_LINKED or not _needs_refresh(creds)):
+            self._creds.move_to_end(user_id)
+            metrics.inc("google_token_cache_hits")
+            return None if creds is _NOT_LINKED else creds
+        # Загрузка и обновление — по одному на пользователя: остальные
+        # запросы ждут ту же задачу, которая живёт только пока идёт загрузка.
+        task = self._loading.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load(user_id))
+            self._loading[user_id] = task
+            task.add_done_callback(lambda done: self._loaded(user_id, done))
+        return await asyncio.shield(task)
+
+    def _loaded(self, user_id, task):
+        if self._loading.get(user_id) is task:
+            del self._loading[user_id]
+
+    async def _load(self, user_id):
+        creds = self._creds.get(user_id)
+        if creds is None:
+            metrics.inc("google_token_cache_misses")
+            if not self.store.enabled:
+                return None
+            info = await asyncio.to_thread(self.store.load, user_id)
+            if user_id in self._creds:
+                # Пока читали хранилище, прошёл /link или /unlink
+                creds = self._creds[user_id]
+                return None if creds is _NOT_LINKED else creds
+            if info is None:
+                self._remember(user_id, _NOT_LINKED)
+                return None
+            creds = Credentials.from_authorized_user_info(info, SCOPES)
+            self._remember(user_id, creds)
+        if _needs_refresh(creds):
+            await self._refresh(user_id, creds)
+        return creds
+
+    async def _refresh(self, user_id, creds):
+        if not creds.refresh_token:
+            raise NotLinked()
         try:
-            token_data = base64.b64decode(encoded_token)
-            creds = pickle.load(io.BytesIO(token_data))
-        except Exception as e:
-            print(f"Ошибка загрузки токена: {e}")
-
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            creds_data = eval(os.getenv("GOOGLE_CREDENTIALS"))
-            flow = InstalledAppFlow.from_client_config(creds_data, SCOPES)
-            creds = flow.run_local_server(port=0)
-
-    return creds
+            await asyncio.to_thread(creds.refresh, Request())
+        except RefreshError as e:
+            # Доступ отозван в настройках Google-аккаунта.
+            logging.warning(f"Не удалось обновить токен пользователя {user_id}: {e}")
+            self._remember(user_id, _NOT_LINKED)
+            await asyncio.to_thread(self.store.delete, user_id)
+            raise NotLinked() from e
+        await asyncio.to_thread(self.store.save, user_id, json.loads(creds.to_json()))
+
+    async def link(self, user_id, creds):
+        await asyncio.to_thread(self.store.save, user_id, json.loads(creds.to_json()))
+        self._remember(user_id, creds)
+
+    async def unlink(self, user_id):
+        self._remember(user_id, _NOT_LINKED)
+        await asyncio.to_thread(self.store.delete, user_id)
+
+
+credential_manager = CredentialManager()
+user_credentials = UserCredentials(TokenStore())
+
+
+async def get_credentials(user_id=None):
+    # Свой аккаунт пользователя, а если он не подключён — общий из GOOGLE_TOKEN.
+    # Без хранилища токенов (TOKEN_STORE_KEY не задан) личных аккаунтов
+    # нет: кэш не трогаем, чтобы не засорять его и метрики промахами.
+    if user_id is not None and user_credentials.store.enabled:
+        creds = await user_credentials.get(user_id)
+        if creds is not None:
+            return creds
+    if os.getenv("GOOGLE_TOKEN"):
+        return await credential_manager.get()
+    raise NotLinked()
+
+
+def load_client_config():
+    # GOOGLE_CREDENTIALS — JSON клиента OAuth, как есть или в base64.
+    raw = os.getenv("GOOGLE_CREDENTIALS", "").strip()
+    if not raw.startswith("{"):
+        raw = base64.b64decode(raw).decode()
+    return json.loads(raw)
+
+
+def run_oauth_flow():
+    # Интерактивная авторизация: запускается вручную, не из обработчиков бота.
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
+    client_config = load_client_config()
+    flow = InstalledAppFlow.from_client_config(client_config, SCOPES)
+    creds = flow.run_local_server(port=0)
+    return base64.b64encode(pickle.dumps(creds)).decode()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    print("GOOGLE_TOKEN=" + run_oauth_flow())
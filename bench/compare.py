@@ -0,0 +1,44 @@
+import argparse
+import json
+import sys
+
+# Сравнение двух прогонов bench.run: изменение p50/p95/p99 по обработчикам.
+# Код возврата 1, если p95 какого-то обработчика вырос больше порога.
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение результатов bench.run")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.1, help="допустимый рост p95, доля")
+    args = parser.parse_args()
+
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)["handlers"]
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)["handlers"]
+
+    regressions = []
+    print(f"{'обработчик':<14} {'p50':>16} {'p95':>16} {'p99':>16}")
+    for label in sorted(set(base) & set(new)):
+        cells = []
+        for key in ("p50", "p95", "p99"):
+            before, after = base[label].get(key), new[label].get(key)
+            if not before or after is None:
+                cells.append(f"{'—':>16}")
+                continue
+            change = after / before - 1
+            cells.append(f"{after * 1000:>7.0f}мс {change:>+6.0%}")
+            if key == "p95" and change > args.threshold:
+                regressions.append(label)
+        print(f"{label:<14} " + " ".join(cells))
+    for label in sorted(set(base) ^ set(new)):
+        print(f"{label:<14} есть только в одном из прогонов")
+
+    if regressions:
+        print(f"Регрессия p95 больше {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import random
+import re
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from email.parser import BytesParser
+from urllib.parse import parse_qs
+
+import uvicorn
+
+# Фейковые Tasks API и Calendar API для бенчмарка. Бот направляется сюда
+# через GOOGLE_API_ROOT; задержка, доля ошибок и размеры списков задаются
+# в FakeGoogle. Данные одинаковые для всех пользователей и не меняются:
+# отметка задачи выполненной лишь возвращает её со статусом completed.
+
+MINSK = timezone(timedelta(hours=3))
+
+ROUTES = [
+    ("GET", re.compile(r"tasks/v1/lists/[^/]+/tasks$"), "tasks.list"),
+    ("POST", re.compile(r"tasks/v1/lists/[^/]+/tasks$"), "tasks.insert"),
+    ("PATCH", re.compile(r"tasks/v1/lists/[^/]+/tasks/([^/]+)$"), "tasks.patch"),
+    ("GET", re.compile(r"calendar/v3/calendars/[^/]+/events$"), "events.list"),
+    ("POST", re.compile(r"calendar/v3/calendars/[^/]+/events$"), "events.insert"),
+    ("POST", re.compile(r"calendar/v3/freeBusy$"), "freebusy.query"),
+    ("GET", re.compile(r"_stats$"), "stats"),
+]
+
+
+def _error(status, reason, message):
+    return status, {"error": {"code": status, "message": message, "errors": [{"reason": reason, "message": message}]}}
+
+
+class FakeGoogle:
+    def __init__(self, latency=0.05, error_rate=0.0, quota_rate=0.0, tasks=200, events=8, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.quota_rate = quota_rate
+        self.random = random.Random(seed)
+        self.requests = Counter()
+        self.errors = Counter()
+        self.tasks = self._make_tasks(tasks)
+        self.events = self._make_events(events)
+
+    def _make_tasks(self, count):
+        today = datetime.now(MINSK).date()
+        tasks = []
+        for i in range(count):
+            task = {"id": f"t{i}", "title": f"Задача {i}", "status": "needsAction"}
+            if i % 5:
+                due = today + timedelta(days=i % 29 - 14)
+                task["due"] = due.strftime("%Y-%m-%dT00:00:00.000Z")
+            tasks.append(task)
+        return tasks
+
+    def _make_events(self, count):
+        start = datetime.now(MINSK).replace(hour=9, minute=0, second=0, microsecond=0)
+        events = []
+        for i in range(count):
+            begin = start + timedelta(minutes=45 * i)
+            events.append({
+                "id": f"e{i}",
+                "summary": f"Встреча {i}",
+                "status": "confirmed",
+                "start": {"dateTime": begin.isoformat()},
+                "end": {"dateTime": (begin + timedelta(minutes=30)).isoformat()},
+            })
+        return events
+
+    def _page(self, items, query, extra=None):
+        offset = int(query.get("pageToken", ["0"])[0])
+        size = int(query.get("maxResults", ["100"])[0])
+        result = {"items": items[offset:offset + size]}
+        if offset + size < len(items):
+            result["nextPageToken"] = str(offset + size)
+        elif extra:
+            result.update(extra)
+        return result
+
+    def handle(self, method, path, query, body):
+        for route_method, pattern, name in ROUTES:
+            match = pattern.match(path)
+            if route_method == method and match:
+                break
+        else:
+            return _error(404, "notFound", f"{method} {path}")
+        self.requests[name] += 1
+
+        if name == "stats":
+            return 200, {"requests": dict(self.requests), "errors": dict(self.errors)}
+        roll = self.random.random()
+        if roll < self.quota_rate:
+            self.errors[name] += 1
+            return _error(429, "rateLimitExceeded", "Rate Limit Exceeded")
+        if roll < self.quota_rate + self.error_rate:
+            self.errors[name] += 1
+            return _error(503, "backendError", "Backend Error")
+
+        if name == "tasks.list":
+            # Дельта по updatedMin пуста: данные фейка не меняются.
+            return 200, self._page([] if "updatedMin" in query else self.tasks, query)
+        if name == "events.list":
+            if "syncToken" in query:
+                return 200, {"items": [], "nextSyncToken": "sync"}
+            return 200, self._page(self.events, query, {"nextSyncToken": "sync"})
+        if name in ("tasks.insert", "events.insert"):
+            item = {"id": f"new{sum(self.requests.values())}", **json.loads(body or b"{}")}
+            if item.get("due"):
+                # Tasks API хранит только дату и отдаёт её с миллисекундами
+                item["due"] = item["due"][:10] + "T00:00:00.000Z"
+            return 200, item
+        if name == "freebusy.query":
+            busy = [{"start": event["start"]["dateTime"], "end": event["end"]["dateTime"]} for event in self.events]
+            request = json.loads(body or b"{}")
+            return 200, {"calendars": {item["id"]: {"busy": busy} for item in request.get("items", [])}}
+        if name == "tasks.patch":
+            return 200, {"id": match.group(1), "title": match.group(1), **json.loads(body or b"{}")}
+        return 400, {}
+
+    def handle_batch(self, content_type, body):
+        # multipart/mixed из application/http частей, как у BatchHttpRequest
+        message = BytesParser().parsebytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+        boundary = "batch_fake"
+        parts = []
+        for part in message.get_payload():
+            request = part.get_payload(decode=False)
+            head, _, part_body = request.partition("\r\n\r\n") if "\r\n\r\n" in request else request.partition("\n\n")
+            method, target, _ = head.splitlines()[0].split(" ", 2)
+            path, _, raw_query = target.lstrip("/").partition("?")
+            status, payload = self.handle(method, path, parse_qs(raw_query), part_body.encode())
+            content_id = part["Content-ID"].strip()[1:-1]
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n\r\n{json.dumps(payload)}\r\n"
+            )
+        return f"multipart/mixed; boundary={boundary}", ("".join(parts) + f"--{boundary}--\r\n").encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        body = b""
+        while True:
+            event = await receive()
+            body += event.get("body", b"")
+            if not event.get("more_body"):
+                break
+        if self.latency:
+            await asyncio.sleep(self.latency * self.random.uniform(0.5, 1.5))
+
+        path = scope["path"].lstrip("/")
+        headers = dict(scope["headers"])
+        if scope["method"] == "POST" and path.startswith("batch"):
+            self.requests["batch"] += 1
+            content_type, payload = self.handle_batch(headers.get(b"content-type", b"").decode(), body)
+            status = 200
+        else:
+            status, data = self.handle(scope["method"], path, parse_qs(scope["query_string"].decode()), body)
+            content_type, payload = "application/json", json.dumps(data).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(payload)).encode())],
+        })
+        await send({"type": "http.response.body", "body": payload})
+
+
+def serve(port, **options):
+    # Точка входа отдельного процесса, чтобы фейк не делил GIL с ботом.
+    uvicorn.run(FakeGoogle(**options), host="127.0.0.1", port=port, log_level="warning", lifespan="off")
@@ -0,0 +1,72 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from urllib.parse import parse_qs
+
+# Фейковый Bot API для бенчмарка. Бот направляется сюда через
+# TELEGRAM_BASE_URL. Сервер работает в том же event loop, что и драйвер:
+# каждое сообщение бота передаётся в on_call(chat_id, method, text, время).
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+
+class FakeTelegram:
+    def __init__(self, on_call, latency=0.02, flood_rate=0.0, seed=0):
+        self.on_call = on_call
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.random = random.Random(seed)
+        self.requests = Counter()
+        self._message_id = 0
+
+    def _message(self, params):
+        self._message_id += 1
+        return {
+            "message_id": int(params.get("message_id", self._message_id)),
+            "date": int(time.time()),
+            "chat": {"id": int(params["chat_id"]), "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+
+    def handle(self, method, params):
+        self.requests[method] += 1
+        if method == "getMe":
+            return BOT_USER
+        if method in ("sendMessage", "editMessageText"):
+            self.on_call(int(params["chat_id"]), method, params.get("text", ""), time.perf_counter())
+            return self._message(params)
+        return True
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        body = b""
+        while True:
+            event = await receive()
+            body += event.get("body", b"")
+            if not event.get("more_body"):
+                break
+        if self.latency:
+            await asyncio.sleep(self.latency * self.random.uniform(0.5, 1.5))
+
+        method = scope["path"].rsplit("/", 1)[-1]
+        # PTB отправляет параметры формой, значения сложных типов — в JSON
+        params = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+        if method != "getMe" and self.random.random() < self.flood_rate:
+            self.requests["flood"] += 1
+            status, data = 429, {
+                "ok": False, "error_code": 429,
+                "description": "Too Many Requests: retry after 1", "parameters": {"retry_after": 1},
+            }
+        else:
+            status, data = 200, {"ok": True, "result": self.handle(method, params)}
+        payload = json.dumps(data).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())],
+        })
+        await send({"type": "http.response.body", "body": payload})
@@ -0,0 +1,318 @@
+import argparse
+import asyncio
+import base64
+import json
+import multiprocessing
+import os
+import pickle
+import random
+import socket
+import statistics
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+# Нагрузочный прогон бота на локальных фейках Bot API и Google API:
+#
+#   python -m bench.run --rate 5 --duration 60 --tasks 500 --output before.json
+#   python -m bench.compare before.json after.json
+#
+# Сессии пользователей (/today, /listtasks, диалог /done, /addtask одной
+# строкой — в --mix, например today=5,addtask=1) стартуют с
+# заданной частотой (пуассоновский поток) и идут шаг за шагом. Задержка
+# шага — от отправки обновления до последнего сообщения бота в этот чат;
+# шаг считается завершённым, когда чат молчит --settle секунд (больше
+# паузы лимитера чата в outbound.py, иначе ответ разрежется на два шага).
+
+SESSIONS = {
+    "today": [("/today", "today")],
+    "listtasks": [("/listtasks", "listtasks")],
+    "done": [("/done", "done"), ("1", "done_select")],
+    "addtask": [("/addtask Купить молоко завтра", "addtask")],
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота на фейковых Telegram и Google")
+    parser.add_argument("--rate", type=float, default=5, help="новых сессий в секунду")
+    parser.add_argument("--duration", type=float, default=30, help="сколько секунд запускать новые сессии")
+    parser.add_argument("--users", type=int, default=50, help="размер пула пользователей")
+    parser.add_argument("--mix", default="today=5,listtasks=3,done=2", help="веса сценариев")
+    parser.add_argument("--think", type=float, default=0.5, help="пауза пользователя между шагами, с")
+    parser.add_argument("--settle", type=float, default=1.2, help="тишина в чате, после которой шаг завершён, с")
+    parser.add_argument("--step-timeout", type=float, default=30)
+    parser.add_argument("--tasks", type=int, default=200, help="задач в списке пользователя")
+    parser.add_argument("--events", type=int, default=8, help="встреч на сегодня")
+    parser.add_argument("--google-latency", type=float, default=0.08)
+    parser.add_argument("--google-error-rate", type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument("--google-quota-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    parser.add_argument("--telegram-flood-rate", type=float, default=0.0, help="доля ответов 429 от Bot API")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="файл JSON с результатами")
+    return parser.parse_args()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _fake_token():
+    # Настоящие Credentials с долгоживущим токеном: бот не ходит за refresh.
+    from google.oauth2.credentials import Credentials
+
+    creds = Credentials(token="bench", expiry=datetime.utcnow() + timedelta(days=1))
+    return base64.b64encode(pickle.dumps(creds)).decode()
+
+
+def configure(args, telegram_port, google_port):
+    # Модули бота читают настройки при импорте, поэтому окружение
+    # готовится до import bot.
+    os.environ.update({
+        "TELEGRAM_TOKEN": "1:bench",
+        "TELEGRAM_BASE_URL": f"http://127.0.0.1:{telegram_port}/bot",
+        "GOOGLE_API_ROOT": f"http://127.0.0.1:{google_port}/",
+        "GOOGLE_TOKEN": _fake_token(),
+        "TOKEN_STORE_KEY": "",
+        "PERSISTENCE": "none",
+    })
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+    cuts = statistics.quantiles(values, n=100, method="inclusive") if len(values) > 1 else [values[0]] * 99
+    return {
+        "mean": statistics.fmean(values),
+        "p50": cuts[49],
+        "p95": cuts[94],
+        "p99": cuts[98],
+        "max": values[-1],
+    }
+
+
+def _failed(text):
+    # Ошибка может быть не первой строкой: в отчёте /done и /addtask о
+    # нескольких задачах это «❌ <название>», в /today — «⚠️» внутри раздела
+    return any(line.startswith(("⚠️", "❌")) for line in text.splitlines())
+
+
+class Chat:
+    def __init__(self):
+        self.calls = []
+        self.changed = asyncio.Event()
+
+    def record(self, method, text, at):
+        self.calls.append((at, method, text))
+        self.changed.set()
+
+
+class Driver:
+    def __init__(self, app, args):
+        self.app = app
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.chats = defaultdict(Chat)
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.timeouts = defaultdict(int)
+        self.sessions_started = 0
+        self.sessions_completed = 0
+        self._update_id = 0
+        self._users = asyncio.Queue()
+        for user_id in range(1000, 1000 + args.users):
+            self._users.put_nowait(user_id)
+        self._mix = []
+        for item in args.mix.split(","):
+            name, _, weight = item.partition("=")
+            self._mix.append((name.strip(), float(weight or 1)))
+
+    def on_call(self, chat_id, method, text, at):
+        self.chats[chat_id].record(method, text, at)
+
+    async def send(self, user_id, text):
+        from telegram import Update
+
+        self._update_id += 1
+        message = {
+            "message_id": self._update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        await self.app.update_queue.put(Update.de_json({"update_id": self._update_id, "message": message}, self.app.bot))
+
+    async def step(self, user_id, text, label):
+        chat = self.chats[user_id]
+        mark = len(chat.calls)
+        started = time.perf_counter()
+        await self.send(user_id, text)
+        deadline = started + self.args.step_timeout
+        while True:
+            chat.changed.clear()
+            waiting = self.args.settle if len(chat.calls) > mark else deadline - time.perf_counter()
+            try:
+                await asyncio.wait_for(chat.changed.wait(), max(waiting, 0))
+            except asyncio.TimeoutError:
+                break
+        replies = chat.calls[mark:]
+        if not replies:
+            self.timeouts[label] += 1
+            return False
+        self.samples[label].append(replies[-1][0] - started)
+        if any(_failed(text) for _, _, text in replies):
+            self.errors[label] += 1
+        return True
+
+    async def session(self, name):
+        user_id = await self._users.get()
+        self.sessions_started += 1
+        try:
+            for i, (text, label) in enumerate(SESSIONS[name]):
+                if i:
+                    await asyncio.sleep(self.args.think)
+                if not await self.step(user_id, text, label):
+                    # Без ответа диалог мог остаться открытым
+                    await self.step(user_id, "/cancel", "cancel")
+                    return
+            self.sessions_completed += 1
+        finally:
+            self._users.put_nowait(user_id)
+
+    async def run(self):
+        names = [name for name, _ in self._mix]
+        weights = [weight for _, weight in self._mix]
+        sessions = []
+        started = time.perf_counter()
+        while time.perf_counter() - started < self.args.duration:
+            name = self.random.choices(names, weights)[0]
+            sessions.append(asyncio.create_task(self.session(name)))
+            await asyncio.sleep(self.random.expovariate(self.args.rate))
+        await asyncio.gather(*sessions)
+        return time.perf_counter() - started
+
+
+def _google_stats(port):
+    import urllib.request
+
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stats", timeout=5) as response:
+        return json.load(response)
+
+
+def _counters():
+    import metrics
+
+    totals = defaultdict(float)
+    for (name, _), value in metrics.snapshot()["counters"].items():
+        totals[name] += value
+    return dict(sorted(totals.items()))
+
+
+def _spans():
+    # Среднее время по гистограммам спанов: куда уходит время обработчиков.
+    import metrics
+
+    spans = {}
+    for (name, labels), (_, total, count) in sorted(metrics.snapshot()["histograms"].items()):
+        key = name + "{" + ",".join(f"{label}={value}" for label, value in labels if value) + "}"
+        spans[key] = {"count": count, "mean": total / count}
+    return spans
+
+
+async def main(args):
+    import uvicorn
+
+    from bench.fake_google import serve
+    from bench.fake_telegram import FakeTelegram
+
+    telegram_port, google_port = _free_port(), _free_port()
+    google = multiprocessing.get_context("spawn").Process(target=serve, args=(google_port,), kwargs={
+        "latency": args.google_latency,
+        "error_rate": args.google_error_rate,
+        "quota_rate": args.google_quota_rate,
+        "tasks": args.tasks,
+        "events": args.events,
+        "seed": args.seed,
+    }, daemon=True)
+    google.start()
+
+    configure(args, telegram_port, google_port)
+    from bot import build_application
+
+    app = build_application(updater=False)
+    driver = Driver(app, args)
+    telegram = FakeTelegram(driver.on_call, args.telegram_latency, args.telegram_flood_rate, args.seed)
+    server = uvicorn.Server(uvicorn.Config(
+        telegram, host="127.0.0.1", port=telegram_port, log_level="warning", lifespan="off",
+    ))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    for _ in range(100):
+        try:
+            _google_stats(google_port)
+            break
+        except OSError:
+            await asyncio.sleep(0.1)
+
+    await app.initialize()
+    await app.post_init(app)
+    await app.start()
+    try:
+        wall = await driver.run()
+        google_stats = _google_stats(google_port)
+    finally:
+        await app.stop()
+        await app.shutdown()
+        await app.post_shutdown(app)
+        server.should_exit = True
+        await server_task
+        google.terminate()
+
+    steps = sum(len(samples) for samples in driver.samples.values())
+    report = {
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "config": vars(args),
+        "duration_seconds": wall,
+        "sessions": {"started": driver.sessions_started, "completed": driver.sessions_completed},
+        "throughput": {"steps_per_second": steps / wall, "sessions_per_second": driver.sessions_completed / wall},
+        "handlers": {
+            label: {
+                "count": len(driver.samples[label]),
+                "errors": driver.errors[label],
+                "timeouts": driver.timeouts[label],
+                **percentiles(driver.samples[label]),
+            }
+            for label in sorted(set(driver.samples) | set(driver.timeouts))
+        },
+        "google_requests": google_stats,
+        "telegram_requests": dict(telegram.requests),
+        "metrics": _counters(),
+        "spans": _spans(),
+    }
+    return report
+
+
+def print_report(report):
+    print(f"Сессий: {report['sessions']['completed']}/{report['sessions']['started']}, "
+          f"{report['throughput']['steps_per_second']:.1f} шагов/с за {report['duration_seconds']:.1f} с")
+    print(f"{'обработчик':<14} {'шагов':>6} {'ошибок':>7} {'таймаут':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for label, stats in report["handlers"].items():
+        print(f"{label:<14} {stats['count']:>6} {stats['errors']:>7} {stats['timeouts']:>8} "
+              f"{stats.get('p50', 0) * 1000:>7.0f}мс {stats.get('p95', 0) * 1000:>6.0f}мс {stats.get('p99', 0) * 1000:>6.0f}мс")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = asyncio.run(main(args))
+    print_report(report)
+    output = args.output or f"bench-{datetime.now():%Y%m%d-%H%M%S}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты: {output}")
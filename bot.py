@@ -1,439 +1,160 @@
 # bot.py
+import time
+
+# Точка отсчёта для метрик холодного старта — до всех тяжёлых импортов.
+STARTED_AT = time.monotonic()
+
+import asyncio
 import logging
-import pickle
 import os
-import io
-import base64
-from datetime import datetime, timedelta, timezone
-import pytz
+import sys
 
-from telegram import Update, ReplyKeyboardMarkup
-from telegram.ext import (
-    ApplicationBuilder, CommandHandler, ContextTypes,
-    MessageHandler, filters, ConversationHandler
-)
-
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from dotenv import load_dotenv
 
-# Импорт нового клиента для Inference от Hugging Face
-from huggingface_hub import InferenceClient
-
+# Настройки модулей читаются из окружения при импорте, поэтому .env
+# загружается до них.
 load_dotenv()
-logging.basicConfig(level=logging.INFO)
-
-ASK_TASK_TEXT = 0
-ASK_TASK_DATE = 1
-ASK_TASK_DURATION = 2
-ASK_DONE_INDEX = 3
-ASK_EVENT_TITLE = 4
-ASK_EVENT_DATE = 5
-ASK_EVENT_START = 6
-ASK_EVENT_END = 7
-
-SCOPES = [
-    "https://www.googleapis.com/auth/calendar",
-    "https://www.googleapis.com/auth/tasks",
-]
-
-MINSK_TZ = pytz.timezone("Europe/Minsk")
-RUSSIAN_WEEKDAYS = {
-    'Monday': 'Понедельник',
-    'Tuesday': 'Вторник',
-    'Wednesday': 'Среда',
-    'Thursday': 'Четверг',
-    'Friday': 'Пятница',
-    'Saturday': 'Суббота',
-    'Sunday': 'Воскресенье',
-}
-
-def format_russian_date(date_obj):
-    weekday = RUSSIAN_WEEKDAYS[date_obj.strftime("%A")]
-    return f"{weekday} ({date_obj.strftime('%d.%m')})"
-
-def get_credentials():
-    creds = None
-    encoded_token = os.getenv("GOOGLE_TOKEN")
-    if encoded_token:
-        try:
-            token_data = base64.b64decode(encoded_token)
-            creds = pickle.load(io.BytesIO(token_data))
-        except Exception as e:
-            logging.error(f"Ошибка загрузки токена: {e}")
-    if not creds:
-        flow = InstalledAppFlow.from_client_config(
-            eval(os.getenv("GOOGLE_CREDENTIALS")), SCOPES
-        )
-        creds = flow.run_local_server(port=0)
-    return creds
-
-async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("❌ Действие отменено.")
-    return ConversationHandler.END
-
-async def list_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    creds = get_credentials()
-    service = build("tasks", "v1", credentials=creds)
-    results = service.tasks().list(tasklist='@default', showCompleted=False).execute()
-    items = results.get('items', [])
-
-    if not items:
-        await update.message.reply_text("🎉 У тебя нет активных задач.")
-        return
-
-    grouped = {}
-    for task in items:
-        due = task.get('due')
-        try:
-            if due:
-                due_dt = datetime.strptime(due, "%Y-%m-%dT%H:%M:%S.%fZ").replace(
-                    tzinfo=timezone.utc
-                ).astimezone(MINSK_TZ)
-                key = due_dt.date()
-            else:
-                key = "Без даты"
-        except Exception:
-            key = "Без даты"
-
-        grouped.setdefault(key, []).append(task)
-
-    lines = ["📝 Твои задачи:"]
-    for key in sorted(grouped.keys()):
-        if key == "Без даты":
-            lines.append("📅 Без даты:")
-        else:
-            weekday = RUSSIAN_WEEKDAYS[datetime.combine(key, datetime.min.time()).strftime("%A")]
-            lines.append(f"\n📅 {weekday} ({key.strftime('%d.%m')}):")
-
-        for task in grouped[key]:
-            line = f"• {task['title']}"
-            if task.get("notes"):
-                line += f" — {task['notes']}"
-            lines.append(line)
-
-    await update.message.reply_text("\n".join(lines))
-
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    menu = """👋 Привет! Я бот-планировщик. Вот что я умею:
-
-📝 /addtask — добавить задачу с датой и временем
-📋 /listtasks — показать список всех активных задач
-✅ /done — выбрать и отметить задачу как выполненную
-📅 /addevent — запланировать встречу в Google Календарь
-📆 /today — показать задачи и встречи на сегодня
-⏰ /overdue — показать просроченные задачи
-🤖 /ai — общаться с ИИ (через Hugging Face Inference API)
-❌ /cancel — отменить текущую операцию
-"""
-    keyboard = [["📝 Добавить задачу", "📋 Показать задачи"],
-                ["✅ Завершить задачу", "📅 Добавить встречу"],
-                ["📆 Сегодня", "⏰ Просроченные"],
-                ["❌ Отменить"]]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    await update.message.reply_text(menu + "\n\nВыберите действие с помощью кнопок ниже:", reply_markup=reply_markup)
-
-async def addtask_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("📝 Введи текст задачи:")
-    return ASK_TASK_TEXT
-
-async def received_task_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data['task_title'] = update.message.text
-    await update.message.reply_text("📅 Укажи дату (в формате ДД.ММ.ГГГГ):")
-    return ASK_TASK_DATE
-
-async def received_task_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        date = datetime.strptime(update.message.text, "%d.%m.%Y")
-        context.user_data['task_due'] = date.isoformat() + "Z"
-        await update.message.reply_text("⏱ Сколько времени планируешь на выполнение? (например: 1 час, 30 минут)")
-        return ASK_TASK_DURATION
-    except ValueError:
-        await update.message.reply_text("❌ Неверный формат. Попробуй снова: ДД.ММ.ГГГГ")
-        return ASK_TASK_DATE
-
-async def received_task_duration(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    duration = update.message.text
-    creds = get_credentials()
-    service = build("tasks", "v1", credentials=creds)
-    task = {
-        "title": context.user_data['task_title'],
-        "due": context.user_data['task_due'],
-        "notes": f"Планируемое время: {duration}"
-    }
-    service.tasks().insert(tasklist='@default', body=task).execute()
-    await update.message.reply_text("✅ Задача добавлена!")
-    return ConversationHandler.END
-
-async def done_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    creds = get_credentials()
-    service = build("tasks", "v1", credentials=creds)
-    result = service.tasks().list(tasklist='@default', showCompleted=False).execute()
-    items = result.get('items', [])
-    if not items:
-        await update.message.reply_text("❌ Нет активных задач для завершения.")
-        return ConversationHandler.END
-    context.user_data['tasks'] = items
-    message = "Выбери номер задачи, которую хочешь завершить:\n"
-    for idx, task in enumerate(items, 1):
-        message += f"{idx}. {task['title']}\n"
-    await update.message.reply_text(message)
-    return ASK_DONE_INDEX
-
-async def mark_selected_done(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        index = int(update.message.text) - 1
-        items = context.user_data.get('tasks', [])
-        if 0 <= index < len(items):
-            task = items[index]
-            task['status'] = 'completed'
-            creds = get_credentials()
-            service = build("tasks", "v1", credentials=creds)
-            service.tasks().update(tasklist='@default', task=task['id'], body=task).execute()
-            await update.message.reply_text(f"✅ Задача завершена: {task['title']}")
-        else:
-            await update.message.reply_text("❌ Неверный номер. Попробуй снова.")
-            return ASK_DONE_INDEX
-    except ValueError:
-        await update.message.reply_text("❌ Введи номер задачи.")
-        return ASK_DONE_INDEX
-    return ConversationHandler.END
-
-async def today_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    creds = get_credentials()
-    now = datetime.now(MINSK_TZ)
-    today_start = datetime(now.year, now.month, now.day, tzinfo=MINSK_TZ)
-    today_end = today_start + timedelta(days=1)
-
-    formatted_today = format_russian_date(today_start)
-    lines = [f"📆 Сегодня: {formatted_today}"]
 
-    task_service = build("tasks", "v1", credentials=creds)
-    result = task_service.tasks().list(tasklist='@default', showCompleted=False).execute()
-    tasks = result.get('items', [])
+from telegram import Update
+from telegram.ext import ApplicationBuilder, ContextTypes, TypeHandler
+
+import ai
+import digest
+import google_executor
+import google_services
+import metrics
+import tracing
+from accounts import LINK_HINT
+from auth import NotLinked, credential_manager, user_credentials
+from google_executor import GoogleUnavailable
+from handlers import setup_handlers
+from outbound import OutboundLimiter
+from persistence import build_persistence
 
-    today_tasks = []
-    for task in tasks:
-        due = task.get("due")
-        if due:
-            try:
-                due_dt = datetime.strptime(due, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc).astimezone(MINSK_TZ)
-                if today_start <= due_dt < today_end:
-                    line = f"• {task['title']}"
-                    if task.get("notes"):
-                        line += f" — {task['notes']}"
-                    today_tasks.append(line)
-            except Exception as e:
-                logging.warning(f"Ошибка в обработке задачи: {e}")
-
-    lines.append("\n📝 Задачи:")
-    lines.extend(today_tasks or ["Нет задач на сегодня."])
-
-    calendar_service = build("calendar", "v3", credentials=creds)
-    events_result = calendar_service.events().list(
-        calendarId='primary',
-        timeMin=today_start.isoformat(),
-        timeMax=today_end.isoformat(),
-        singleEvents=True,
-        orderBy='startTime'
-    ).execute()
-    events = events_result.get('items', [])
-
-    lines.append("\n🕒 Встречи:")
-    if events:
-        for event in events:
-            start = event['start'].get('dateTime', event['start'].get('date'))
-            summary = event.get('summary', 'Без названия')
-            if 'T' in start:
-                start_time = datetime.fromisoformat(start).astimezone(MINSK_TZ)
-                lines.append(f"• {summary} в {start_time.strftime('%H:%M')}")
-            else:
-                lines.append(f"• {summary}")
-    else:
-        lines.append("Нет встреч на сегодня.")
-
-    await update.message.reply_text("\n".join(lines))
-
-async def overdue_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    creds = get_credentials()
-    now = datetime.now(MINSK_TZ)
-    service = build("tasks", "v1", credentials=creds)
-    result = service.tasks().list(tasklist='@default', showCompleted=False).execute()
-    tasks = result.get('items', [])
-
-    grouped_tasks = {}
-
-    for task in tasks:
-        due = task.get("due")
-        if due:
-            try:
-                due_dt = datetime.strptime(due, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc).astimezone(MINSK_TZ)
-                if due_dt < now:
-                    key = due_dt.date()
-                    if key not in grouped_tasks:
-                        grouped_tasks[key] = []
-                    task_line = f"• {task['title']}"
-                    if task.get("notes"):
-                        task_line += f" — {task['notes']}"
-                    grouped_tasks[key].append(task_line)
-            except Exception as e:
-                logging.warning(f"Ошибка в overdue: {e}")
-                continue
-
-    if not grouped_tasks:
-        await update.message.reply_text("✅ У тебя нет просроченных задач!")
-        return
-
-    lines = ["⏰ Просроченные задачи:"]
-    for date in sorted(grouped_tasks.keys()):
-        lines.append(f"\n{format_russian_date(datetime.combine(date, datetime.min.time()))}")
-        lines.extend(grouped_tasks[date])
-
-    await update.message.reply_text("\n".join(lines))
+logging.basicConfig(level=logging.INFO)
 
-async def addevent_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("📌 Введи название встречи:")
-    return ASK_EVENT_TITLE
+# Адрес Bot API: свой сервер telegram-bot-api или фейковый из bench/.
+TELEGRAM_BASE_URL = os.getenv("TELEGRAM_BASE_URL", "")
 
-async def received_event_title(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = update.message.text.strip()
-    if text:
-        context.user_data['event_title'] = text
-        await update.message.reply_text("📅 Укажи дату встречи (ДД.ММ.ГГГГ):")
-        return ASK_EVENT_DATE
-    else:
-        await update.message.reply_text("❌ Название не может быть пустым. Введи ещё раз:")
-        return ASK_EVENT_TITLE
+_preload_task = None
 
-async def received_event_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = update.message.text.strip()
+async def _preload_google():
     try:
-        parsed_date = datetime.strptime(text, "%d.%m.%Y")
-        context.user_data['event_date'] = parsed_date.strftime("%d.%m.%Y")
-        await update.message.reply_text("🕒 Укажи время начала (например: 14:30):")
-        return ASK_EVENT_START
-    except ValueError:
-        await update.message.reply_text("❌ Неверный формат даты. Попробуй снова: ДД.ММ.ГГГГ")
-        return ASK_EVENT_DATE
-
-async def received_event_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data['event_start'] = update.message.text
-    await update.message.reply_text("🕕 Укажи время окончания (например: 15:30):")
-    return ASK_EVENT_END
-
-async def received_event_end(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        title = context.user_data['event_title']
-        date = context.user_data['event_date']
-        start_time = context.user_data['event_start']
-        end_time = update.message.text
-
-        start_dt = datetime.strptime(f"{date} {start_time}", "%d.%m.%Y %H:%M")
-        end_dt = datetime.strptime(f"{date} {end_time}", "%d.%m.%Y %H:%M")
-
-        event = {
-            'summary': title,
-            'start': {'dateTime': start_dt.isoformat(), 'timeZone': 'Europe/Minsk'},
-            'end': {'dateTime': end_dt.isoformat(), 'timeZone': 'Europe/Minsk'},
-            'description': 'Добавлено через Telegram-бота'
-        }
-
-        creds = get_credentials()
-        service = build("calendar", "v3", credentials=creds)
-        service.events().insert(calendarId='primary', body=event).execute()
-
-        await update.message.reply_text(f"✅ Встреча '{title}' добавлена в календарь!")
+        await asyncio.to_thread(google_services.preload)
     except Exception as e:
-        await update.message.reply_text(f"❌ Ошибка при добавлении события: {e}")
-    return ConversationHandler.END
-
-# --- Интеграция Hugging Face Inference API с новым InferenceClient ---
-inference_client = InferenceClient(model="distilgpt2")
-
-def generate_ai_response(prompt, max_length=100):
-    # Используем метод text_generation
-    response = inference_client.text_generation(prompt, parameters={"max_new_tokens": max_length})
-    if isinstance(response, dict):
-        generated_text = response.get("generated_text", "")
-    elif isinstance(response, list) and len(response) > 0:
-        generated_text = response[0].get("generated_text", "")
+        # Не страшно: клиент загрузится при первом запросе
+        logging.warning(f"Не удалось заранее загрузить клиент Google API: {e}")
+
+async def on_startup(app):
+    credential_manager.start()
+    await metrics.start_server()
+    await ai.start()
+    digest.scheduler.restore(app)
+    # Клиент Google API догружается в фоне, пока бот уже принимает обновления.
+    # Application ещё не запущен, поэтому задача создаётся прямо в loop.
+    global _preload_task
+    _preload_task = asyncio.get_running_loop().create_task(_preload_google())
+    metrics.set_gauge("startup_ready_seconds", time.monotonic() - STARTED_AT)
+
+_first_update_seen = False
+
+async def record_first_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    global _first_update_seen
+    if not _first_update_seen:
+        _first_update_seen = True
+        elapsed = time.monotonic() - STARTED_AT
+        metrics.set_gauge("startup_first_update_seconds", elapsed)
+        logging.info(f"Первое обновление обработано через {elapsed:.2f} с после запуска")
+
+async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE):
+    # Пользователь видит понятное сообщение, подробности — только в логе
+    logging.error("Ошибка при обработке обновления", exc_info=context.error)
+    if not isinstance(update, Update) or update.effective_message is None:
+        return
+    if isinstance(context.error, NotLinked):
+        text = LINK_HINT
+    elif isinstance(context.error, GoogleUnavailable):
+        text = "⚠️ Google сейчас перегружен, а сохранённых данных пока нет. Попробуй через минуту."
     else:
-        generated_text = ""
-    return generated_text
-
-async def ai_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = update.message.text
-    prompt = text[3:].strip() if text.startswith("/ai") else text.strip()
-    if not prompt:
-        await update.message.reply_text("Введите сообщение после команды /ai для общения с ИИ.")
+        text = "❌ Что-то пошло не так. Попробуй ещё раз позже."
+    await update.effective_message.reply_text(text)
+
+async def on_shutdown(app):
+    if _preload_task is not None:
+        # Поток загрузки не прервать — дожидаемся его до остановки пула
+        await _preload_task
+    await credential_manager.stop()
+    user_credentials.store.close()
+    await ai.stop()
+    google_executor.shutdown()
+    await metrics.stop_server()
+    tracing.close()
+
+def build_application(updater=True):
+    builder = (
+        ApplicationBuilder()
+        .token(os.getenv("TELEGRAM_TOKEN"))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .rate_limiter(OutboundLimiter())
+    )
+    if TELEGRAM_BASE_URL:
+        builder = builder.base_url(TELEGRAM_BASE_URL)
+    if not updater:
+        # В режиме webhook обновления приходят из очереди процесса, а не из getUpdates
+        builder = builder.updater(None)
+    persistence = build_persistence()
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    app = builder.build()
+
+    # Группа -1 видит каждое обновление раньше остальных и не мешает им
+    app.add_handler(TypeHandler(Update, record_first_update), group=-1)
+
+    setup_handlers(app, persistent=persistence is not None)
+    app.add_error_handler(on_error)
+
+    return app
+
+def profile_startup(top=25):
+    # Аналог python -X importtime: импорт бота в отдельном процессе
+    # и самые дорогие модули по суммарному времени импорта.
+    import subprocess
+
+    code = "import time; t = time.perf_counter(); import bot; print(time.perf_counter() - t)"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode != 0:
+        print(result.stderr)
         return
-    response = generate_ai_response(prompt)
-    await update.message.reply_text(response)
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        timings.append((int(cumulative), int(own), name.rstrip()))
+    timings.sort(reverse=True)
+    print(f"Импорт bot.py: {float(result.stdout.strip()):.3f} с, модулей: {len(timings)}")
+    print(f"{'всего, мс':>10} {'свой, мс':>10}  модуль")
+    for cumulative, own, name in timings[:top]:
+        print(f"{cumulative / 1000:>10.1f} {own / 1000:>10.1f}  {name}")
 
 def main():
-    app = ApplicationBuilder().token(os.getenv("TELEGRAM_TOKEN")).build()
-
-    # Команды
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("addevent", addevent_start))
-    app.add_handler(CommandHandler("cancel", cancel))
-    app.add_handler(CommandHandler("listtasks", list_tasks))
-    app.add_handler(CommandHandler("today", today_tasks))
-    app.add_handler(CommandHandler("overdue", overdue_tasks))
-    # Команда для общения с ИИ
-    app.add_handler(CommandHandler("ai", ai_chat))
-
-    # Кнопки быстрого доступа
-    app.add_handler(MessageHandler(filters.Regex(r"^📋 Показать задачи$"), list_tasks))
-    app.add_handler(MessageHandler(filters.Regex(r"^📆 Сегодня$"), today_tasks))
-    app.add_handler(MessageHandler(filters.Regex(r"^⏰ Просроченные$"), overdue_tasks))
-    app.add_handler(MessageHandler(filters.Regex(r"^❌ Отменить$"), cancel))
-
-    # ConversationHandler — Добавить задачу
-    app.add_handler(ConversationHandler(
-        entry_points=[
-            CommandHandler("addtask", addtask_start),
-            MessageHandler(filters.Regex(r"^📝 Добавить задачу$"), addtask_start)
-        ],
-        states={
-            ASK_TASK_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_task_text)],
-            ASK_TASK_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_task_date)],
-            ASK_TASK_DURATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_task_duration)],
-        },
-        fallbacks=[CommandHandler("cancel", cancel)],
-        allow_reentry=True
-    ))
-
-    # ConversationHandler — Добавить встречу
-    app.add_handler(ConversationHandler(
-        entry_points=[
-            CommandHandler("addevent", addevent_start),
-            MessageHandler(filters.Regex(r"^📅 Добавить встречу$"), addevent_start)
-        ],
-        states={
-            ASK_EVENT_TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_event_title)],
-            ASK_EVENT_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_event_date)],
-            ASK_EVENT_START: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_event_start)],
-            ASK_EVENT_END: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_event_end)],
-        },
-        fallbacks=[CommandHandler("cancel", cancel)],
-        allow_reentry=True
-    ))
+    if "--profile-startup" in sys.argv:
+        profile_startup()
+        return
 
-    # ConversationHandler — Завершить задачу
-    app.add_handler(ConversationHandler(
-        entry_points=[
-            CommandHandler("done", done_start),
-            MessageHandler(filters.Regex(r"^✅ Завершить задачу$"), done_start)
-        ],
-        states={
-            ASK_DONE_INDEX: [MessageHandler(filters.TEXT & ~filters.COMMAND, mark_selected_done)],
-        },
-        fallbacks=[CommandHandler("cancel", cancel)],
-        allow_reentry=True
-    ))
+    # BOT_MODE=webhook — приём обновлений через ASGI-сервер с несколькими
+    # процессами-обработчиками; по умолчанию — long polling.
+    if os.getenv("BOT_MODE", "polling") == "webhook":
+        import webhook
+        webhook.serve()
+        return
 
-    print("🚀 Бот запущен. Жду команды...")
+    app = build_application()
+    logging.info("🚀 Бот запущен. Жду команды...")
     app.run_polling()
 
 if __name__ == "__main__":
@@ -0,0 +1,91 @@
+import logging
+import re
+from datetime import datetime, time
+
+import nl_dates
+import task_cache
+from auth import get_credentials
+from google_executor import execute_batch
+from google_services import get_service
+
+_SELECTION_PART = re.compile(r"^(\d+)(?:-(\d+))?$")
+
+
+def parse_selection(text, count):
+    # "1 3 5-8" -> [0, 2, 4, 5, 6, 7]. ValueError — не номера,
+    # IndexError — номер вне диапазона 1..count.
+    indices = set()
+    for part in re.split(r"[\s,]+", text.strip()):
+        if not part:
+            continue
+        match = _SELECTION_PART.match(part)
+        if not match:
+            raise ValueError(part)
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        first, last = min(first, last), max(first, last)
+        if first < 1 or last > count:
+            raise IndexError(part)
+        indices.update(range(first - 1, last))
+    if not indices:
+        raise ValueError(text)
+    return sorted(indices)
+
+
+async def task_body(text, today):
+    # «купить молоко в пятницу» → задача «купить молоко» со сроком на пятницу.
+    # Время Tasks API не хранит, поэтому оно уходит в заметку.
+    when = await nl_dates.parse_async(text, today)
+    body = {"title": when.rest or text}
+    if when.date is not None:
+        body["due"] = datetime.combine(when.date, time()).isoformat() + "Z"
+    if when.start is not None:
+        body["notes"] = f"Время: {when.start.strftime('%H:%M')}"
+    return body
+
+
+async def parse_task_lines(text, today):
+    # Одна задача на строку, дата и время — в свободной форме.
+    return [await task_body(line.strip(), today) for line in text.splitlines() if line.strip()]
+
+
+async def complete_tasks(user_id, tasks):
+    # Все задачи закрываются одним batch-запросом из patch-вызовов,
+    # в теле которых только изменённое поле.
+    creds = await get_credentials(user_id)
+    service = get_service("tasks", "v1", creds)
+    requests = [
+        service.tasks().patch(tasklist='@default', task=task.id, body={'status': 'completed'})
+        for task in tasks
+    ]
+    results = []
+    # Повторная отметка «выполнено» ничего не меняет, поэтому 5xx тоже повторяются
+    responses = await execute_batch(service, requests, creds, "tasks", user_id=user_id, idempotent=True)
+    for task, (response, error) in zip(tasks, responses):
+        if error is None:
+            task_cache.task_completed(user_id, task.id)
+        else:
+            logging.warning(f"Не удалось завершить задачу {task.id}: {error}")
+        results.append((task.title, error is None))
+    return results
+
+
+async def add_tasks(user_id, bodies):
+    creds = await get_credentials(user_id)
+    service = get_service("tasks", "v1", creds)
+    requests = [service.tasks().insert(tasklist='@default', body=body) for body in bodies]
+    results = []
+    for body, (response, error) in zip(bodies, await execute_batch(service, requests, creds, "tasks", user_id=user_id)):
+        if error is None:
+            task_cache.task_added(user_id, response)
+        else:
+            logging.warning(f"Не удалось добавить задачу '{body['title']}': {error}")
+        results.append((body['title'], error is None))
+    return results
+
+
+def format_report(header, results):
+    done = sum(ok for _, ok in results)
+    lines = [f"{header}: {done} из {len(results)}"]
+    lines.extend(f"{'✅' if ok else '❌'} {title}" for title, ok in results)
+    return "\n".join(lines)
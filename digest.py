@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import os
+import random
+from datetime import datetime, timedelta
+
+from telegram import Update
+from telegram.error import Forbidden
+from telegram.ext import ContextTypes
+
+import metrics
+import task_cache
+from auth_utils import MINSK_TZ
+from outbound import send_long
+from overdue import render_overdue
+from today import fetch_today_events, fetch_today_tasks, render_today, today_bounds
+
+# За сколько минут до рассылки начинается подготовка сводок.
+PRECOMPUTE_MINUTES = int(os.getenv("DIGEST_PRECOMPUTE_MINUTES", "10"))
+# Сколько пользователей одного слота загружается из Google одновременно.
+FETCH_CONCURRENCY = int(os.getenv("DIGEST_FETCH_CONCURRENCY", "4"))
+# Рассылка растягивается на окно в секундах и не быстрее SEND_RATE сообщений
+# в секунду (лимит Telegram на массовые рассылки — около 30 в секунду).
+SEND_JITTER = float(os.getenv("DIGEST_SEND_JITTER", "60"))
+SEND_RATE = float(os.getenv("DIGEST_SEND_RATE", "20"))
+# Напоминания о встречах: как часто проверять и за сколько минут предупреждать.
+REMINDER_INTERVAL = int(os.getenv("REMINDER_INTERVAL", "300"))
+REMINDER_LEAD = int(os.getenv("REMINDER_LEAD_MINUTES", "15"))
+
+
+def _parse_time(text):
+    return datetime.strptime(text, "%H:%M").time()
+
+
+class DigestScheduler:
+    # Подписки хранятся в user_data (переживают перезапуск через persistence),
+    # а задания JobQueue создаются по одному на время рассылки: все
+    # пользователи с одинаковым временем обслуживаются одним заданием.
+    def __init__(self):
+        self.shard = (0, 1)
+        self._slots = {}
+        self._jobs = {}
+        self._reminders = {}
+        self._reminded = {}
+        self._reminder_job = None
+
+    def owns(self, chat_id):
+        # В режиме webhook с несколькими процессами рассылку для чата
+        # планирует только процесс, в который маршрутизируются его обновления.
+        index, count = self.shard
+        return chat_id % count == index
+
+    def restore(self, application):
+        if application.job_queue is None:
+            logging.warning("JobQueue недоступна: рассылки отключены (нужен python-telegram-bot[job-queue])")
+            return
+        for user_id, data in application.user_data.items():
+            schedule = data.get("schedule")
+            if not schedule or not self.owns(schedule["chat_id"]):
+                continue
+            if schedule.get("digest"):
+                self.subscribe(application, user_id, schedule["chat_id"], schedule["digest"])
+            if schedule.get("reminders"):
+                self.enable_reminders(application, user_id, schedule["chat_id"])
+
+    def subscribe(self, application, user_id, chat_id, slot):
+        self.unsubscribe(user_id)
+        users = self._slots.setdefault(slot, {})
+        users[user_id] = chat_id
+        if slot not in self._jobs:
+            send_at = datetime.combine(datetime.now(MINSK_TZ).date(), _parse_time(slot))
+            start = (send_at - timedelta(minutes=PRECOMPUTE_MINUTES)).time()
+            self._jobs[slot] = application.job_queue.run_daily(
+                self._run_slot, time=start.replace(tzinfo=MINSK_TZ), data=slot, name=f"digest {slot}",
+            )
+        metrics.set_gauge("digest_subscribers", sum(len(users) for users in self._slots.values()))
+
+    def unsubscribe(self, user_id):
+        for slot, users in list(self._slots.items()):
+            if users.pop(user_id, None) is not None and not users:
+                del self._slots[slot]
+                self._jobs.pop(slot).schedule_removal()
+        metrics.set_gauge("digest_subscribers", sum(len(users) for users in self._slots.values()))
+
+    def enable_reminders(self, application, user_id, chat_id):
+        self._reminders[user_id] = chat_id
+        if self._reminder_job is None:
+            self._reminder_job = application.job_queue.run_repeating(
+                self._run_reminders, interval=REMINDER_INTERVAL, first=REMINDER_INTERVAL, name="reminders",
+            )
+
+    def disable_reminders(self, user_id):
+        self._reminders.pop(user_id, None)
+        self._reminded.pop(user_id, None)
+        if not self._reminders and self._reminder_job is not None:
+            self._reminder_job.schedule_removal()
+            self._reminder_job = None
+
+    async def build_digest(self, user_id):
+        now = datetime.now(MINSK_TZ)
+        today_start, today_end = today_bounds(now)
+        tasks, events, index = await asyncio.gather(
+            fetch_today_tasks(user_id, today_start, today_end),
+            fetch_today_events(user_id, today_start, today_end),
+            task_cache.get_index(user_id),
+            return_exceptions=True,
+        )
+        text = "☀️ Доброе утро!\n\n" + render_today(today_start, {"tasks": tasks, "events": events})
+        overdue = None if isinstance(index, Exception) else render_overdue(index, now)
+        if overdue:
+            text += "\n\n" + overdue
+        return text
+
+    async def _precompute(self, users, window):
+        # Загрузки слота идут ограниченной пачкой и размазаны по окну
+        # подготовки, чтобы не упираться в квоты Google в одну секунду.
+        semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+
+        async def prepare(user_id, chat_id):
+            await asyncio.sleep(random.uniform(0, window))
+            async with semaphore:
+                try:
+                    return user_id, chat_id, await self.build_digest(user_id)
+                except Exception as e:
+                    logging.error(f"Не удалось подготовить сводку для {user_id}: {e}")
+                    metrics.inc("digest_errors")
+                    return user_id, chat_id, None
+
+        return await asyncio.gather(*(prepare(user_id, chat_id) for user_id, chat_id in users.items()))
+
+    async def _run_slot(self, context: ContextTypes.DEFAULT_TYPE):
+        slot = context.job.data
+        users = dict(self._slots.get(slot, {}))
+        if not users:
+            return
+        now = datetime.now(MINSK_TZ)
+        send_at = MINSK_TZ.localize(datetime.combine(now.date(), _parse_time(slot)))
+        if send_at < now - timedelta(minutes=PRECOMPUTE_MINUTES):
+            # Подготовка началась до полуночи, а рассылка — уже завтра.
+            send_at = MINSK_TZ.localize(datetime.combine(now.date() + timedelta(days=1), _parse_time(slot)))
+        send_at = max(send_at, now)
+        payloads = await self._precompute(users, (send_at - now).total_seconds() / 2)
+
+        # Каждому сообщению — случайная задержка в окне SEND_JITTER, но не
+        # чаще SEND_RATE в секунду.
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(max((send_at - datetime.now(MINSK_TZ)).total_seconds(), 0))
+        started = loop.time()
+        last = None
+        plan = sorted(
+            (random.uniform(0, SEND_JITTER), user_id, chat_id, text)
+            for user_id, chat_id, text in payloads if text
+        )
+        for delay, user_id, chat_id, text in plan:
+            at = started + delay
+            if last is not None:
+                at = max(at, last + 1 / SEND_RATE)
+            await asyncio.sleep(max(at - loop.time(), 0))
+            last = loop.time()
+            await self._send(context, user_id, chat_id, text)
+        metrics.inc("digest_slots")
+
+    async def _run_reminders(self, context: ContextTypes.DEFAULT_TYPE):
+        now = datetime.now(MINSK_TZ)
+        today_start, today_end = today_bounds(now)
+        horizon = now + timedelta(minutes=REMINDER_LEAD)
+        semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+
+        async def check(user_id, chat_id):
+            async with semaphore:
+                try:
+                    events = await task_cache.get_events(user_id, today_start, today_end)
+                except Exception as e:
+                    logging.error(f"Не удалось проверить встречи для {user_id}: {e}")
+                    return
+            reminded = self._reminded.setdefault(user_id, {})
+            for event_id, start in list(reminded.items()):
+                if start < now:
+                    del reminded[event_id]
+            soon = [
+                event for event in events
+                if not event.all_day and now <= event.start < horizon and event.id not in reminded
+            ]
+            for event in soon:
+                reminded[event.id] = event.start
+                await self._send(context, user_id, chat_id, f"⏰ В {event.start.strftime('%H:%M')} — {event.summary}")
+
+        await asyncio.gather(*(check(user_id, chat_id) for user_id, chat_id in list(self._reminders.items())))
+
+    async def _send(self, context, user_id, chat_id, text):
+        try:
+            await send_long(context.bot, chat_id, text)
+            metrics.inc("digest_sent")
+        except Forbidden:
+            # Пользователь заблокировал бота — рассылать больше некому.
+            # Изменение сделано вне обработчика обновления, поэтому
+            # persistence о нём нужно сказать явно, иначе restore() вернёт подписку.
+            context.application.user_data.get(user_id, {}).pop("schedule", None)
+            context.application.mark_data_for_update_persistence(user_ids=user_id)
+            self.unsubscribe(user_id)
+            self.disable_reminders(user_id)
+        except Exception as e:
+            logging.error(f"Не удалось отправить рассылку в чат {chat_id}: {e}")
+            metrics.inc("digest_errors")
+
+
+scheduler = DigestScheduler()
+
+
+async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /digest 09:00 — включить утреннюю сводку, /digest off — выключить
+    if context.application.job_queue is None:
+        await update.message.reply_text("⚠️ Рассылки сейчас недоступны.")
+        return
+    schedule = context.user_data.setdefault("schedule", {"chat_id": update.effective_chat.id})
+    user_id = update.effective_user.id
+    if not context.args:
+        current = schedule.get("digest")
+        await update.message.reply_text(
+            f"☀️ Сводка приходит в {current}. Выключить: /digest off" if current
+            else "☀️ Укажи время ежедневной сводки, например: /digest 09:00"
+        )
+        return
+    if context.args[0].lower() == "off":
+        schedule["digest"] = None
+        scheduler.unsubscribe(user_id)
+        await update.message.reply_text("🔕 Ежедневная сводка выключена.")
+        return
+    try:
+        slot = _parse_time(context.args[0]).strftime("%H:%M")
+    except ValueError:
+        await update.message.reply_text("❌ Неверный формат времени. Пример: /digest 09:00")
+        return
+    schedule["digest"] = slot
+    scheduler.subscribe(context.application, user_id, schedule["chat_id"], slot)
+    await update.message.reply_text(f"✅ Сводка на день будет приходить каждый день в {slot}.")
+
+
+async def remind_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /remind on|off — напоминания о встречах за REMINDER_LEAD минут
+    if context.application.job_queue is None:
+        await update.message.reply_text("⚠️ Напоминания сейчас недоступны.")
+        return
+    schedule = context.user_data.setdefault("schedule", {"chat_id": update.effective_chat.id})
+    user_id = update.effective_user.id
+    if context.args and context.args[0].lower() == "off":
+        schedule["reminders"] = False
+        scheduler.disable_reminders(user_id)
+        await update.message.reply_text("🔕 Напоминания о встречах выключены.")
+        return
+    schedule["reminders"] = True
+    scheduler.enable_reminders(context.application, user_id, schedule["chat_id"])
+    await update.message.reply_text(f"🔔 Напомню о каждой встрече за {REMINDER_LEAD} минут. Выключить: /remind off")
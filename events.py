@@ -1,44 +1,119 @@
+import logging
+
+from google.auth.exceptions import RefreshError
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
-from auth import get_credentials
-from googleapiclient.discovery import build
-from datetime import datetime
+import freebusy
+import nl_dates
+import task_cache
+from accounts import LINK_HINT
+from auth import NotLinked, get_credentials
+from auth_utils import MINSK_TZ
+from google_executor import GoogleUnavailable, execute
+from google_services import get_service
+from datetime import datetime, timedelta
 
 ASK_EVENT_TITLE = 4
 ASK_EVENT_DATE = 5
 ASK_EVENT_START = 6
 ASK_EVENT_END = 7
 
+EVENT_FIELDS = ('event_title', 'event_date', 'event_start', 'event_end')
+
+def _today():
+    return datetime.now(MINSK_TZ).date()
+
 async def addevent_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data.clear()
-    await update.message.reply_text("📌 Введи название встречи:")
-    return ASK_EVENT_TITLE
+    # /addevent Созвон завтра 14:30-15:30 — встреча одной строкой.
+    # Чего в строке не хватает, бот спросит отдельными шагами.
+    for field in EVENT_FIELDS:
+        context.user_data.pop(field, None)
+    text = update.message.text.split(maxsplit=1)
+    if update.message.text.startswith("/") and len(text) > 1:
+        now = datetime.now(MINSK_TZ)
+        when = await nl_dates.parse_async(text[1], now.date())
+        date = when.date
+        if date is None and when.start is not None:
+            # Только время: сегодня, если оно ещё не прошло, иначе завтра
+            date = now.date() if when.start > now.time() else now.date() + timedelta(days=1)
+        if when.rest:
+            context.user_data['event_title'] = when.rest
+        if date is not None:
+            context.user_data['event_date'] = date.strftime("%d.%m.%Y")
+        if when.start is not None:
+            context.user_data['event_start'] = when.start.strftime("%H:%M")
+        if when.end is not None:
+            context.user_data['event_end'] = when.end.strftime("%H:%M")
+    return await _next_step(update, context)
+
+async def _next_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    data = context.user_data
+    if not data.get('event_title'):
+        await update.message.reply_text("📌 Введи название встречи:")
+        return ASK_EVENT_TITLE
+    if not data.get('event_date'):
+        await update.message.reply_text("📅 Укажи дату встречи (ДД.ММ.ГГГГ, «завтра», «в пятницу»...):")
+        return ASK_EVENT_DATE
+    if not data.get('event_start'):
+        day = datetime.strptime(data['event_date'], "%d.%m.%Y").date()
+        hint = await freebusy.day_hint(update.effective_user.id, day)
+        await update.message.reply_text("🕒 Укажи время начала (например: 14:30 или 14:30-15:30):" + hint)
+        return ASK_EVENT_START
+    if not data.get('event_end'):
+        await update.message.reply_text("🕕 Укажи время окончания (например: 15:30):")
+        return ASK_EVENT_END
+    return await _create_event(update, context)
 
 async def received_event_title(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data['event_title'] = update.message.text
-    await update.message.reply_text("📅 Укажи дату встречи (ДД.ММ.ГГГГ):")
-    return ASK_EVENT_DATE
+    text = update.message.text.strip()
+    if text:
+        context.user_data['event_title'] = text
+        return await _next_step(update, context)
+    else:
+        await update.message.reply_text("❌ Название не может быть пустым. Введи ещё раз:")
+        return ASK_EVENT_TITLE
 
 async def received_event_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data['event_date'] = update.message.text
-    await update.message.reply_text("🕒 Укажи время начала (например: 14:30):")
-    return ASK_EVENT_START
+    date = await nl_dates.parse_date(update.message.text, _today())
+    if date is None:
+        await update.message.reply_text("❌ Не понял дату. Попробуй снова: ДД.ММ.ГГГГ, «завтра» или «в пятницу»")
+        return ASK_EVENT_DATE
+    context.user_data['event_date'] = date.strftime("%d.%m.%Y")
+    return await _next_step(update, context)
 
 async def received_event_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data['event_start'] = update.message.text
-    await update.message.reply_text("🕕 Укажи время окончания (например: 15:30):")
-    return ASK_EVENT_END
+    # Можно сразу указать и окончание: «14:30-15:30», «с 9 до 10», «в 15 на час»
+    when = await nl_dates.parse_async(update.message.text.strip(), _today())
+    start = when.start if not when.rest and when.date is None else None
+    if start is None:
+        start = nl_dates.parse_time(update.message.text)
+    if start is None:
+        await update.message.reply_text("❌ Неверный формат времени. Попробуй снова: ЧЧ:ММ")
+        return ASK_EVENT_START
+    context.user_data['event_start'] = start.strftime("%H:%M")
+    if when.end is not None:
+        context.user_data['event_end'] = when.end.strftime("%H:%M")
+    return await _next_step(update, context)
 
 async def received_event_end(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        title = context.user_data['event_title']
-        date = context.user_data['event_date']
-        start_time = context.user_data['event_start']
-        end_time = update.message.text
+    end = nl_dates.parse_time(update.message.text)
+    if end is None:
+        await update.message.reply_text("❌ Неверный формат времени. Попробуй снова: ЧЧ:ММ")
+        return ASK_EVENT_END
+    context.user_data['event_end'] = end.strftime("%H:%M")
+    return await _next_step(update, context)
 
-        start_dt = datetime.strptime(f"{date} {start_time}", "%d.%m.%Y %H:%M")
-        end_dt = datetime.strptime(f"{date} {end_time}", "%d.%m.%Y %H:%M")
+async def _create_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    title = context.user_data['event_title']
+    date = context.user_data['event_date']
+    start_dt = datetime.strptime(f"{date} {context.user_data['event_start']}", "%d.%m.%Y %H:%M")
+    end_dt = datetime.strptime(f"{date} {context.user_data['event_end']}", "%d.%m.%Y %H:%M")
+    if end_dt <= start_dt:
+        context.user_data.pop('event_end')
+        await update.message.reply_text("❌ Встреча должна закончиться позже, чем начнётся. Укажи время окончания:")
+        return ASK_EVENT_END
 
+    try:
         event = {
             'summary': title,
             'start': {'dateTime': start_dt.isoformat(), 'timeZone': 'Europe/Minsk'},
@@ -46,11 +121,24 @@ async def received_event_end(update: Update, context: ContextTypes.DEFAULT_TYPE)
             'description': 'Добавлено через Telegram-бота'
         }
 
-        creds = get_credentials()
-        service = build("calendar", "v3", credentials=creds)
-        service.events().insert(calendarId='primary', body=event).execute()
+        creds = await get_credentials(update.effective_user.id)
+        service = get_service("calendar", "v3", creds)
+        await execute(
+            service.events().insert(calendarId='primary', body=event), "calendar", user_id=update.effective_user.id,
+        )
+        task_cache.events_changed(update.effective_user.id)
 
-        await update.message.reply_text(f"✅ Встреча '{title}' добавлена в календарь!")
+        await update.message.reply_text(
+            f"✅ Встреча '{title}' добавлена в календарь: {date}, "
+            f"{context.user_data['event_start']}–{context.user_data['event_end']}"
+        )
+    except GoogleUnavailable:
+        await update.message.reply_text("⚠️ Google Календарь сейчас перегружен. Попробуй добавить встречу через минуту.")
+    except (NotLinked, RefreshError):
+        await update.message.reply_text(LINK_HINT)
     except Exception as e:
-        await update.message.reply_text(f"❌ Ошибка при добавлении события: {e}")
+        logging.error(f"Ошибка при добавлении события: {e}")
+        await update.message.reply_text("❌ Не удалось добавить встречу. Попробуй позже.")
+    for field in EVENT_FIELDS:
+        context.user_data.pop(field, None)
     return ConversationHandler.END
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+import os
+
+from google.auth.exceptions import RefreshError
+
+from accounts import LINK_HINT
+from auth import NotLinked
+from outbound import reply_long, split_message
+
+# Через сколько секунд отправлять частичный ответ, если один из источников медлит.
+PARTIAL_REPLY_DEADLINE = float(os.getenv("PARTIAL_REPLY_DEADLINE", "1.5"))
+
+PENDING = object()
+
+# Аккаунт не подключён или доступ отозван: это не сбой загрузки, а повод
+# подсказать /link
+LINK_ERRORS = (NotLinked, RefreshError)
+
+
+def _results(jobs):
+    results = {}
+    for name, job in jobs.items():
+        if not job.done():
+            results[name] = PENDING
+        elif job.exception() is not None:
+            results[name] = job.exception()
+        else:
+            results[name] = job.result()
+    return results
+
+
+def not_linked(results):
+    return all(isinstance(result, LINK_ERRORS) for result in results.values())
+
+
+def section_lines(result, empty_text):
+    if result is PENDING:
+        return ["⏳ Загружается..."]
+    if isinstance(result, LINK_ERRORS):
+        return [LINK_HINT]
+    if isinstance(result, Exception):
+        return ["⚠️ Не удалось загрузить данные."]
+    return result or [empty_text]
+
+
+async def reply_progressively(message, jobs, render, deadline=PARTIAL_REPLY_DEADLINE):
+    # jobs — словарь {имя: asyncio.Task}; render получает {имя: результат | PENDING | исключение}.
+    done, pending = await asyncio.wait(jobs.values(), timeout=deadline)
+    sent = await reply_long(message, render(_results(jobs)))
+    if pending:
+        await asyncio.wait(pending)
+        # Полный ответ может занять больше сообщений, чем частичный.
+        for i, part in enumerate(split_message(render(_results(jobs)))):
+            if i < len(sent):
+                await sent[i].edit_text(part)
+            else:
+                sent.append(await message.reply_text(part))
+    for name, job in jobs.items():
+        if job.exception() is not None and not isinstance(job.exception(), LINK_ERRORS):
+            logging.error(f"Ошибка при загрузке '{name}': {job.exception()}")
+    return sent
@@ -0,0 +1,19 @@
+RUSSIAN_WEEKDAYS = {
+    'Monday': 'Понедельник',
+    'Tuesday': 'Вторник',
+    'Wednesday': 'Среда',
+    'Thursday': 'Четверг',
+    'Friday': 'Пятница',
+    'Saturday': 'Суббота',
+    'Sunday': 'Воскресенье',
+}
+
+def format_russian_date(date_obj):
+    weekday = RUSSIAN_WEEKDAYS[date_obj.strftime("%A")]
+    return f"{weekday} ({date_obj.strftime('%d.%m')})"
+
+def format_task_line(task):
+    line = f"• {task.title}"
+    if task.notes:
+        line += f" — {task.notes}"
+    return line
@@ -0,0 +1,151 @@
+import logging
+import os
+from datetime import datetime, timedelta
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+import nl_dates
+from auth import get_credentials
+from auth_utils import MINSK_TZ
+from formatting import format_russian_date
+from google_executor import execute
+from google_services import get_service
+from outbound import reply_long
+
+# Рабочее время и дни недели (1 — понедельник), в которые ищутся окна.
+WORK_START = datetime.strptime(os.getenv("WORK_START", "09:00"), "%H:%M").time()
+WORK_END = datetime.strptime(os.getenv("WORK_END", "19:00"), "%H:%M").time()
+WORK_DAYS = {int(day) for day in os.getenv("WORK_DAYS", "12345")}
+MIN_SLOT = timedelta(minutes=int(os.getenv("FREE_MIN_MINUTES", "30")))
+# На сколько дней вперёд смотрит /free без даты.
+FREE_DAYS = int(os.getenv("FREE_DAYS", "7"))
+# Календари, занятость в которых учитывается (через запятую).
+FREE_CALENDARS = [c.strip() for c in os.getenv("FREE_CALENDARS", "primary").split(",") if c.strip()]
+# Начало окна округляется вверх до стольких минут: «14:15», а не «14:07».
+ROUND_MINUTES = 15
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).astimezone(MINSK_TZ)
+
+
+def _round_up(moment, minutes=ROUND_MINUTES):
+    moment = moment.replace(second=0, microsecond=0)
+    return moment + timedelta(minutes=-moment.minute % minutes)
+
+
+async def query_busy(user_id, time_min, time_max, calendars=None):
+    # Один freebusy.query на всё окно и все календари вместо events.list по
+    # дням: неделя подсказок стоит одного запроса.
+    service = get_service("calendar", "v3", await get_credentials(user_id))
+    body = {
+        "timeMin": time_min.isoformat(),
+        "timeMax": time_max.isoformat(),
+        "timeZone": "Europe/Minsk",
+        "items": [{"id": calendar_id} for calendar_id in calendars or FREE_CALENDARS],
+    }
+    result = await execute(service.freebusy().query(body=body), "calendar", user_id=user_id)
+    busy = []
+    for calendar_id, calendar in result.get("calendars", {}).items():
+        for error in calendar.get("errors", []):
+            logging.warning(f"Занятость календаря {calendar_id} недоступна: {error.get('reason')}")
+        busy.extend((_parse_time(item["start"]), _parse_time(item["end"])) for item in calendar.get("busy", []))
+    return busy
+
+
+def merge_intervals(intervals):
+    # Сортировка по началу и один проход: пересекающиеся и смежные
+    # интервалы (в том числе из разных календарей) склеиваются.
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def free_slots(busy, window_start, window_end, min_duration=MIN_SLOT,
+               work_start=WORK_START, work_end=WORK_END, work_days=WORK_DAYS):
+    # Свободные окна в рабочее время: дни и занятые интервалы идут по
+    # возрастанию, поэтому указатель по busy только движется вперёд.
+    merged = merge_intervals(busy)
+    slots = []
+    first = 0
+    day = window_start.astimezone(MINSK_TZ).date()
+    last_day = window_end.astimezone(MINSK_TZ).date()
+    while day <= last_day:
+        if day.isoweekday() in work_days:
+            cursor = max(MINSK_TZ.localize(datetime.combine(day, work_start)), window_start)
+            end = min(MINSK_TZ.localize(datetime.combine(day, work_end)), window_end)
+            while first < len(merged) and merged[first][1] <= cursor:
+                first += 1
+            index = first
+            while cursor < end and index < len(merged) and merged[index][0] < end:
+                busy_start, busy_end = merged[index]
+                if busy_start - cursor >= min_duration:
+                    slots.append((cursor, busy_start))
+                cursor = max(cursor, busy_end)
+                index += 1
+            if end - cursor >= min_duration:
+                slots.append((cursor, end))
+        day += timedelta(days=1)
+    return slots
+
+
+def format_slots(slots):
+    lines = []
+    current = None
+    for start, end in slots:
+        if start.date() != current:
+            current = start.date()
+            lines.append(f"\n📅 {format_russian_date(start)}:")
+        lines.append(f"• {start.strftime('%H:%M')}–{end.strftime('%H:%M')}")
+    return lines
+
+
+async def find_slots(user_id, window_start, window_end, min_duration=MIN_SLOT):
+    window_start = _round_up(window_start)
+    if window_end <= window_start:
+        return []
+    busy = await query_busy(user_id, window_start, window_end)
+    return free_slots(busy, window_start, window_end, min_duration)
+
+
+async def day_hint(user_id, day):
+    # Подсказка для шага «время начала» в /addevent; ошибка Google не должна
+    # ломать диалог, поэтому без подсказки в этом случае.
+    now = datetime.now(MINSK_TZ)
+    day_start = MINSK_TZ.localize(datetime.combine(day, datetime.min.time()))
+    try:
+        slots = await find_slots(user_id, max(day_start, now), day_start + timedelta(days=1))
+    except Exception as e:
+        logging.warning(f"Не удалось подобрать окна для {user_id}: {e}")
+        return ""
+    if not slots:
+        return "\n🔴 Свободных окон в рабочее время нет."
+    return "\n🟢 Свободно: " + ", ".join(f"{start.strftime('%H:%M')}–{end.strftime('%H:%M')}" for start, end in slots)
+
+
+async def free_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /free — окна на FREE_DAYS дней; /free завтра на час — окна от часа на завтра
+    now = datetime.now(MINSK_TZ)
+    text = " ".join(context.args or [])
+    min_duration = nl_dates.parse_duration(text) or MIN_SLOT
+    day = (await nl_dates.parse_async(text, now.date())).date if text else None
+    if day is not None:
+        window_start = MINSK_TZ.localize(datetime.combine(day, datetime.min.time()))
+        window_end = window_start + timedelta(days=1)
+    else:
+        window_start, window_end = now, now + timedelta(days=FREE_DAYS)
+
+    slots = await find_slots(update.effective_user.id, max(window_start, now), window_end, min_duration)
+    if not slots:
+        await update.message.reply_text("🔴 Свободных окон в рабочее время не нашлось.")
+        return
+    minutes = int(min_duration.total_seconds() // 60)
+    lines = [f"🟢 Свободное время (окна от {minutes} мин, {WORK_START.strftime('%H:%M')}–{WORK_END.strftime('%H:%M')}):"]
+    lines.extend(format_slots(slots))
+    await reply_long(update.message, "\n".join(lines))
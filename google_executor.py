@@ -0,0 +1,294 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+import metrics
+import tracing
+from google_services import thread_http
+from ratelimit import TokenBucket
+
+MAX_WORKERS = int(os.getenv("GOOGLE_API_WORKERS", "8"))
+CALL_TIMEOUT = float(os.getenv("GOOGLE_API_TIMEOUT", "20"))
+# Максимум, который Tasks API отдаёт за одну страницу.
+PAGE_SIZE = 100
+# Сколько запросов упаковывается в один batch-запрос.
+BATCH_SIZE = 50
+# Повторы при 429/5xx: экспоненциальная пауза со случайным разбросом.
+MAX_RETRIES = int(os.getenv("GOOGLE_API_RETRIES", "4"))
+BACKOFF_BASE = float(os.getenv("GOOGLE_API_BACKOFF", "0.5"))
+BACKOFF_MAX = 16.0
+# После BREAKER_THRESHOLD вызовов подряд, закончившихся 5xx или таймаутом
+# (с учётом повторов), API считается недоступным на BREAKER_COOLDOWN секунд,
+# затем пропускается один пробный запрос.
+BREAKER_THRESHOLD = int(os.getenv("GOOGLE_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("GOOGLE_BREAKER_COOLDOWN", "30"))
+# Доля квоты проекта на одного пользователя: запросов в секунду и всплеск.
+USER_RATE = float(os.getenv("GOOGLE_USER_RATE", "5"))
+USER_BURST = int(os.getenv("GOOGLE_USER_BURST", "10"))
+MAX_USER_BUCKETS = 10000
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded", "quotaExceeded"}
+
+# googleapiclient синхронный, поэтому запросы выполняются в ограниченном
+# пуле потоков, а обработчики только ждут результат, не блокируя event loop.
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="google-api")
+_lock = threading.Lock()
+_queued = 0
+_in_flight = 0
+
+
+class GoogleUnavailable(Exception):
+    # API временно отключено предохранителем; данные стоит взять из кэша.
+    def __init__(self, api):
+        super().__init__(f"Google API {api} временно недоступен")
+        self.api = api
+
+
+class CircuitBreaker:
+    def __init__(self, api, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.api = api
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at < self.cooldown or self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def success(self):
+        if self.opened_at is not None:
+            logging.info(f"Google API {self.api} снова доступен")
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        metrics.set_gauge("google_api_breaker_open", 0, api=self.api)
+
+    def release(self):
+        # Вызов закончился ничем, что говорит о здоровье API (например, не
+        # обновился токен пользователя): пробный слот освобождается.
+        self._probing = False
+
+    def failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.failures >= self.threshold:
+            if self.opened_at is None:
+                logging.warning(f"Google API {self.api}: {self.failures} сбоев подряд, запросы приостановлены")
+                metrics.inc("google_api_breaker_trips", api=self.api)
+            self.opened_at = time.monotonic()
+            metrics.set_gauge("google_api_breaker_open", 1, api=self.api)
+
+
+_breakers = {}
+_user_buckets = OrderedDict()
+
+
+def _breaker(api):
+    breaker = _breakers.get(api)
+    if breaker is None:
+        breaker = _breakers[api] = CircuitBreaker(api)
+    return breaker
+
+
+def _user_bucket(user_id):
+    bucket = _user_buckets.get(user_id)
+    if bucket is None:
+        bucket = _user_buckets[user_id] = TokenBucket(USER_RATE, USER_BURST)
+        if len(_user_buckets) > MAX_USER_BUCKETS:
+            _user_buckets.popitem(last=False)
+    else:
+        _user_buckets.move_to_end(user_id)
+    return bucket
+
+
+def _retry_delay(error, attempt, idempotent):
+    # Пауза перед повтором или None, если ошибку повторять нельзя.
+    # Отказ по квоте означает, что запрос не выполнялся, поэтому его можно
+    # повторить всегда; 5xx и таймауты — только для запросов на чтение.
+    retry_after = None
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        details = error.error_details if isinstance(error.error_details, list) else []
+        rate_limited = status == 429 or (status == 403 and any(
+            isinstance(detail, dict) and detail.get("reason") in RATE_LIMIT_REASONS for detail in details
+        ))
+        if not rate_limited and not (idempotent and status in RETRY_STATUSES):
+            return None
+        retry_after = error.resp.get("retry-after")
+    elif not (idempotent and isinstance(error, (asyncio.TimeoutError, OSError, httplib2.HttpLib2Error))):
+        return None
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, float(retry_after))
+    return delay
+
+
+def _is_outage(error):
+    # Сбой самого API: 5xx или нет ответа. Квоты (429, 403 rateLimitExceeded)
+    # и ошибки учётных данных касаются одного пользователя или запроса и
+    # предохранитель, общий для всех, не открывают.
+    if isinstance(error, HttpError):
+        return error.resp.status >= 500
+    return isinstance(error, (asyncio.TimeoutError, ConnectionError, httplib2.HttpLib2Error))
+
+
+def _publish():
+    metrics.set_gauge("google_api_queue_depth", _queued)
+    metrics.set_gauge("google_api_in_flight", _in_flight)
+
+
+def _run(request, api, credentials):
+    global _queued, _in_flight
+    with _lock:
+        _queued -= 1
+        _in_flight += 1
+        _publish()
+    try:
+        http = thread_http(credentials or request.http.credentials)
+        return request.execute(http=http)
+    finally:
+        with _lock:
+            _in_flight -= 1
+            _publish()
+
+
+async def execute(request, api="google", timeout=CALL_TIMEOUT, credentials=None, user_id=None):
+    # Батч не имеет methodId, у обычного запроса это, например, tasks.tasks.list
+    with tracing.span("google_api", api=api, method=getattr(request, "methodId", "batch")) as span:
+        span.attributes["user_id"] = user_id
+        return await _execute(request, api, timeout, credentials, user_id, span)
+
+
+async def _execute(request, api, timeout, credentials, user_id, span):
+    breaker = _breaker(api)
+    if not breaker.allow():
+        metrics.inc("google_api_rejected", api=api)
+        raise GoogleUnavailable(api)
+    idempotent = getattr(request, "method", None) == "GET"
+    try:
+        return await _attempts(request, api, timeout, credentials, user_id, span, breaker, idempotent)
+    except asyncio.CancelledError:
+        breaker.release()
+        raise
+
+
+async def _attempts(request, api, timeout, credentials, user_id, span, breaker, idempotent):
+    attempt = 0
+    while True:
+        if user_id is not None:
+            # Запросы одного пользователя не могут выбрать всю квоту проекта.
+            await _user_bucket(user_id).acquire()
+        try:
+            result = await _submit(request, api, timeout, credentials)
+        except Exception as e:
+            delay = _retry_delay(e, attempt, idempotent)
+            if delay is None or attempt >= MAX_RETRIES:
+                # Один исход на логический вызов, а не на каждую попытку
+                if _is_outage(e):
+                    breaker.failure()
+                elif isinstance(e, HttpError):
+                    # API ответило: ошибка запроса (400, 404, 410...) или квота
+                    breaker.success()
+                else:
+                    breaker.release()
+                raise
+            metrics.inc("google_api_retries", api=api)
+            span.attributes["retries"] = attempt + 1
+            logging.warning(f"Ошибка Google API ({api}), повтор {attempt + 1} через {delay:.1f} с: {e}")
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        breaker.success()
+        return result
+
+
+async def _submit(request, api, timeout, credentials):
+    global _queued
+    with _lock:
+        _queued += 1
+        _publish()
+    future = _executor.submit(_run, request, api, credentials)
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except asyncio.TimeoutError:
+        metrics.inc("google_api_timeouts", api=api)
+        logging.warning(f"Таймаут запроса к Google API ({api}) после {timeout} с")
+        raise
+    finally:
+        if future.cancel():
+            # Запрос так и не начал выполняться — убираем его из очереди.
+            with _lock:
+                _queued -= 1
+                _publish()
+
+
+def stats():
+    with _lock:
+        return {
+            "queued": _queued,
+            "in_flight": _in_flight,
+            "workers": MAX_WORKERS,
+            "open_breakers": [api for api, breaker in _breakers.items() if breaker.opened_at is not None],
+        }
+
+
+async def paginate(make_request, api="google", user_id=None):
+    # Асинхронный генератор страниц: make_request(page_token) строит запрос
+    # очередной страницы, следующая запрашивается только когда нужна.
+    page_token = None
+    while True:
+        result = await execute(make_request(page_token), api, user_id=user_id)
+        yield result
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            return
+
+
+async def execute_batch(service, requests, credentials, api="google", user_id=None, idempotent=False):
+    # Выполняет запросы пачками через BatchHttpRequest: один HTTP-запрос на
+    # BATCH_SIZE операций. Возвращает [(ответ, исключение)] в порядке requests.
+    # Отдельные операции, отклонённые по квоте или (для idempotent) с 5xx,
+    # отправляются повторно по тем же правилам, что и обычные запросы.
+    results = [(None, None)] * len(requests)
+
+    def collect(request_id, response, exception):
+        results[int(request_id)] = (response, exception)
+
+    pending = list(range(len(requests)))
+    attempt = 0
+    while True:
+        for offset in range(0, len(pending), BATCH_SIZE):
+            batch = service.new_batch_http_request(callback=collect)
+            for i in pending[offset:offset + BATCH_SIZE]:
+                batch.add(requests[i], request_id=str(i))
+            await execute(batch, api, credentials=credentials, user_id=user_id)
+            metrics.inc("google_api_batches", api=api)
+        if attempt >= MAX_RETRIES:
+            return results
+        delays = {i: _retry_delay(results[i][1], attempt, idempotent) for i in pending if results[i][1] is not None}
+        pending = [i for i, delay in delays.items() if delay is not None]
+        if not pending:
+            return results
+        metrics.inc("google_api_retries", api=api)
+        logging.warning(f"Google API ({api}): повтор {len(pending)} операций пачки, попытка {attempt + 1}")
+        await asyncio.sleep(max(delays[i] for i in pending))
+        attempt += 1
+
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,91 @@
+import importlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+
+import metrics
+
+HTTP_TIMEOUT = 30
+# Сколько клиентов API (пар «учётные данные, API») держать в памяти.
+SERVICE_CACHE_SIZE = int(os.getenv("GOOGLE_SERVICE_CACHE_SIZE", "2000"))
+# Другой адрес Google API (например, фейковый сервер бенчмарка bench/).
+GOOGLE_API_ROOT = os.getenv("GOOGLE_API_ROOT", "")
+
+# Клиенты Google API собираются из статических discovery-документов,
+# поставляемых вместе с google-api-python-client; документ читается с
+# диска один раз на процесс. У каждого пользователя свои учётные данные,
+# поэтому клиенты кэшируются по LRU на пару (учётные данные, API).
+# httplib2.Http не потокобезопасен, поэтому keep-alive соединения
+# с googleapis.com держатся отдельно в каждом потоке пула запросов.
+_lock = threading.Lock()
+_services = OrderedDict()
+_documents = {}
+_base_http = httplib2.Http(timeout=HTTP_TIMEOUT)
+_local = threading.local()
+
+
+def thread_http(credentials):
+    http = getattr(_local, "http", None)
+    if http is None:
+        http = _local.http = httplib2.Http(timeout=HTTP_TIMEOUT)
+    return AuthorizedHttp(credentials, http=http)
+
+
+def _document(api, version):
+    document = _documents.get((api, version))
+    if document is None:
+        from googleapiclient.discovery_cache import get_static_doc
+
+        document = get_static_doc(api, version)
+        if GOOGLE_API_ROOT:
+            # rootUrl задаёт адрес и обычных, и batch-запросов.
+            parsed = json.loads(document)
+            parsed["rootUrl"] = GOOGLE_API_ROOT.rstrip("/") + "/"
+            document = json.dumps(parsed)
+        _documents[(api, version)] = document
+    return document
+
+
+def get_service(api, version, credentials):
+    # Ключ по id() безопасен: запись держит ссылку на сами учётные данные.
+    key = (id(credentials), api, version)
+    with _lock:
+        entry = _services.get(key)
+        if entry is not None and entry[0] is credentials:
+            _services.move_to_end(key)
+            metrics.inc("google_service_cache_hits", api=api)
+            return entry[1]
+
+        metrics.inc("google_service_cache_misses", api=api)
+        # discovery тянет за собой заметную часть старта, поэтому
+        # импортируется при первом обращении (или в фоне через preload).
+        from googleapiclient.discovery import build_from_document
+
+        # Запросы выполняются через thread_http; _base_http клиента лишь
+        # несёт учётные данные.
+        service = build_from_document(_document(api, version), http=AuthorizedHttp(credentials, http=_base_http))
+        _services[key] = (credentials, service)
+        while len(_services) > SERVICE_CACHE_SIZE:
+            _services.popitem(last=False)
+            metrics.inc("google_service_cache_evictions")
+        logging.debug(f"Создан клиент Google API {api} {version}: {stats()}")
+        return service
+
+
+def preload():
+    importlib.import_module("googleapiclient.discovery")
+    with _lock:
+        _document("tasks", "v1")
+        _document("calendar", "v3")
+
+
+def stats():
+    snapshot = metrics.snapshot()["counters"]
+    hits = sum(v for (name, _), v in snapshot.items() if name == "google_service_cache_hits")
+    misses = sum(v for (name, _), v in snapshot.items() if name == "google_service_cache_misses")
+    return {"hits": int(hits), "misses": int(misses), "services": len(_services)}
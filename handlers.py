@@ -1,57 +1,163 @@
-from telegram.ext import CommandHandler, MessageHandler, ConversationHandler, filters
-from tasks import *
-from events import *
-from menu import start, cancel
+import functools
 
-from tasks import (
-    addtask_start, received_task_text, received_task_date, received_task_duration,
-    done_start, mark_selected_done, list_tasks
-)
+from telegram import Update
+from telegram.ext import BaseHandler, MessageHandler, ConversationHandler, filters
+
+import tracing
+from accounts import ASK_LINK_CODE, link_start, received_link_code, unlink
+from digest import digest_command, remind_command
 from events import (
+    ASK_EVENT_TITLE, ASK_EVENT_DATE, ASK_EVENT_START, ASK_EVENT_END,
     addevent_start, received_event_title, received_event_date,
-    received_event_start, received_event_end
+    received_event_start, received_event_end,
+)
+from freebusy import free_command
+from menu import CANCEL_BUTTON, start, cancel, ai_chat
+from overdue import overdue_tasks
+from tasks import (
+    ASK_TASK_TEXT, ASK_TASK_DATE, ASK_TASK_DURATION, ASK_DONE_INDEX, ASK_DONE_CONFIRM,
+    addtask_start, received_task_text, received_task_date, received_task_duration,
+    done_start, mark_selected_done, confirm_selected_done, list_tasks,
 )
+from today import today_tasks, week_tasks
+
+def _instrument(callback, conversation=None):
+    # Гистограмма handler_seconds и счётчик handler_errors по обработчику;
+    # внутри диалога обработчик однозначно задаёт его состояние.
+    labels = {"handler": callback.__name__, "conversation": conversation or ""}
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        with tracing.span("handler", **labels) as span:
+            if update.effective_user is not None:
+                span.attributes["user_id"] = update.effective_user.id
+            return await callback(update, context)
+
+    return wrapper
+
+class Router(BaseHandler):
+    # Команды и кнопки клавиатуры ищутся по словарю за одну проверку вместо
+    # перебора CommandHandler/Regex по очереди. Маршруты с background=True
+    # (только чтение) выполняются в отдельной задаче и не задерживают
+    # обработку следующих обновлений.
+    def __init__(self, commands=None, buttons=None, background=(), conversation=None):
+        super().__init__(self._unused, block=True)
+        self.commands = {}
+        self.buttons = {}
+        for name, callback in (commands or {}).items():
+            self.commands[name.lower()] = (_instrument(callback, conversation), name in background)
+        for text, callback in (buttons or {}).items():
+            self.buttons[text] = (_instrument(callback, conversation), text in background)
+
+    @staticmethod
+    async def _unused(update, context):
+        raise RuntimeError("Router вызывает обработчик маршрута напрямую")
+
+    def check_update(self, update):
+        if not isinstance(update, Update) or update.message is None or not update.message.text:
+            return None
+        text = update.message.text
+        if not text.startswith("/"):
+            return self.buttons.get(text)
+        command, _, username = text.split(maxsplit=1)[0][1:].partition("@")
+        if username and username.lower() != (update.get_bot().username or "").lower():
+            return None
+        return self.commands.get(command.lower())
+
+    def collect_additional_context(self, context, update, application, check_result):
+        if update.message.text.startswith("/"):
+            context.args = update.message.text.split()[1:]
 
-def setup_handlers(app):
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("listtasks", list_tasks))
-    app.add_handler(CommandHandler("done", done_start))
-    app.add_handler(CommandHandler("addtask", addtask_start))
-    app.add_handler(CommandHandler("addevent", addevent_start))
-    app.add_handler(MessageHandler(filters.Regex("^📋 Показать задачи$"), list_tasks))
-    app.add_handler(MessageHandler(filters.Regex("^✅ Завершить задачу$"), done_start))
-    app.add_handler(MessageHandler(filters.Regex("^📝 Добавить задачу$"), addtask_start))
-    app.add_handler(MessageHandler(filters.Regex("^📅 Добавить встречу$"), addevent_start))
-    app.add_handler(MessageHandler(filters.Regex("^❌ Отменить$"), cancel))
+    async def handle_update(self, update, application, check_result, context):
+        self.collect_additional_context(context, update, application, check_result)
+        callback, background = check_result
+        if background:
+            application.create_task(callback(update, context), update=update)
+            return None
+        return await callback(update, context)
 
+# Кнопка «Отменить» — тоже текст: без исключения шаг диалога принял бы её
+# за ответ раньше, чем дойдёт до fallbacks.
+_ANSWER = filters.TEXT & ~filters.COMMAND & ~filters.Text([CANCEL_BUTTON])
+
+def _text(callback, conversation):
+    return MessageHandler(_ANSWER, _instrument(callback, conversation))
+
+def setup_handlers(app, persistent=False):
+    # Меню и команды без диалога. Добавлен первым, поэтому кнопки меню
+    # работают и посреди диалога.
+    app.add_handler(Router(
+        commands={
+            "start": start,
+            "listtasks": list_tasks,
+            "today": today_tasks,
+            "overdue": overdue_tasks,
+            "week": week_tasks,
+            "ai": ai_chat,
+            "digest": digest_command,
+            "remind": remind_command,
+            "unlink": unlink,
+            "free": free_command,
+        },
+        buttons={
+            "📋 Показать задачи": list_tasks,
+            "📆 Сегодня": today_tasks,
+            "⏰ Просроченные": overdue_tasks,
+        },
+        background={"listtasks", "today", "overdue", "week", "ai", "free",
+                    "📋 Показать задачи", "📆 Сегодня", "⏰ Просроченные"},
+    ))
+
+    cancel_route = Router(commands={"cancel": cancel}, buttons={CANCEL_BUTTON: cancel})
+
+    # Команды, начинающие диалог, регистрируются только как точки входа диалогов
     app.add_handler(ConversationHandler(
-        entry_points=[CommandHandler("addtask", addtask_start)],
+        entry_points=[Router(commands={"addtask": addtask_start}, buttons={"📝 Добавить задачу": addtask_start}, conversation="addtask")],
         states={
-            ASK_TASK_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_task_text)],
-            ASK_TASK_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_task_date)],
-            ASK_TASK_DURATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_task_duration)],
+            ASK_TASK_TEXT: [_text(received_task_text, "addtask")],
+            ASK_TASK_DATE: [_text(received_task_date, "addtask")],
+            ASK_TASK_DURATION: [_text(received_task_duration, "addtask")],
         },
-        fallbacks=[CommandHandler("cancel", cancel)],
-        allow_reentry=True
+        fallbacks=[cancel_route],
+        allow_reentry=True,
+        name="addtask",
+        persistent=persistent,
     ))
 
     app.add_handler(ConversationHandler(
-        entry_points=[CommandHandler("done", done_start)],
+        entry_points=[Router(commands={"addevent": addevent_start}, buttons={"📅 Добавить встречу": addevent_start}, conversation="addevent")],
         states={
-            ASK_DONE_INDEX: [MessageHandler(filters.TEXT & ~filters.COMMAND, mark_selected_done)],
+            ASK_EVENT_TITLE: [_text(received_event_title, "addevent")],
+            ASK_EVENT_DATE: [_text(received_event_date, "addevent")],
+            ASK_EVENT_START: [_text(received_event_start, "addevent")],
+            ASK_EVENT_END: [_text(received_event_end, "addevent")],
         },
-        fallbacks=[CommandHandler("cancel", cancel)],
-        allow_reentry=True
+        fallbacks=[cancel_route],
+        allow_reentry=True,
+        name="addevent",
+        persistent=persistent,
     ))
 
     app.add_handler(ConversationHandler(
-        entry_points=[CommandHandler("addevent", addevent_start)],
+        entry_points=[Router(commands={"done": done_start}, buttons={"✅ Завершить задачу": done_start}, conversation="done")],
         states={
-            ASK_EVENT_TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_event_title)],
-            ASK_EVENT_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_event_date)],
-            ASK_EVENT_START: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_event_start)],
-            ASK_EVENT_END: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_event_end)],
+            ASK_DONE_INDEX: [_text(mark_selected_done, "done")],
+            ASK_DONE_CONFIRM: [_text(confirm_selected_done, "done")],
         },
-        fallbacks=[CommandHandler("cancel", cancel)],
-        allow_reentry=True
+        fallbacks=[cancel_route],
+        allow_reentry=True,
+        name="done",
+        persistent=persistent,
     ))
+
+    app.add_handler(ConversationHandler(
+        entry_points=[Router(commands={"link": link_start}, conversation="link")],
+        states={
+            ASK_LINK_CODE: [_text(received_link_code, "link")],
+        },
+        fallbacks=[cancel_route],
+        allow_reentry=True,
+    ))
+
+    # /cancel вне диалога
+    app.add_handler(cancel_route)
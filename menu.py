@@ -1,25 +1,45 @@
 from telegram import Update, ReplyKeyboardMarkup
-from telegram.ext import ContextTypes
+from telegram.ext import ContextTypes, ConversationHandler
+import ai
+from tasks import forget_done_state
+
+CANCEL_BUTTON = "❌ Отменить"
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    menu = """
-👋 Привет! Я бот-планировщик. Вот что я умею:
+    menu = """👋 Привет! Я бот-планировщик. Вот что я умею:
 
-📝 /addtask — добавить задачу с датой и временем
+📝 /addtask — добавить задачу (/addtask купить молоко в пятницу; несколько — по одной на строку)
 📋 /listtasks — показать список всех активных задач
-✅ /done — выбрать и отметить задачу как выполненную
-📅 /addevent — запланировать встречу в Google Календарь
+✅ /done — выбрать и отметить задачу как выполненную (/done 1 3 5-8 — сразу несколько)
+📅 /addevent — запланировать встречу (/addevent Созвон завтра 14:30-15:30)
+🟢 /free — свободные окна на неделю (/free завтра на час — на конкретный день)
 📆 /today — показать задачи и встречи на сегодня
 ⏰ /overdue — показать просроченные задачи
+🗓 /week — показать задачи на эту неделю
+☀️ /digest 09:00 — присылать сводку на день каждое утро (/digest off — выключить)
+🔔 /remind — напоминать о встречах заранее (/remind off — выключить)
+🤖 /ai — общаться с ИИ (через Hugging Face Inference API)
+🔗 /link — подключить свой Google-аккаунт (/unlink — отключить)
 ❌ /cancel — отменить текущую операцию
-    """
+"""
     keyboard = [["📝 Добавить задачу", "📋 Показать задачи"],
                 ["✅ Завершить задачу", "📅 Добавить встречу"],
                 ["📆 Сегодня", "⏰ Просроченные"],
-                ["❌ Отменить"]]
+                [CANCEL_BUTTON]]
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     await update.message.reply_text(menu + "\n\nВыберите действие с помощью кнопок ниже:", reply_markup=reply_markup)
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ai.pipeline.cancel(update.effective_user.id)
+    forget_done_state(context)
     await update.message.reply_text("❌ Действие отменено.")
     return ConversationHandler.END
+
+async def ai_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text
+    prompt = text[3:].strip() if text.startswith("/ai") else text.strip()
+    if not prompt:
+        await update.message.reply_text("Введите сообщение после команды /ai для общения с ИИ.")
+        return
+    # Генерация идёт в фоне: ответ потоково дописывается в одно сообщение
+    await ai.pipeline.submit(update.effective_user.id, prompt, update.message, context.application)
@@ -0,0 +1,139 @@
+import asyncio
+import bisect
+import logging
+import os
+import threading
+from collections import defaultdict
+
+# Простейший реестр счётчиков, gauge-метрик и гистограмм процесса.
+# Ключ — имя метрики и отсортированный набор меток.
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_histograms = {}
+
+# Границы корзин гистограмм задержек, в секундах.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Порт HTTP-эндпоинта /metrics в формате Prometheus; 0 — не запускать.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+_server = None
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    index = bisect.bisect_left(BUCKETS, value)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            # [счётчики корзин (последняя — +Inf), сумма, количество]
+            histogram = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+        histogram[0][index] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+def get(name, **labels):
+    key = _key(name, labels)
+    with _lock:
+        if key in _gauges:
+            return _gauges[key]
+        return _counters.get(key, 0)
+
+
+def snapshot():
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "histograms": {key: (list(buckets), total, count) for key, (buckets, total, count) in _histograms.items()},
+        }
+
+
+def _labels(labels, extra=()):
+    pairs = [(name, str(value)) for name, value in labels if value is not None] + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def render():
+    # Текстовый формат Prometheus (exposition format 0.0.4).
+    data = snapshot()
+    lines = []
+    typed = set()
+
+    def declare(name, kind):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in sorted(data["counters"].items()):
+        name = name if name.endswith("_total") else f"{name}_total"
+        declare(name, "counter")
+        lines.append(f"{name}{_labels(labels)} {value:g}")
+    for (name, labels), value in sorted(data["gauges"].items()):
+        declare(name, "gauge")
+        lines.append(f"{name}{_labels(labels)} {value:g}")
+    for (name, labels), (buckets, total, count) in sorted(data["histograms"].items()):
+        declare(name, "histogram")
+        cumulative = 0
+        for bound, hits in zip(BUCKETS + ("+Inf",), buckets):
+            cumulative += hits
+            lines.append(f"{name}_bucket{_labels(labels, [('le', str(bound))])} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {total:g}")
+        lines.append(f"{name}_count{_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+async def _handle(reader, writer):
+    try:
+        request = await asyncio.wait_for(reader.readline(), 10)
+        while (await asyncio.wait_for(reader.readline(), 10)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request.split()
+        if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+            status, body = "200 OK", render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(port=None):
+    # Отдельный маленький HTTP-сервер: в режиме polling у бота нет своего.
+    global _server
+    port = METRICS_PORT if port is None else port
+    if not port or _server is not None:
+        return
+    _server = await asyncio.start_server(_handle, "0.0.0.0", port)
+    logging.info(f"Метрики Prometheus: http://0.0.0.0:{port}/metrics")
+
+
+async def stop_server():
+    global _server
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
+        _server = None
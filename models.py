@@ -0,0 +1,67 @@
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from auth_utils import MINSK_TZ
+
+
+@lru_cache(maxsize=4096)
+def parse_due(due):
+    # Tasks API хранит срок как полночь UTC, поэтому различных значений
+    # столько же, сколько различных дат, и разбор кэшируется по строке.
+    return datetime.strptime(due, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc).astimezone(MINSK_TZ)
+
+
+@lru_cache(maxsize=4096)
+def parse_event_time(value, all_day):
+    if all_day:
+        return MINSK_TZ.localize(datetime.strptime(value, "%Y-%m-%d"))
+    return datetime.fromisoformat(value).astimezone(MINSK_TZ)
+
+
+class Task:
+    __slots__ = ("id", "title", "notes", "due")
+
+    def __init__(self, id, title, notes=None, due=None):
+        self.id = id
+        self.title = title
+        self.notes = notes
+        self.due = due
+
+    @classmethod
+    def from_api(cls, item):
+        due = item.get('due')
+        return cls(
+            item['id'],
+            item.get('title', ''),
+            item.get('notes') or None,
+            parse_due(due) if due else None,
+        )
+
+    def __repr__(self):
+        return f"Task({self.id!r}, {self.title!r}, due={self.due})"
+
+
+class Event:
+    __slots__ = ("id", "summary", "start", "end", "all_day")
+
+    def __init__(self, id, summary, start, end, all_day=False):
+        self.id = id
+        self.summary = summary
+        self.start = start
+        self.end = end
+        self.all_day = all_day
+
+    @classmethod
+    def from_api(cls, item):
+        all_day = 'dateTime' not in item['start']
+        key = 'date' if all_day else 'dateTime'
+        return cls(
+            item['id'],
+            item.get('summary', 'Без названия'),
+            parse_event_time(item['start'][key], all_day),
+            parse_event_time(item['end'][key], all_day),
+            all_day,
+        )
+
+    def __repr__(self):
+        return f"Event({self.id!r}, {self.summary!r}, start={self.start})"
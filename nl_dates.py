@@ -0,0 +1,303 @@
+import asyncio
+import logging
+import re
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+# Разбор дат и времени из фраз вроде «Созвон завтра 14:30-15:30» или
+# «купить молоко в пятницу». Частые обороты разбираются заранее
+# скомпилированными регулярками за микросекунды; dateparser (медленный и
+# в импорте, и в вызове) загружается, только если регулярки ничего не нашли,
+# а в тексте есть что-то похожее на дату. Обработчики зовут parse_async:
+# тогда dateparser работает в потоке и не держит event loop.
+
+
+class When(NamedTuple):
+    rest: str
+    date: Optional[date] = None
+    start: Optional[time] = None
+    end: Optional[time] = None
+
+
+# По первым двум буквам: и полное название, и сокращение («пятница», «пт»).
+WEEKDAYS = {
+    "пн": 0, "по": 0, "вт": 1, "ср": 2, "чт": 3, "че": 3, "пт": 4, "пя": 4,
+    "сб": 5, "су": 5, "вс": 6, "во": 6,
+}
+MONTHS = {
+    "янв": 1, "фев": 2, "мар": 3, "апр": 4, "ма": 5, "июн": 6,
+    "июл": 7, "авг": 8, "сен": 9, "окт": 10, "ноя": 11, "дек": 12,
+}
+# Дальше этого «через N дней/недель/месяцев» и «на N часов» не разбираются.
+MAX_AHEAD_DAYS = 3650
+COUNTS = {"одну": 1, "один": 1, "одни": 1, "два": 2, "две": 2, "пару": 2, "три": 3}
+
+_F = re.IGNORECASE
+_RELATIVE = re.compile(r"\b(сегодня|послезавтра|завтра)\b", _F)
+_WEEKDAY = re.compile(
+    r"\b(?:(?:в|во)\s+)?(?:(следующ(?:ий|ую|ее|ей))\s+)?"
+    r"(понедельник|вторник|сред[ау]|четверг|пятниц[ау]|суббот[ау]|воскресенье|пн|вт|ср|чт|пт|сб|вс)\b",
+    _F,
+)
+_IN = re.compile(
+    r"\bчерез\s+(?:(\d+|одну|один|одни|два|две|пару|три)\s+)?(день|дня|дней|недел[юиь]|недель|месяц|месяца|месяцев)\b",
+    _F,
+)
+_NUMERIC_DATE = re.compile(
+    r"(?:\b(к|ко|до|на|с|со|по|от|в|во)\s+)?(?<![\w.,])(\d{1,2})\.(\d{1,2})(?:\.(\d{4}|\d{2}))?(?![.,]?\d)(?!\w)",
+    _F,
+)
+_TEXT_DATE = re.compile(
+    r"\b(\d{1,2})(?:-?го)?\s+(январ[яь]|феврал[яь]|марта?|апрел[яь]|ма[яй]|июн[яь]|июл[яь]|августа?"
+    r"|сентябр[яь]|октябр[яь]|ноябр[яь]|декабр[яь])(?:\s+(\d{4})(?:\s*(?:года|г\.?))?)?(?!\w)",
+    _F,
+)
+_DAY_OF_MONTH = re.compile(r"\b(\d{1,2})(?:-?го)?\s+числа\b", _F)
+_RANGE = re.compile(
+    r"(?:\bс\s+)?\b(\d{1,2}):(\d{2})\s*(?:-|–|—|до)\s*(\d{1,2}):(\d{2})\b"
+    r"|\bс\s+(\d{1,2})(?::(\d{2}))?\s+до\s+(\d{1,2})(?::(\d{2}))?\b",
+    _F,
+)
+_DURATION_PATTERN = r"\bна\s+(?:(полчаса)|(?:(\d+|полтора|два|три)\s+)?(час|часа|часов|минут[уы]?|мин)\b)"
+_DURATION = re.compile(_DURATION_PATTERN, _F)
+# Время с минутами: «14:30», «в 9:15 утра».
+_CLOCK = re.compile(r"(?:\b(?:в|во)\s+)?\b(\d{1,2}):(\d{2})(?:\s+(утра|дня|вечера|ночи))?\b", _F)
+# Час без минут — только «в 9 вечера», «в 15» в конце фразы или «в 15 на час»:
+# в «позвонить в 5 отделов» или «в 3 корпусе» число относится к слову за ним.
+_HOUR = re.compile(
+    r"\b(?:в|во)\s+(\d{1,2})(?:\s+(утра|дня|вечера|ночи)\b|(?=[\s.,;!]*$)|(?=\s+" + _DURATION_PATTERN + r"))",
+    _F,
+)
+# Признаки даты, которую не разобрали регулярки: тогда есть смысл звать dateparser.
+_SUSPECT = re.compile(
+    r"\d{4}-\d{1,2}-\d{1,2}|\d{1,2}/\d{1,2}|\d+\s*(?:-?го|числа)\b|январ|феврал|март|апрел|июн|июл|август|сентябр|октябр|ноябр|декабр"
+    r"|недел|месяц|выходн",
+    _F,
+)
+_SPACES = re.compile(r"\s+")
+# Предлог, оставшийся от вырезанной даты: «Отчёт к 1-го ноября» → «Отчёт».
+_DANGLING = re.compile(r"\s+(?:к|ко|в|во|на|до|с|со)$", _F)
+_EDGES = " ,.;:-–—"
+
+
+def _year(value, default):
+    if value is None:
+        return default
+    year = int(value)
+    return year + 2000 if year < 100 else year
+
+
+def _upcoming(today, month, day, year=None):
+    # Дата без года — ближайшая такая же, не раньше сегодняшней.
+    try:
+        result = date(_year(year, today.year), month, day)
+        if year is None and result < today:
+            result = date(today.year + 1, month, day)
+        return result
+    except ValueError:
+        return None
+
+
+def _clock(hour, minute, part=None):
+    hour, minute = int(hour), int(minute or 0)
+    if part is not None:
+        part = part.lower()
+        if part in ("дня", "вечера") and hour < 12:
+            hour += 12
+        elif part == "ночи" and hour == 12:
+            hour = 0
+    if hour > 23 or minute > 59:
+        return None
+    return time(hour, minute)
+
+
+def _match_date(text, today):
+    match = _RELATIVE.search(text)
+    if match:
+        offset = {"сегодня": 0, "завтра": 1, "послезавтра": 2}[match.group(1).lower()]
+        return match, today + timedelta(days=offset)
+
+    match = _TEXT_DATE.search(text)
+    if match:
+        month = next(number for stem, number in MONTHS.items() if match.group(2).lower().startswith(stem))
+        result = _upcoming(today, month, int(match.group(1)), match.group(3))
+        if result is not None:
+            return match, result
+
+    for match in _NUMERIC_DATE.finditer(text):
+        preposition, day, month, year = match.groups()
+        # «python 3.11», «глава 3.2» — не даты: без предлога, года или
+        # формата ДД.ММ число с точкой принимается за дату, только если
+        # кроме него в тексте ничего нет.
+        if not (preposition or year or len(day) == len(month) == 2 or match.group(0) == text.strip(_EDGES)):
+            continue
+        result = _upcoming(today, int(month), int(day), year)
+        if result is not None:
+            return match, result
+
+    match = _DAY_OF_MONTH.search(text)
+    if match:
+        # «3 числа» — ближайшее третье число, в этом месяце или следующем
+        day = int(match.group(1))
+        for shift in range(3):
+            month = today.month - 1 + shift
+            result = _upcoming(today, month % 12 + 1, day, today.year + month // 12)
+            if result is not None and result >= today:
+                return match, result
+
+    match = _WEEKDAY.search(text)
+    if match:
+        weekday = WEEKDAYS[match.group(2).lower()[:2]]
+        if match.group(1):
+            # «в следующую пятницу» — пятница следующей недели
+            return match, today + timedelta(days=7 - today.weekday() + weekday)
+        return match, today + timedelta(days=(weekday - today.weekday()) % 7)
+
+    match = _IN.search(text)
+    if match:
+        count = match.group(1)
+        count = 1 if count is None else int(count) if count.isdigit() else COUNTS[count.lower()]
+        unit = match.group(2).lower()
+        if count > MAX_AHEAD_DAYS:
+            # «через 99999999 дней» — не дата
+            return None, None
+        if unit.startswith("д"):
+            return match, today + timedelta(days=count)
+        if unit.startswith("н"):
+            return match, today + timedelta(weeks=count)
+        month = today.month - 1 + count
+        year, month = today.year + month // 12, month % 12 + 1
+        for day in (today.day, 30, 29, 28):
+            try:
+                return match, date(year, month, day)
+            except ValueError:
+                continue
+    return None, None
+
+
+def _match_times(text):
+    match = _RANGE.search(text)
+    if match:
+        groups = match.groups()
+        start_hour, start_minute, end_hour, end_minute = groups[:4] if groups[0] is not None else groups[4:]
+        start, end = _clock(start_hour, start_minute), _clock(end_hour, end_minute)
+        if start is not None and end is not None:
+            return match, start, end
+
+    # Явное «14:30» важнее часа без минут, даже если тот стоит раньше
+    for pattern in (_CLOCK, _HOUR):
+        for match in pattern.finditer(text):
+            start = _clock(*match.groups()) if pattern is _CLOCK else _clock(match.group(1), 0, match.group(2))
+            if start is not None:
+                return match, start, None
+    return None, None, None
+
+
+def _duration(match):
+    if match.group(1):
+        return timedelta(minutes=30)
+    count = match.group(2)
+    value = {None: 1, "полтора": 1.5, "два": 2, "три": 3}.get(count)
+    if value is None:
+        value = int(count)
+    minutes = value if match.group(3).lower().startswith("мин") else value * 60
+    if minutes > MAX_AHEAD_DAYS * 24 * 60:
+        return None
+    return timedelta(minutes=minutes)
+
+
+def _cut(text, match):
+    return text[:match.start()] + " " + text[match.end():]
+
+
+@lru_cache(maxsize=4096)
+def _fast(text, today):
+    # Только регулярки; rest ещё не подчищен.
+    rest = text
+    match, found_date = _match_date(rest, today)
+    if match:
+        rest = _cut(rest, match)
+
+    match, start, end = _match_times(rest)
+    if match:
+        rest = _cut(rest, match)
+        if end is None:
+            duration = _DURATION.search(rest)
+            length = _duration(duration) if duration else None
+            if length is not None:
+                rest = _cut(rest, duration)
+                end = (datetime.combine(today, start) + length).time()
+    return When(rest, found_date, start, end)
+
+
+def _needs_fallback(when):
+    return when.date is None and _SUSPECT.search(when.rest) is not None
+
+
+@lru_cache(maxsize=4096)
+def parse(text, today):
+    # today передаётся явно: от него зависят «завтра» и «в пятницу», и он же
+    # входит в ключ кэша.
+    when = _fast(text, today)
+    rest, found_date, start, end = when
+    if _needs_fallback(when):
+        fallback = _dateparser(rest, today)
+        if fallback is not None:
+            phrase, parsed = fallback
+            rest = rest.replace(phrase, " ", 1)
+            found_date = parsed.date()
+            if start is None and parsed.time() != time(0, 0):
+                start = parsed.time()
+
+    rest = _DANGLING.sub("", _SPACES.sub(" ", rest).strip(_EDGES)).strip(_EDGES)
+    return When(rest, found_date, start, end)
+
+
+async def parse_async(text, today):
+    # Как parse, но dateparser (десятки миллисекунд на вызов) — в потоке.
+    if _needs_fallback(_fast(text, today)):
+        return await asyncio.to_thread(parse, text, today)
+    return parse(text, today)
+
+
+async def parse_date(text, today):
+    # Для шага диалога: весь ответ должен быть датой.
+    when = await parse_async(text.strip(), today)
+    return when.date if not when.rest and when.start is None else None
+
+
+def parse_duration(text):
+    # «на час», «на 30 минут», «на полчаса»
+    match = _DURATION.search(text)
+    return _duration(match) if match else None
+
+
+def parse_time(text):
+    # Для шага диалога: весь ответ — время («14:30», «в 9 вечера», «14»).
+    text = text.strip()
+    if text.isdigit() and len(text) <= 2:
+        return _clock(text, 0)
+    match = _CLOCK.fullmatch(text)
+    if match is not None:
+        return _clock(*match.groups())
+    match = _HOUR.fullmatch(text)
+    if match is not None:
+        return _clock(match.group(1), 0, match.group(2))
+    return None
+
+
+def _dateparser(text, today):
+    try:
+        from dateparser.search import search_dates
+    except ImportError:
+        return None
+    try:
+        found = search_dates(text, languages=["ru"], settings={
+            "RELATIVE_BASE": datetime.combine(today, time(0, 0)),
+            "PREFER_DATES_FROM": "future",
+        })
+    except Exception as e:
+        logging.warning(f"dateparser не разобрал '{text}': {e}")
+        return None
+    return found[0] if found else None
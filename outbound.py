@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import os
+import random
+from collections import OrderedDict
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+from telegram.ext import BaseRateLimiter
+
+import metrics
+import tracing
+from ratelimit import TokenBucket
+
+TELEGRAM_LIMIT = 4096
+# Лимиты Bot API: около 30 сообщений в секунду на бота, 1 в секунду в личный
+# чат (с небольшим запасом на всплески) и 20 в минуту в группу.
+GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+GROUP_RATE = float(os.getenv("TELEGRAM_GROUP_RATE", str(20 / 60)))
+MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+BACKOFF_BASE = 0.5
+MAX_CHAT_BUCKETS = 10000
+
+
+def _length(text):
+    # Telegram считает длину сообщения в UTF-16, эмодзи занимают две единицы.
+    return len(text.encode("utf-16-le")) // 2
+
+
+def split_message(text, limit=TELEGRAM_LIMIT):
+    # Режет текст по границам строк; строки длиннее лимита режутся по символам.
+    parts = []
+    current = ""
+    for line in text.split("\n"):
+        while _length(line) > limit:
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(line[:limit // 2])
+            line = line[limit // 2:]
+        candidate = f"{current}\n{line}" if current else line
+        if _length(candidate) > limit:
+            parts.append(current)
+            current = line
+        else:
+            current = candidate
+    if current or not parts:
+        parts.append(current)
+    return parts
+
+
+async def reply_long(message, text, **kwargs):
+    # Клавиатура и прочие параметры прикрепляются к последней части.
+    parts = split_message(text)
+    sent = []
+    for i, part in enumerate(parts):
+        sent.append(await message.reply_text(part, **(kwargs if i == len(parts) - 1 else {})))
+    return sent
+
+
+async def send_long(bot, chat_id, text):
+    return [await bot.send_message(chat_id, part) for part in split_message(text)]
+
+
+class OutboundLimiter(BaseRateLimiter):
+    # Все запросы бота к Bot API проходят через общий token bucket и
+    # отдельный bucket своего чата. RetryAfter и сетевые сбои повторяются
+    # с паузой, поэтому ответ не теряется из-за flood control.
+    def __init__(self, global_rate=None):
+        rate = global_rate or GLOBAL_RATE
+        self._global = TokenBucket(rate, max(int(rate), 1))
+        self._chats = OrderedDict()
+        self._waiting = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(GROUP_RATE)
+            else:
+                bucket = TokenBucket(CHAT_RATE, CHAT_BURST)
+            self._chats[chat_id] = bucket
+            if len(self._chats) > MAX_CHAT_BUCKETS:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint == "getUpdates":
+            return await callback(*args, **kwargs)
+
+        # Спан охватывает и ожидание лимитера, и повторы: это время, которое
+        # видит обработчик.
+        with tracing.span("telegram_api", endpoint=endpoint):
+            return await self._send(callback, args, kwargs, endpoint, data)
+
+    async def _send(self, callback, args, kwargs, endpoint, data):
+        self._waiting += 1
+        metrics.set_gauge("telegram_send_queue_depth", self._waiting)
+        try:
+            chat_id = data.get("chat_id")
+            if chat_id is not None:
+                await self._chat_bucket(chat_id).acquire()
+            await self._global.acquire()
+        finally:
+            self._waiting -= 1
+            metrics.set_gauge("telegram_send_queue_depth", self._waiting)
+
+        attempt = 0
+        while True:
+            try:
+                result = await callback(*args, **kwargs)
+                metrics.inc("telegram_requests", endpoint=endpoint)
+                return result
+            except RetryAfter as e:
+                if attempt >= MAX_RETRIES:
+                    raise
+                metrics.inc("telegram_retry_after", endpoint=endpoint)
+                logging.warning(f"Flood control Telegram ({endpoint}), повтор через {e.retry_after} с")
+                await asyncio.sleep(e.retry_after)
+            except BadRequest:
+                raise
+            except NetworkError as e:
+                # Таймаут отправки мог дойти до Telegram — повторять его
+                # можно только для запросов на чтение.
+                if attempt >= MAX_RETRIES or (isinstance(e, TimedOut) and not endpoint.startswith("get")):
+                    raise
+                metrics.inc("telegram_send_retries", endpoint=endpoint)
+                await asyncio.sleep(BACKOFF_BASE * 2 ** attempt * random.uniform(0.5, 1.5))
+            attempt += 1
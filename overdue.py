@@ -1,27 +1,23 @@
 from telegram import Update
 from telegram.ext import ContextTypes
-from auth import get_credentials
+import task_cache
 from auth_utils import MINSK_TZ
-from googleapiclient.discovery import build
-from datetime import datetime, timezone
+from formatting import format_russian_date, format_task_line
+from outbound import reply_long
+from datetime import datetime
+
+def render_overdue(index, now):
+    overdue = index.overdue_before(now)
+    if not overdue:
+        return None
+
+    lines = ["⏰ Просроченные задачи:"]
+    for day, tasks in index.by_date(overdue):
+        lines.append(f"\n{format_russian_date(day)}")
+        lines.extend(format_task_line(task) for task in tasks)
+    return "\n".join(lines)
 
 async def overdue_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    creds = get_credentials()
-    now = datetime.now(MINSK_TZ)
-    service = build("tasks", "v1", credentials=creds)
-    result = service.tasks().list(tasklist='@default', showCompleted=False).execute()
-    tasks = result.get('items', [])
-    overdue = []
-    for task in tasks:
-        due = task.get("due")
-        if due:
-            try:
-                due_dt = datetime.strptime(due, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc).astimezone(MINSK_TZ)
-                if due_dt < now:
-                    overdue.append(f"❗ {task['title']} (на {due_dt.strftime('%d.%m.%Y')})")
-            except Exception:
-                continue
-    if overdue:
-        await update.message.reply_text("⏰ Просроченные задачи:\n" + "\n".join(overdue))
-    else:
-        await update.message.reply_text("✅ У тебя нет просроченных задач!")
+    index = await task_cache.get_index(update.effective_user.id)
+    text = render_overdue(index, datetime.now(MINSK_TZ))
+    await reply_long(update.message, text or "✅ У тебя нет просроченных задач!")
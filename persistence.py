@@ -0,0 +1,275 @@
+import asyncio
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+from urllib.parse import urlparse
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import metrics
+
+PERSISTENCE_BACKEND = os.getenv("PERSISTENCE", "sqlite")
+PERSISTENCE_PATH = os.getenv("PERSISTENCE_PATH", "bot_state.sqlite3")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Как часто Application отдаёт накопленные изменения в persistence.
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "5"))
+
+
+def _encode_key(key):
+    return json.dumps(list(key) if isinstance(key, tuple) else key)
+
+
+def _decode_key(raw):
+    key = json.loads(raw)
+    return tuple(key) if isinstance(key, list) else key
+
+
+class SQLiteBackend:
+    # Хранилище ключ-значение в одной таблице; запросы выполняются в потоке,
+    # чтобы не блокировать event loop.
+    def __init__(self, path=PERSISTENCE_PATH):
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (kind TEXT, key TEXT, value BLOB, PRIMARY KEY (kind, key))"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def _load(self, kind):
+        with self._lock:
+            rows = self._conn.execute("SELECT key, value FROM kv WHERE kind = ?", (kind,)).fetchall()
+        return {_decode_key(key): pickle.loads(value) for key, value in rows}
+
+    def _write(self, ops):
+        with self._lock, self._conn:
+            for (kind, key), value in ops:
+                if value is None:
+                    self._conn.execute("DELETE FROM kv WHERE kind = ? AND key = ?", (kind, _encode_key(key)))
+                else:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO kv (kind, key, value) VALUES (?, ?, ?)",
+                        (kind, _encode_key(key), value),
+                    )
+
+    async def load(self, kind):
+        return await asyncio.to_thread(self._load, kind)
+
+    async def write(self, ops):
+        await asyncio.to_thread(self._write, ops)
+
+    async def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisError(RuntimeError):
+    pass
+
+
+class RedisBackend:
+    # Минимальный клиент протокола Redis (RESP2): каждый вид данных — хэш
+    # planner:<kind>, все изменения пачки отправляются одним пайплайном.
+    def __init__(self, url=REDIS_URL):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    async def _connect(self):
+        if self._writer is not None and not self._writer.is_closing():
+            return
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", str(self.db)))
+        if setup:
+            await self._pipeline(setup)
+
+    @staticmethod
+    def _encode(args):
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    async def _read_reply(self):
+        line = (await self._reader.readline()).rstrip(b"\r\n")
+        prefix, payload = line[:1], line[1:]
+        if prefix == b"+":
+            return payload.decode()
+        if prefix == b"-":
+            # Ошибку возвращаем как значение: ответы на остальные команды
+            # пайплайна ещё лежат в сокете, и их нужно дочитать
+            return RedisError(f"Redis: {payload.decode()}")
+        if prefix == b":":
+            return int(payload)
+        if prefix == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2]
+        if prefix == b"*":
+            count = int(payload)
+            if count < 0:
+                return None
+            return [await self._read_reply() for _ in range(count)]
+        raise RuntimeError(f"Redis: неожиданный ответ {line!r}")
+
+    async def _pipeline(self, commands):
+        self._writer.write(b"".join(self._encode(command) for command in commands))
+        await self._writer.drain()
+        replies = [await self._read_reply() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    async def _run(self, commands):
+        async with self._lock:
+            try:
+                await self._connect()
+                return await self._pipeline(commands)
+            except BaseException:
+                # После любого сбоя поток ответов мог разойтись с запросами:
+                # следующий вызов откроет новое соединение
+                await self.close()
+                raise
+
+    async def load(self, kind):
+        (flat,) = await self._run([("HGETALL", f"planner:{kind}")])
+        return {
+            _decode_key(flat[i].decode()): pickle.loads(flat[i + 1])
+            for i in range(0, len(flat), 2)
+        }
+
+    async def write(self, ops):
+        commands = []
+        for (kind, key), value in ops:
+            if value is None:
+                commands.append(("HDEL", f"planner:{kind}", _encode_key(key)))
+            else:
+                commands.append(("HSET", f"planner:{kind}", _encode_key(key), value))
+        await self._run(commands)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class BatchedPersistence(BasePersistence):
+    # Изменения из update_* не пишутся сразу, а копятся в буфере и уходят в
+    # хранилище одной пачкой в фоновой задаче: обработка сообщений никогда
+    # не ждёт диска или сети. Данные сериализуются сразу в _stage, на event
+    # loop: обработчики продолжают менять те же словари, и поток записи
+    # должен получить уже готовый снимок в байтах.
+    def __init__(self, backend, update_interval=PERSISTENCE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.backend = backend
+        self._pending = {}
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+
+    def _stage(self, kind, key, value):
+        if value is not None:
+            try:
+                value = pickle.dumps(value)
+            except Exception as e:
+                logging.error(f"Не удалось сохранить {kind} {key}: {e}")
+                metrics.inc("persistence_errors")
+                return
+        self._pending[(kind, key)] = value
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self):
+        async with self._flush_lock:
+            # Даём Application отдать все изменения текущего прохода.
+            await asyncio.sleep(0)
+            while self._pending:
+                ops, self._pending = self._pending, {}
+                try:
+                    await self.backend.write(list(ops.items()))
+                    metrics.inc("persistence_flushes")
+                    metrics.inc("persistence_writes", len(ops))
+                except Exception as e:
+                    logging.error(f"Ошибка записи состояния: {e}")
+                    metrics.inc("persistence_errors")
+                    # Возвращаем в буфер то, что не успело перезаписаться,
+                    # следующая попытка — при следующем update_persistence.
+                    for key, value in ops.items():
+                        self._pending.setdefault(key, value)
+                    return
+
+    async def get_user_data(self):
+        return await self.backend.load("user_data")
+
+    async def get_chat_data(self):
+        return await self.backend.load("chat_data")
+
+    async def get_bot_data(self):
+        return (await self.backend.load("bot_data")).get("bot_data", {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return await self.backend.load(f"conversations:{name}")
+
+    async def update_conversation(self, name, key, new_state):
+        self._stage(f"conversations:{name}", key, new_state)
+
+    async def update_user_data(self, user_id, data):
+        self._stage("user_data", user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._stage("chat_data", chat_id, data)
+
+    async def update_bot_data(self, data):
+        self._stage("bot_data", "bot_data", data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        self._stage("chat_data", chat_id, None)
+
+    async def drop_user_data(self, user_id):
+        self._stage("user_data", user_id, None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        await self._write_pending()
+        await self.backend.close()
+
+
+def build_persistence():
+    if PERSISTENCE_BACKEND == "sqlite":
+        return BatchedPersistence(SQLiteBackend())
+    if PERSISTENCE_BACKEND == "redis":
+        return BatchedPersistence(RedisBackend())
+    return None
@@ -1,25 +0,0 @@
-from telegram import Update, ReplyKeyboardMarkup
-from telegram.ext import ContextTypes, ConversationHandler
-
-async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    menu = """
-👋 Привет! Я бот-планировщик. Вот что я умею:
-
-📝 /addtask — добавить задачу с датой и временем
-📋 /listtasks — показать список всех активных задач
-✅ /done — выбрать и отметить задачу как выполненную
-📅 /addevent — запланировать встречу в Google Календарь
-📆 /today — показать задачи и встречи на сегодня
-⏰ /overdue — показать просроченные задачи
-❌ /cancel — отменить текущую операцию
-    """
-    keyboard = [["📝 Добавить задачу", "📋 Показать задачи"],
-                ["✅ Завершить задачу", "📅 Добавить встречу"],
-                ["📆 Сегодня", "⏰ Просроченные"],
-                ["❌ Отменить"]]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    await update.message.reply_text(menu + "\n\nВыберите действие с помощью кнопок ниже:", reply_markup=reply_markup)
-
-async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("❌ Действие отменено.")
-    return ConversationHandler.END
@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+from googleapiclient.errors import HttpError
+
+import metrics
+from auth import get_credentials
+from auth_utils import MINSK_TZ
+from google_executor import PAGE_SIZE, GoogleUnavailable, paginate
+from google_services import get_service
+from models import Event, Task
+from task_index import TaskIndex
+
+# Запас для updatedMin: перекрывающиеся дельты безопасны, пропущенные — нет.
+UPDATED_MIN_SKEW = timedelta(minutes=1)
+# Окно зеркала календаря: сколько дней назад и вперёд от начала сегодняшнего
+# дня. Без верхней границы полная синхронизация листала бы весь будущий
+# календарь со всеми повторами.
+EVENTS_LOOKBACK_DAYS = 1
+EVENTS_HORIZON_DAYS = int(os.getenv("EVENTS_HORIZON_DAYS", "2"))
+# Сбои, при которых вместо ошибки отдаётся последнее известное зеркало.
+TRANSIENT_ERRORS = (GoogleUnavailable, HttpError, OSError, asyncio.TimeoutError)
+
+
+def _rfc3339(dt):
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def _is_open(task):
+    return not task.get('deleted') and not task.get('hidden') and task.get('status') != 'completed'
+
+
+def parse_item(model, item):
+    # Сырые ответы API разбираются один раз, при попадании в зеркало;
+    # элемент, который не удалось разобрать, пропускается с предупреждением.
+    try:
+        return model.from_api(item)
+    except (KeyError, ValueError) as e:
+        logging.warning(f"Ошибка в обработке {model.__name__} {item.get('id')}: {e}")
+        return None
+
+
+class TaskMirror:
+    def __init__(self):
+        self.tasks = {}
+        self.index = TaskIndex()
+        self.updated_min = None
+
+
+class EventMirror:
+    def __init__(self):
+        self.events = {}
+        self.sync_token = None
+        self.window_start = None
+        self.window_end = None
+
+    def between(self, time_min, time_max):
+        selected = [
+            event for event in self.events.values()
+            if event.start < time_max and event.end > time_min
+        ]
+        selected.sort(key=lambda event: event.start)
+        return selected
+
+
+class SyncEngine:
+    # Локальное зеркало задач и встреч каждого пользователя. После первой
+    # полной загрузки запрашиваются только изменения: для Tasks — по
+    # updatedMin, для Calendar — по syncToken. Зеркало сохраняется только
+    # после успешной полной загрузки и удаляется вместе с записью
+    # пользователя в task_cache.
+    def __init__(self):
+        self._tasks = {}
+        self._events = {}
+
+    async def stream_tasks(self, user_id):
+        # Отдаёт задачи страницами по мере загрузки. При холодном зеркале
+        # каждая страница Tasks API уходит потребителю сразу; при тёплом —
+        # запрашивается только дельта, а затем отдаётся зеркало целиком.
+        mirror = self._tasks.get(user_id) or TaskMirror()
+        service = get_service("tasks", "v1", await get_credentials(user_id))
+        started = datetime.now(timezone.utc)
+
+        if mirror.updated_min is None:
+            fresh = {}
+            async for result in paginate(lambda token: service.tasks().list(
+                tasklist='@default', showCompleted=False, maxResults=PAGE_SIZE, pageToken=token,
+            ), "tasks", user_id=user_id):
+                page = []
+                for item in result.get('items', []):
+                    task = parse_item(Task, item)
+                    if task is not None:
+                        fresh[task.id] = task
+                        page.append(task)
+                yield page
+            mirror.tasks = fresh
+            mirror.index = TaskIndex(fresh.values())
+            self._tasks[user_id] = mirror
+            metrics.inc("sync_full", api="tasks")
+        else:
+            delta = 0
+            try:
+                async for result in paginate(lambda token: service.tasks().list(
+                    tasklist='@default',
+                    updatedMin=mirror.updated_min,
+                    showCompleted=True,
+                    showDeleted=True,
+                    showHidden=True,
+                    maxResults=PAGE_SIZE,
+                    pageToken=token,
+                ), "tasks", user_id=user_id):
+                    for item in result.get('items', []):
+                        self._apply_task(mirror, item)
+                        delta += 1
+            except TRANSIENT_ERRORS as e:
+                # Google недоступен — отдаём последнее зеркало, а изменения
+                # подтянутся следующей синхронизацией с того же updatedMin.
+                logging.warning(f"Задачи {user_id} отданы из зеркала: {e}")
+                metrics.inc("sync_stale_served", api="tasks")
+                yield list(mirror.tasks.values())
+                return
+            metrics.inc("sync_incremental", api="tasks")
+            metrics.inc("sync_delta_items", delta, api="tasks")
+            yield list(mirror.tasks.values())
+
+        mirror.updated_min = _rfc3339(started - UPDATED_MIN_SKEW)
+
+    async def sync_tasks(self, user_id):
+        tasks = []
+        async for page in self.stream_tasks(user_id):
+            tasks.extend(page)
+        return tasks
+
+    def _apply_task(self, mirror, item):
+        task = parse_item(Task, item) if _is_open(item) else None
+        if task is not None:
+            mirror.tasks[task.id] = task
+            mirror.index.add(task)
+        else:
+            mirror.tasks.pop(item['id'], None)
+            mirror.index.remove(item['id'])
+
+    def put_task(self, user_id, task):
+        mirror = self._tasks.get(user_id)
+        if mirror is not None:
+            mirror.tasks[task.id] = task
+            mirror.index.add(task)
+
+    def remove_task(self, user_id, task_id):
+        mirror = self._tasks.get(user_id)
+        if mirror is not None:
+            mirror.tasks.pop(task_id, None)
+            mirror.index.remove(task_id)
+
+    def forget(self, user_id):
+        self._tasks.pop(user_id, None)
+        self._events.pop(user_id, None)
+
+    def task_index(self, user_id):
+        mirror = self._tasks.get(user_id)
+        return mirror.index if mirror is not None else TaskIndex()
+
+    async def sync_events(self, user_id):
+        mirror = self._events.get(user_id) or EventMirror()
+        now = datetime.now(MINSK_TZ)
+        day_start = MINSK_TZ.localize(datetime(now.year, now.month, now.day))
+        window_start = day_start - timedelta(days=EVENTS_LOOKBACK_DAYS)
+        window_end = day_start + timedelta(days=EVENTS_HORIZON_DAYS)
+        # Раз в сутки окно сдвигается и зеркало пересобирается с нуля.
+        if mirror.window_start != window_start:
+            mirror.sync_token = None
+
+        service = get_service("calendar", "v3", await get_credentials(user_id))
+        if mirror.sync_token is not None:
+            try:
+                delta = 0
+                async for result in paginate(lambda token: service.events().list(
+                    calendarId='primary',
+                    singleEvents=True,
+                    syncToken=mirror.sync_token,
+                    maxResults=PAGE_SIZE,
+                    pageToken=token,
+                ), "calendar", user_id=user_id):
+                    for item in result.get('items', []):
+                        event = None if item.get('status') == 'cancelled' else parse_item(Event, item)
+                        # Дельта по syncToken приходит по всему календарю
+                        if event is None or event.end <= mirror.window_start or event.start >= mirror.window_end:
+                            mirror.events.pop(item['id'], None)
+                        else:
+                            mirror.events[event.id] = event
+                        delta += 1
+                mirror.sync_token = result.get('nextSyncToken')
+                metrics.inc("sync_incremental", api="calendar")
+                metrics.inc("sync_delta_items", delta, api="calendar")
+                return mirror
+            except HttpError as e:
+                if e.resp.status != 410:
+                    return self._stale_events(user_id, mirror, e)
+                logging.info("syncToken календаря устарел, выполняется полная синхронизация")
+                metrics.inc("sync_token_expired", api="calendar")
+            except TRANSIENT_ERRORS as e:
+                return self._stale_events(user_id, mirror, e)
+
+        events = {}
+        try:
+            async for result in paginate(lambda token: service.events().list(
+                calendarId='primary',
+                singleEvents=True,
+                timeMin=window_start.isoformat(),
+                timeMax=window_end.isoformat(),
+                maxResults=PAGE_SIZE,
+                pageToken=token,
+            ), "calendar", user_id=user_id):
+                for item in result.get('items', []):
+                    event = None if item.get('status') == 'cancelled' else parse_item(Event, item)
+                    if event is not None:
+                        events[event.id] = event
+        except TRANSIENT_ERRORS as e:
+            if mirror.window_start is None:
+                raise
+            return self._stale_events(user_id, mirror, e)
+        mirror.events = events
+        mirror.sync_token = result.get('nextSyncToken')
+        mirror.window_start = window_start
+        mirror.window_end = window_end
+        self._events[user_id] = mirror
+        metrics.inc("sync_full", api="calendar")
+        return mirror
+
+    def _stale_events(self, user_id, mirror, error):
+        logging.warning(f"Встречи {user_id} отданы из зеркала: {error}")
+        metrics.inc("sync_stale_served", api="calendar")
+        return mirror
+
+
+engine = SyncEngine()
@@ -0,0 +1,146 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+import metrics
+from models import Task
+from sync import engine, parse_item
+
+CACHE_TTL = float(os.getenv("TASK_CACHE_TTL", "30"))
+CACHE_MAX_USERS = int(os.getenv("TASK_CACHE_MAX_USERS", "1000"))
+
+
+class TaskCache:
+    # Для каждого пользователя хранится словарь {вид данных: (истекает, значение)}.
+    # Пользователи вытесняются по LRU, записи внутри — по TTL. on_evict
+    # получает вытесненного пользователя, чтобы освободить связанные данные.
+    def __init__(self, ttl=CACHE_TTL, max_users=CACHE_MAX_USERS, on_evict=None):
+        self.ttl = ttl
+        self.max_users = max_users
+        self.on_evict = on_evict
+        self._users = OrderedDict()
+        self._locks = {}
+
+    def _lookup(self, user_id, kind):
+        entries = self._users.get(user_id)
+        entry = entries.get(kind) if entries else None
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        self._users.move_to_end(user_id)
+        return entry[1]
+
+    def get(self, user_id, kind):
+        value = self._lookup(user_id, kind)
+        name = "task_cache_misses" if value is None else "task_cache_hits"
+        metrics.inc(name, kind=kind)
+        return value
+
+    def put(self, user_id, kind, value):
+        entries = self._users.setdefault(user_id, {})
+        entries[kind] = (time.monotonic() + self.ttl, value)
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.max_users:
+            evicted, entries = self._users.popitem(last=False)
+            for evicted_kind in entries:
+                self._locks.pop((evicted, evicted_kind), None)
+            if self.on_evict is not None:
+                self.on_evict(evicted)
+            metrics.inc("task_cache_evictions")
+
+    def update(self, user_id, kind, func):
+        # Применяет func к закэшированному значению, не продлевая TTL.
+        entries = self._users.get(user_id)
+        if entries and kind in entries:
+            expires, value = entries[kind]
+            entries[kind] = (expires, func(value))
+
+    def invalidate(self, user_id, kind=None):
+        entries = self._users.get(user_id)
+        if not entries:
+            return
+        if kind is None:
+            entries.clear()
+        else:
+            entries.pop(kind, None)
+
+    async def get_or_load(self, user_id, kind, loader):
+        value = self.get(user_id, kind)
+        if value is not None:
+            return value
+        # Одновременные запросы одних и тех же данных ждут одну загрузку.
+        lock = self._locks.setdefault((user_id, kind), asyncio.Lock())
+        async with lock:
+            value = self._lookup(user_id, kind)
+            if value is None:
+                value = await loader()
+                self.put(user_id, kind, value)
+        return value
+
+    def stats(self):
+        snapshot = metrics.snapshot()["counters"]
+        hits = sum(v for (name, _), v in snapshot.items() if name == "task_cache_hits")
+        misses = sum(v for (name, _), v in snapshot.items() if name == "task_cache_misses")
+        total = hits + misses
+        return {
+            "users": len(self._users),
+            "hits": int(hits),
+            "misses": int(misses),
+            "hit_rate": hits / total if total else 0.0,
+        }
+
+
+# Зеркала синхронизации живут столько же, сколько запись пользователя в кэше
+cache = TaskCache(on_evict=engine.forget)
+
+
+async def get_tasks(user_id):
+    return await cache.get_or_load(user_id, "tasks", lambda: engine.sync_tasks(user_id))
+
+
+async def get_index(user_id):
+    # Индекс по срокам ведёт движок синхронизации; кэш лишь решает,
+    # пора ли подтянуть изменения.
+    await get_tasks(user_id)
+    return engine.task_index(user_id)
+
+
+async def stream_tasks(user_id):
+    # Как get_tasks, но при промахе отдаёт задачи постранично по мере загрузки.
+    items = cache.get(user_id, "tasks")
+    if items is not None:
+        yield items
+        return
+    items = []
+    async for page in engine.stream_tasks(user_id):
+        items.extend(page)
+        yield page
+    cache.put(user_id, "tasks", items)
+
+
+async def get_events(user_id, day_start, day_end):
+    # Одна запись на пользователя: кэш решает, пора ли синхронизировать
+    # зеркало календаря, а встречи нужного дня выбираются из него.
+    mirror = await cache.get_or_load(user_id, "events", lambda: engine.sync_events(user_id))
+    return mirror.between(day_start, day_end)
+
+
+def task_added(user_id, item):
+    # Задача уже создана: ошибка разбора ответа здесь заставила бы
+    # пользователя повторить и создать дубликат. Непонятный ответ просто
+    # сбрасывает кэш, и задача придёт со следующей синхронизацией.
+    task = parse_item(Task, item)
+    if task is None:
+        cache.invalidate(user_id, "tasks")
+        return
+    engine.put_task(user_id, task)
+    cache.update(user_id, "tasks", lambda items: items + [task])
+
+
+def task_completed(user_id, task_id):
+    engine.remove_task(user_id, task_id)
+    cache.update(user_id, "tasks", lambda items: [t for t in items if t.id != task_id])
+
+
+def events_changed(user_id):
+    cache.invalidate(user_id, "events")
@@ -0,0 +1,53 @@
+from bisect import bisect_left, bisect_right
+from itertools import groupby
+
+
+class TaskIndex:
+    # Задачи с датой хранятся в двух параллельных списках, отсортированных
+    # по сроку: keys (datetime) для bisect и tasks с самими записями.
+    def __init__(self, tasks=()):
+        dated = sorted((task for task in tasks if task.due), key=lambda task: task.due)
+        self._keys = [task.due for task in dated]
+        self._tasks = dated
+        self._undated = {task.id: task for task in tasks if not task.due}
+        self._due = {task.id: task.due for task in dated}
+
+    def __len__(self):
+        return len(self._tasks) + len(self._undated)
+
+    def add(self, task):
+        self.remove(task.id)
+        if task.due is None:
+            self._undated[task.id] = task
+            return
+        pos = bisect_right(self._keys, task.due)
+        self._keys.insert(pos, task.due)
+        self._tasks.insert(pos, task)
+        self._due[task.id] = task.due
+
+    def remove(self, task_id):
+        if self._undated.pop(task_id, None) is not None:
+            return
+        due = self._due.pop(task_id, None)
+        if due is None:
+            return
+        pos = bisect_left(self._keys, due)
+        while self._tasks[pos].id != task_id:
+            pos += 1
+        del self._keys[pos]
+        del self._tasks[pos]
+
+    def due_between(self, start, end):
+        # Задачи со сроком в полуинтервале [start, end).
+        return self._tasks[bisect_left(self._keys, start):bisect_left(self._keys, end)]
+
+    def overdue_before(self, now):
+        return self._tasks[:bisect_left(self._keys, now)]
+
+    def undated(self):
+        return list(self._undated.values())
+
+    def by_date(self, tasks=None):
+        # Пары (дата, [задачи]) в порядке возрастания даты.
+        tasks = self._tasks if tasks is None else tasks
+        return [(day, list(group)) for day, group in groupby(tasks, key=lambda task: task.due.date())]
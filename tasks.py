@@ -1,99 +1,180 @@
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
+import bulk
+import nl_dates
+import task_cache
 from auth import get_credentials
-from googleapiclient.discovery import build
 from auth_utils import MINSK_TZ
+from formatting import format_russian_date, format_task_line
+from google_executor import execute
+from google_services import get_service
+from outbound import reply_long
 from datetime import datetime
+import time
 
 ASK_TASK_TEXT = 0
 ASK_TASK_DATE = 1
 ASK_TASK_DURATION = 2
 ASK_DONE_INDEX = 3
+ASK_DONE_CONFIRM = 9
+
+CONFIRM_ANSWERS = {"да", "д", "+", "yes", "y"}
+# Сколько секунд номера из показанного списка /done считаются актуальными
+DONE_LIST_TTL = 10 * 60
 
 async def list_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    creds = get_credentials()
-    service = build("tasks", "v1", credentials=creds)
-    results = service.tasks().list(tasklist='@default', showCompleted=False).execute()
-    items = results.get('items', [])
-    if not items:
+    index = await task_cache.get_index(update.effective_user.id)
+
+    if not len(index):
         await update.message.reply_text("🎉 У тебя нет активных задач.")
         return
-    message = "📝 Твои задачи:\n"
-    for idx, task in enumerate(items, start=1):
-        title = task['title']
-        notes = task.get('notes', '')
-        due = task.get('due')
-        due_str = f" (на {due[:10]})" if due else ""
-        message += f"{idx}. {title}{due_str}"
-        if notes:
-            message += f" — {notes}"
-        message += "\n"
-    context.user_data['tasks'] = items
-    await update.message.reply_text(message)
+
+    # Индекс уже отсортирован по датам, задачи без даты идут отдельным блоком в конце
+    lines = ["📝 Твои задачи:"]
+    for day, tasks in index.by_date():
+        lines.append(f"\n📅 {format_russian_date(day)}:")
+        lines.extend(format_task_line(task) for task in tasks)
+
+    undated = index.undated()
+    if undated:
+        lines.append("\n📅 Без даты:")
+        lines.extend(format_task_line(task) for task in undated)
+
+    await reply_long(update.message, "\n".join(lines))
 
 async def addtask_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data.clear()
+    # /addtask купить молоко в пятницу — задача одной строкой; каждая
+    # следующая строка после команды — ещё одна задача
+    text = update.message.text.split(maxsplit=1)
+    if update.message.text.startswith("/") and len(text) > 1:
+        bodies = await bulk.parse_task_lines(text[1], datetime.now(MINSK_TZ).date())
+        results = await bulk.add_tasks(update.effective_user.id, bodies)
+        if len(results) == 1 and results[0][1]:
+            due = bodies[0].get("due")
+            when = f" на {format_russian_date(datetime.fromisoformat(due[:-1]))}" if due else ""
+            await update.message.reply_text(f"✅ Задача «{bodies[0]['title']}» добавлена{when}!")
+        else:
+            await reply_long(update.message, bulk.format_report("Добавлено задач", results))
+        return ConversationHandler.END
     await update.message.reply_text("📝 Введи текст задачи:")
     return ASK_TASK_TEXT
 
 async def received_task_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['task_title'] = update.message.text
-    await update.message.reply_text("📅 Укажи дату (в формате ДД.ММ.ГГГГ):")
+    await update.message.reply_text("📅 Укажи дату (ДД.ММ.ГГГГ, «завтра», «в пятницу»...):")
     return ASK_TASK_DATE
 
 async def received_task_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        date = datetime.strptime(update.message.text, "%d.%m.%Y")
-        context.user_data['task_due'] = date.isoformat() + "Z"
-        await update.message.reply_text("⏱ Сколько времени планируешь на выполнение? (например: 1 час, 30 минут)")
-        return ASK_TASK_DURATION
-    except ValueError:
-        await update.message.reply_text("❌ Неверный формат. Попробуй снова: ДД.ММ.ГГГГ")
+    date = await nl_dates.parse_date(update.message.text, datetime.now(MINSK_TZ).date())
+    if date is None:
+        await update.message.reply_text("❌ Не понял дату. Попробуй снова: ДД.ММ.ГГГГ, «завтра» или «в пятницу»")
         return ASK_TASK_DATE
+    context.user_data['task_due'] = datetime.combine(date, datetime.min.time()).isoformat() + "Z"
+    await update.message.reply_text("⏱ Сколько времени планируешь на выполнение? (например: 1 час, 30 минут)")
+    return ASK_TASK_DURATION
 
 async def received_task_duration(update: Update, context: ContextTypes.DEFAULT_TYPE):
     duration = update.message.text
-    creds = get_credentials()
-    service = build("tasks", "v1", credentials=creds)
+    creds = await get_credentials(update.effective_user.id)
+    service = get_service("tasks", "v1", creds)
     task = {
         "title": context.user_data['task_title'],
         "due": context.user_data['task_due'],
         "notes": f"Планируемое время: {duration}"
     }
-    service.tasks().insert(tasklist='@default', body=task).execute()
+    created = await execute(
+        service.tasks().insert(tasklist='@default', body=task), "tasks", user_id=update.effective_user.id,
+    )
+    task_cache.task_added(update.effective_user.id, created)
     await update.message.reply_text("✅ Задача добавлена!")
     return ConversationHandler.END
 
 async def done_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    creds = get_credentials()
-    service = build("tasks", "v1", credentials=creds)
-    result = service.tasks().list(tasklist='@default', showCompleted=False).execute()
-    items = result.get('items', [])
+    # /done 1 3 5-8 — завершить сразу несколько задач по номерам из списка /done
+    if context.args:
+        # Номера относятся к списку, который пользователь видел в /done: свежий
+        # список после синхронизации мог сдвинуться, а завершение не отменить.
+        items = shown_tasks(context)
+        shown = items is not None
+        if not shown:
+            items = await task_cache.get_tasks(update.effective_user.id)
+        try:
+            indices = bulk.parse_selection(" ".join(context.args), len(items))
+        except (IndexError, ValueError):
+            forget_done_state(context)
+            await update.message.reply_text("❌ Неверные номера. Пример: /done 1 3 5-8")
+            return ConversationHandler.END
+        forget_done_state(context)
+        selected = [items[i] for i in indices]
+        if shown:
+            await complete_selected(update, selected)
+            return ConversationHandler.END
+        # Списка пользователь не видел — сначала показать, что будет завершено
+        context.user_data['done_selected'] = selected
+        lines = ["Завершить эти задачи? Ответь «да» или /cancel:"]
+        lines.extend(f"{i + 1}. {items[i].title}" for i in indices)
+        await reply_long(update.message, "\n".join(lines))
+        return ASK_DONE_CONFIRM
+
+    # Первая страница отправляется сразу, остальные — по мере загрузки
+    forget_done_state(context)
+    items = []
+    async for page in task_cache.stream_tasks(update.effective_user.id):
+        if not page:
+            continue
+        message = "" if items else "Выбери номер задачи, которую хочешь завершить (можно несколько: 1 3 5-8):\n"
+        for idx, task in enumerate(page, len(items) + 1):
+            message += f"{idx}. {task.title}\n"
+        items.extend(page)
+        await reply_long(update.message, message)
     if not items:
         await update.message.reply_text("❌ Нет активных задач для завершения.")
         return ConversationHandler.END
     context.user_data['tasks'] = items
-    message = "Выбери номер задачи, которую хочешь завершить:\n"
-    for idx, task in enumerate(items, 1):
-        message += f"{idx}. {task['title']}\n"
-    await update.message.reply_text(message)
+    context.user_data['tasks_shown_at'] = time.time()
     return ASK_DONE_INDEX
 
 async def mark_selected_done(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    items = shown_tasks(context)
+    if items is None:
+        await update.message.reply_text("⌛ Список устарел. Открой его заново: /done")
+        return ConversationHandler.END
     try:
-        index = int(update.message.text) - 1
-        items = context.user_data.get('tasks', [])
-        if 0 <= index < len(items):
-            task = items[index]
-            task['status'] = 'completed'
-            creds = get_credentials()
-            service = build("tasks", "v1", credentials=creds)
-            service.tasks().update(tasklist='@default', task=task['id'], body=task).execute()
-            await update.message.reply_text(f"✅ Задача завершена: {task['title']}")
-        else:
-            await update.message.reply_text("❌ Неверный номер. Попробуй снова.")
-            return ASK_DONE_INDEX
+        indices = bulk.parse_selection(update.message.text, len(items))
+    except IndexError:
+        await update.message.reply_text("❌ Неверный номер. Попробуй снова.")
+        return ASK_DONE_INDEX
     except ValueError:
         await update.message.reply_text("❌ Введи номер задачи.")
         return ASK_DONE_INDEX
+    forget_done_state(context)
+    await complete_selected(update, [items[i] for i in indices])
+    return ConversationHandler.END
+
+async def confirm_selected_done(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    selected = context.user_data.pop('done_selected', [])
+    if update.message.text.strip().lower() not in CONFIRM_ANSWERS or not selected:
+        await update.message.reply_text("❌ Действие отменено.")
+        return ConversationHandler.END
+    await complete_selected(update, selected)
     return ConversationHandler.END
+
+def shown_tasks(context):
+    # Список, который пользователь видел в /done, если он ещё не устарел
+    items = context.user_data.get('tasks')
+    shown_at = context.user_data.get('tasks_shown_at', 0)
+    if items is None or time.time() - shown_at > DONE_LIST_TTL:
+        forget_done_state(context)
+        return None
+    return items
+
+def forget_done_state(context):
+    for key in ('tasks', 'tasks_shown_at', 'done_selected'):
+        context.user_data.pop(key, None)
+
+async def complete_selected(update: Update, tasks):
+    results = await bulk.complete_tasks(update.effective_user.id, tasks)
+    if len(results) == 1 and results[0][1]:
+        await update.message.reply_text(f"✅ Задача завершена: {results[0][0]}")
+    else:
+        await reply_long(update.message, bulk.format_report("Завершено задач", results))
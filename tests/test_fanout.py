@@ -0,0 +1,43 @@
+import asyncio
+from datetime import date
+
+import pytest
+
+import today
+from accounts import LINK_HINT
+from auth import NotLinked
+
+
+class FakeMessage:
+    def __init__(self):
+        self.texts = []
+
+    async def reply_text(self, text, *args, **kwargs):
+        self.texts.append(text)
+        return self
+
+
+async def _fail(error):
+    raise error
+
+
+async def _lines(*lines):
+    return list(lines)
+
+
+@pytest.mark.parametrize("tasks, events, expected", [
+    (NotLinked(), NotLinked(), LINK_HINT),
+    (["• Отчёт"], NotLinked(), f"• Отчёт\n\n🕒 Встречи:\n{LINK_HINT}"),
+    (RuntimeError("503"), ["• Созвон в 10:00"], "⚠️ Не удалось загрузить данные.\n\n🕒 Встречи:\n• Созвон в 10:00"),
+])
+def test_today_explains_missing_link(tasks, events, expected):
+    def job(result):
+        return _fail(result) if isinstance(result, Exception) else _lines(*result)
+
+    async def scenario():
+        message = FakeMessage()
+        jobs = {"tasks": asyncio.create_task(job(tasks)), "events": asyncio.create_task(job(events))}
+        await today.reply_progressively(message, jobs, lambda results: today.render_today(date(2026, 10, 14), results))
+        return message.texts
+
+    assert asyncio.run(scenario())[0].endswith(expected)
@@ -0,0 +1,55 @@
+from datetime import datetime, time, timedelta
+
+import pytest
+
+from auth_utils import MINSK_TZ
+from freebusy import free_slots, merge_intervals
+
+
+def at(day, hour, minute=0):
+    # Момент в Минске, день — число октября 2026 (14-е — среда)
+    return MINSK_TZ.localize(datetime(2026, 10, day, hour, minute))
+
+
+MERGED = [
+    ([], []),
+    # Два календаря: интервалы перекрываются и идут не по порядку
+    ([(at(14, 11), at(14, 12)), (at(14, 10), at(14, 11, 30))], [(at(14, 10), at(14, 12))]),
+    # Смежные склеиваются, вложенный не укорачивает внешний
+    ([(at(14, 10), at(14, 11)), (at(14, 11), at(14, 12))], [(at(14, 10), at(14, 12))]),
+    ([(at(14, 9), at(14, 17)), (at(14, 10), at(14, 11))], [(at(14, 9), at(14, 17))]),
+    ([(at(14, 10), at(14, 11)), (at(14, 12), at(14, 13))], [(at(14, 10), at(14, 11)), (at(14, 12), at(14, 13))]),
+]
+
+
+@pytest.mark.parametrize("intervals, merged", MERGED)
+def test_merge_intervals(intervals, merged):
+    assert merge_intervals(intervals) == merged
+
+
+SLOTS = [
+    # Свободный рабочий день целиком
+    ([], at(14, 0), at(15, 0), [(at(14, 9), at(14, 19))]),
+    # Занятость из двух календарей перекрывается
+    ([(at(14, 10), at(14, 12)), (at(14, 11), at(14, 13))], at(14, 0), at(15, 0),
+     [(at(14, 9), at(14, 10)), (at(14, 13), at(14, 19))]),
+    # Ночная встреча захватывает утро следующего дня
+    ([(at(14, 22), at(15, 10))], at(14, 0), at(16, 0),
+     [(at(14, 9), at(14, 19)), (at(15, 10), at(15, 19))]),
+    # Окно ровно в min_duration остаётся, на минуту короче — нет
+    ([(at(14, 9, 30), at(14, 18, 30))], at(14, 0), at(15, 0),
+     [(at(14, 9), at(14, 9, 30)), (at(14, 18, 30), at(14, 19))]),
+    ([(at(14, 9, 29), at(14, 18, 31))], at(14, 0), at(15, 0), []),
+    # Суббота и воскресенье не рабочие
+    ([], at(16, 20), at(19, 0), []),
+    # Окно начинается посреди рабочего дня
+    ([], at(14, 15, 15), at(14, 23), [(at(14, 15, 15), at(14, 19))]),
+]
+
+
+@pytest.mark.parametrize("busy, window_start, window_end, slots", SLOTS)
+def test_free_slots(busy, window_start, window_end, slots):
+    assert free_slots(
+        busy, window_start, window_end, min_duration=timedelta(minutes=30),
+        work_start=time(9), work_end=time(19), work_days={1, 2, 3, 4, 5},
+    ) == slots
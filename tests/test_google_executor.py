@@ -0,0 +1,68 @@
+import asyncio
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+import google_executor
+
+
+def _error(status):
+    return HttpError(httplib2.Response({"status": status}), b"{}")
+
+
+class FakeBatch:
+    def __init__(self, callback, outcomes, sent):
+        self.callback = callback
+        self.outcomes = outcomes
+        self.sent = sent
+        self.items = []
+
+    def add(self, request, request_id):
+        self.items.append((request, request_id))
+
+
+class FakeService:
+    # Каждый запрос — имя; outcomes[имя] — исходы по попыткам (None — успех)
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+        self.sent = []
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(callback, self.outcomes, self.sent)
+
+
+async def _run_batch(batch, api, credentials=None, user_id=None):
+    for request, request_id in batch.items:
+        batch.sent.append(request)
+        error = batch.outcomes[request].pop(0)
+        batch.callback(request_id, None if error else {"id": request}, error)
+
+
+def _execute_batch(monkeypatch, outcomes, idempotent):
+    monkeypatch.setattr(google_executor, "execute", _run_batch)
+    monkeypatch.setattr(google_executor, "BACKOFF_BASE", 0)
+    service = FakeService(outcomes)
+    results = asyncio.run(google_executor.execute_batch(
+        service, list(outcomes), None, "tasks", idempotent=idempotent,
+    ))
+    return service.sent, [error.resp.status if error else response["id"] for response, error in results]
+
+
+def test_batch_retries_only_retryable_items(monkeypatch):
+    sent, results = _execute_batch(monkeypatch, {
+        "ok": [None],
+        "quota": [_error(429), None],
+        "outage": [_error(503), _error(503), None],
+        "missing": [_error(404)],
+    }, idempotent=True)
+    assert results == ["ok", "quota", "outage", 404]
+    assert sent == ["ok", "quota", "outage", "missing", "quota", "outage", "outage"]
+
+
+def test_batch_does_not_repeat_writes_after_5xx(monkeypatch):
+    sent, results = _execute_batch(monkeypatch, {
+        "quota": [_error(429), None],
+        "outage": [_error(503)],
+    }, idempotent=False)
+    assert results == ["quota", 503]
+    assert sent == ["quota", "outage", "quota"]
@@ -0,0 +1,167 @@
+import asyncio
+
+import pytest
+from telegram import Message, Update
+from telegram.ext import ApplicationBuilder, ExtBot
+
+import bulk
+import events
+import freebusy
+import handlers
+import task_cache
+import tasks
+from accounts import LINK_HINT
+from auth import NotLinked
+from menu import CANCEL_BUTTON
+from models import Task
+
+# Шаги диалогов: ответы, которые доводят диалог до очередного шага.
+ADDTASK = ["/addtask", "Купить молоко", "завтра"]
+ADDEVENT = ["/addevent", "Созвон", "завтра", "14:30"]
+
+
+class Chat:
+    def __init__(self, monkeypatch):
+        self.replies = []
+        self.app = ApplicationBuilder().token("1:test").updater(None).build()
+        handlers.setup_handlers(self.app)
+        self._update_id = 0
+
+        async def reply_text(message, text, *args, **kwargs):
+            self.replies.append(text)
+
+        async def no_google(*args, **kwargs):
+            raise AssertionError("после отмены Google не вызывается")
+
+        async def no_hint(user_id, day):
+            return ""
+
+        async def offline(bot):
+            pass
+
+        # Бот не ходит в сеть: getMe при инициализации не нужен, ответы пишутся в replies
+        monkeypatch.setattr(ExtBot, "initialize", offline)
+        monkeypatch.setattr(Message, "reply_text", reply_text)
+        monkeypatch.setattr(tasks, "get_credentials", no_google)
+        monkeypatch.setattr(events, "get_credentials", no_google)
+        monkeypatch.setattr(freebusy, "day_hint", no_hint)
+
+    async def send(self, text):
+        self._update_id += 1
+        message = {
+            "message_id": self._update_id,
+            "date": 0,
+            "chat": {"id": 1, "type": "private"},
+            "from": {"id": 1, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        update = Update.de_json({"update_id": self._update_id, "message": message}, self.app.bot)
+        mark = len(self.replies)
+        await self.app.process_update(update)
+        return self.replies[mark:]
+
+
+@pytest.mark.parametrize("steps", [ADDTASK[:i] for i in range(1, len(ADDTASK) + 1)]
+                         + [ADDEVENT[:i] for i in range(1, len(ADDEVENT) + 1)])
+@pytest.mark.parametrize("cancel", [CANCEL_BUTTON, "/cancel"], ids=["button", "command"])
+def test_cancel_at_every_step(monkeypatch, steps, cancel):
+    async def scenario():
+        chat = Chat(monkeypatch)
+        await chat.app.initialize()
+        for text in steps:
+            assert await chat.send(text)
+        assert await chat.send(cancel) == ["❌ Действие отменено."]
+        # Диалог закрыт: обычный текст больше не считается ответом на шаг
+        assert await chat.send("30 минут") == []
+
+    asyncio.run(scenario())
+
+
+def test_done_numbers_refer_to_the_shown_list(monkeypatch):
+    shown = [Task("a", "Первая"), Task("b", "Вторая"), Task("c", "Третья")]
+    # После синхронизации первая задача пропала: номера в свежем списке сдвинулись
+    fresh = shown[1:]
+    completed = []
+
+    async def stream_tasks(user_id):
+        yield shown
+
+    async def get_tasks(user_id):
+        return fresh
+
+    async def complete_tasks(user_id, items):
+        completed.append([task.id for task in items])
+        return [(task.title, True) for task in items]
+
+    async def scenario():
+        chat = Chat(monkeypatch)
+        monkeypatch.setattr(task_cache, "stream_tasks", stream_tasks)
+        monkeypatch.setattr(task_cache, "get_tasks", get_tasks)
+        monkeypatch.setattr(bulk, "complete_tasks", complete_tasks)
+        await chat.app.initialize()
+
+        await chat.send("/done")
+        await chat.send("/done 2")
+        assert completed == [["b"]]
+
+        # Списка после завершения нет — сначала подтверждение
+        replies = await chat.send("/done 1")
+        assert completed == [["b"]]
+        assert "1. Вторая" in replies[0]
+        await chat.send("да")
+        assert completed == [["b"], ["b"]]
+
+        await chat.send("/done 2")
+        await chat.send("нет")
+        assert len(completed) == 2
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("forget", ["cancel", "stale"])
+def test_done_numbers_ignore_a_forgotten_list(monkeypatch, forget):
+    shown = [Task("a", "Первая"), Task("b", "Вторая")]
+    completed = []
+
+    async def stream_tasks(user_id):
+        yield shown
+
+    async def get_tasks(user_id):
+        return shown[1:]
+
+    async def complete_tasks(user_id, items):
+        completed.append([task.id for task in items])
+        return [(task.title, True) for task in items]
+
+    async def scenario():
+        chat = Chat(monkeypatch)
+        monkeypatch.setattr(task_cache, "stream_tasks", stream_tasks)
+        monkeypatch.setattr(task_cache, "get_tasks", get_tasks)
+        monkeypatch.setattr(bulk, "complete_tasks", complete_tasks)
+        await chat.app.initialize()
+
+        await chat.send("/done")
+        if forget == "cancel":
+            await chat.send("/cancel")
+        else:
+            monkeypatch.setattr(tasks, "DONE_LIST_TTL", -1)
+        replies = await chat.send("/done 1")
+        assert completed == []
+        assert "1. Вторая" in replies[0]
+
+    asyncio.run(scenario())
+
+
+def test_addevent_without_linked_account_suggests_link(monkeypatch):
+    async def not_linked(user_id):
+        raise NotLinked()
+
+    async def scenario():
+        chat = Chat(monkeypatch)
+        monkeypatch.setattr(events, "get_credentials", not_linked)
+        await chat.app.initialize()
+        assert await chat.send("/addevent Созвон завтра 14:30-15:30") == [LINK_HINT]
+
+    asyncio.run(scenario())
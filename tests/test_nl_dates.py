@@ -0,0 +1,77 @@
+import asyncio
+import threading
+from datetime import date, time
+
+import pytest
+
+import nl_dates
+
+TODAY = date(2026, 10, 14)  # среда
+
+PARSED = [
+    ("Созвон завтра 14:30-15:30", "Созвон", date(2026, 10, 15), time(14, 30), time(15, 30)),
+    ("купить молоко в пятницу", "купить молоко", date(2026, 10, 16), None, None),
+    ("Отчёт к 1-го ноября", "Отчёт", date(2026, 11, 1), None, None),
+    ("оплатить интернет 3 числа", "оплатить интернет", date(2026, 11, 3), None, None),
+    ("день рождения 25 декабря", "день рождения", date(2026, 12, 25), None, None),
+    ("встреча 05.11.2026 в 10 утра", "встреча", date(2026, 11, 5), time(10, 0), None),
+    ("созвон в следующую пятницу с 9 до 10", "созвон", date(2026, 10, 23), time(9, 0), time(10, 0)),
+    ("планёрка в пн в 9:30", "планёрка", date(2026, 10, 19), time(9, 30), None),
+    ("через 2 недели ревью", "ревью", date(2026, 10, 28), None, None),
+    ("обед в 13 на час", "обед", None, time(13, 0), time(14, 0)),
+    ("позвонить маме в 7 вечера", "позвонить маме", None, time(19, 0), None),
+    ("послезавтра", "", date(2026, 10, 16), None, None),
+    ("сдать отчёт к 3.11", "сдать отчёт", date(2026, 11, 3), None, None),
+    ("отчёт 15.11", "отчёт", date(2026, 11, 15), None, None),
+    ("3.11", "", date(2026, 11, 3), None, None),
+    ("Встреча в 3 корпусе завтра 14:00", "Встреча в 3 корпусе", date(2026, 10, 15), time(14, 0), None),
+    ("Обед в 2 местах завтра", "Обед в 2 местах", date(2026, 10, 15), None, None),
+    ("созвон в 15 завтра", "созвон", date(2026, 10, 15), time(15, 0), None),
+    ("в 9 утра на 99999999 часов", "на 99999999 часов", None, time(9, 0), None),
+]
+
+# Числа с точкой, которые не даты: текст остаётся как есть
+NOT_DATES = [
+    "обновить python 3.11",
+    "глава 3.2",
+    "прочитать главу 3.2.1",
+    "версия 1.2.3 вышла",
+    "цена 3,50",
+    "купить молоко",
+    "позвонить в 5 отделов",
+    "через 99999999 дней",
+]
+
+
+@pytest.mark.parametrize("text, rest, day, start, end", PARSED)
+def test_parse(text, rest, day, start, end):
+    assert nl_dates.parse(text, TODAY) == (rest, day, start, end)
+
+
+@pytest.mark.parametrize("text", NOT_DATES)
+def test_not_a_date(monkeypatch, text):
+    def no_fallback(text, today):
+        raise AssertionError("dateparser не нужен")
+
+    monkeypatch.setattr(nl_dates, "_dateparser", no_fallback)
+    nl_dates.parse.cache_clear()
+    assert nl_dates.parse(text, TODAY) == (text, None, None, None)
+
+
+def test_fallback_runs_off_the_event_loop(monkeypatch):
+    threads = []
+
+    def fallback(text, today):
+        threads.append(threading.get_ident())
+        return None
+
+    monkeypatch.setattr(nl_dates, "_dateparser", fallback)
+    nl_dates.parse.cache_clear()
+
+    async def scenario():
+        await nl_dates.parse_async("отпуск на выходных", TODAY)
+        await nl_dates.parse_async("купить молоко завтра", TODAY)
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(scenario())
+    assert len(threads) == 1 and threads[0] != loop_thread
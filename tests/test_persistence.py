@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+import persistence
+
+
+async def _stub_redis(replies):
+    # Отвечает на каждую команду следующим ответом из списка и считает соединения
+    connections = []
+
+    async def serve(reader, writer):
+        connections.append(writer)
+        while True:
+            header = await reader.readline()
+            if not header:
+                break
+            for _ in range(int(header[1:])):
+                length = int((await reader.readline())[1:])
+                await reader.readexactly(length + 2)
+            writer.write(replies.pop(0))
+            await writer.drain()
+
+    server = await asyncio.start_server(serve, "127.0.0.1", 0)
+    return server, connections
+
+
+def test_redis_error_in_pipeline_keeps_replies_in_step():
+    async def scenario():
+        server, connections = await _stub_redis([
+            b"+OK\r\n",
+            b"-WRONGTYPE Operation against a key holding the wrong kind of value\r\n",
+            b":1\r\n",
+            b"*2\r\n$1\r\na\r\n$1\r\nb\r\n",
+        ])
+        port = server.sockets[0].getsockname()[1]
+        backend = persistence.RedisBackend(f"redis://127.0.0.1:{port}")
+        try:
+            with pytest.raises(persistence.RedisError, match="WRONGTYPE"):
+                await backend._run([("SET", "a", "1"), ("HSET", "a", "k", "v"), ("DEL", "b")])
+            assert backend._writer is None
+            reply = await backend._run([("HGETALL", "planner:user_data")])
+        finally:
+            await backend.close()
+            server.close()
+        return reply, len(connections)
+
+    reply, connections = asyncio.run(scenario())
+    assert reply == [[b"a", b"b"]]
+    assert connections == 2
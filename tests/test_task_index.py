@@ -0,0 +1,67 @@
+from datetime import date, datetime
+
+import pytest
+
+from models import Task
+from task_index import TaskIndex
+
+
+def task(id, day=None, hour=0):
+    return Task(id, id, due=datetime(2026, 10, day, hour) if day else None)
+
+
+def ids(tasks):
+    return [task.id for task in tasks]
+
+
+# Задачи с одинаковым сроком: удалять нужно именно ту, что просили
+SAME_DUE = [
+    (["a", "b", "c"], "a", ["b", "c"]),
+    (["a", "b", "c"], "b", ["a", "c"]),
+    (["a", "b", "c"], "c", ["a", "b"]),
+    (["a", "b", "c"], "x", ["a", "b", "c"]),
+]
+
+
+@pytest.mark.parametrize("order, removed, left", SAME_DUE)
+def test_remove_with_equal_due(order, removed, left):
+    index = TaskIndex()
+    for id in order:
+        index.add(task(id, 14))
+    index.remove(removed)
+    assert ids(index.due_between(datetime(2026, 10, 14), datetime(2026, 10, 15))) == left
+    assert len(index) == len(left)
+
+
+def test_add_moves_a_task_with_a_new_due():
+    index = TaskIndex([task("a", 14), task("b", 14), task("c", 16), task("d")])
+    index.add(task("b", 15))
+    index.add(task("a"))
+    index.add(task("d", 13))
+    assert ids(index.due_between(datetime(2026, 10, 1), datetime(2026, 11, 1))) == ["d", "b", "c"]
+    assert ids(index.undated()) == ["a"]
+    assert len(index) == 4
+
+
+OVERDUE = [
+    (datetime(2026, 10, 14), []),
+    # Срок ровно сейчас ещё не просрочен
+    (datetime(2026, 10, 14, 9), ["a"]),
+    (datetime(2026, 10, 14, 9, 1), ["a", "b", "c"]),
+    (datetime(2026, 10, 20), ["a", "b", "c", "d"]),
+]
+
+
+@pytest.mark.parametrize("now, overdue", OVERDUE)
+def test_overdue_before(now, overdue):
+    index = TaskIndex([task("d", 16), task("b", 14, 9), task("a", 14, 8), task("c", 14, 9), task("u")])
+    assert ids(index.overdue_before(now)) == overdue
+
+
+def test_by_date():
+    index = TaskIndex([task("c", 16), task("a", 14, 8), task("b", 14, 20), task("u")])
+    assert [(day, ids(tasks)) for day, tasks in index.by_date()] == [
+        (date(2026, 10, 14), ["a", "b"]),
+        (date(2026, 10, 16), ["c"]),
+    ]
+    assert index.by_date([]) == []
@@ -0,0 +1,70 @@
+import asyncio
+import queue
+
+import webhook
+
+
+class FakeProcess:
+    def __init__(self, target, args, daemon):
+        self.alive = False
+        self.exitcode = None
+
+    def start(self):
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+
+class FakeContext:
+    def Queue(self, maxsize):
+        return queue.Queue(maxsize)
+
+    def Process(self, **kwargs):
+        return FakeProcess(**kwargs)
+
+
+def _post(app, chat_id):
+    scope = {
+        "type": "http", "method": "POST", "path": webhook.WEBHOOK_PATH,
+        "headers": [(b"x-telegram-bot-api-secret-token", webhook.WEBHOOK_SECRET.encode())],
+    }
+    return _call(app, scope, b'{"update_id": 1, "message": {"chat": {"id": %d}}}' % chat_id)
+
+
+def _call(app, scope, body=b""):
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    return sent[0]["status"]
+
+
+def test_dead_worker_is_restarted_and_full_queue_is_refused(monkeypatch):
+    monkeypatch.setattr(webhook, "WEBHOOK_QUEUE_SIZE", 1)
+    monkeypatch.setattr(webhook, "WORKER_RESTART_DELAY", 0)
+    workers = webhook.Workers(FakeContext(), 2)
+    app = webhook.WebhookApp(workers)
+    healthz = {"type": "http", "method": "GET", "path": "/healthz", "headers": []}
+
+    assert _post(app, 1) == 200
+    assert _post(app, 3) == 503  # очередь обработчика #1 уже полна
+    assert _call(app, healthz) == 200
+
+    dead = workers.processes[1]
+    dead.alive = False
+    assert _call(app, healthz) == 503
+    assert _post(app, 1) == 200
+    assert workers.processes[1] is not dead
+    assert _call(app, healthz) == 200
+
+
+def test_worker_crashing_on_start_is_not_restarted_in_a_loop(monkeypatch):
+    workers = webhook.Workers(FakeContext(), 1)
+    workers.processes[0].alive = False
+    assert _post(webhook.WebhookApp(workers), 0) == 503
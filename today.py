@@ -1,53 +1,70 @@
+import asyncio
+
 from telegram import Update
 from telegram.ext import ContextTypes
-from auth import get_credentials
+import task_cache
 from auth_utils import MINSK_TZ
-from googleapiclient.discovery import build
-from datetime import datetime, timedelta, timezone
+from accounts import LINK_HINT
+from fanout import not_linked, reply_progressively, section_lines
+from formatting import format_russian_date, format_task_line
+from outbound import reply_long
+from datetime import datetime, timedelta
+
+async def fetch_today_tasks(user_id, today_start, today_end):
+    index = await task_cache.get_index(user_id)
+    return [format_task_line(task) for task in index.due_between(today_start, today_end)]
+
+async def fetch_today_events(user_id, today_start, today_end):
+    events = await task_cache.get_events(user_id, today_start, today_end)
+
+    lines = []
+    for event in events:
+        if event.all_day:
+            lines.append(f"• {event.summary}")
+        else:
+            lines.append(f"• {event.summary} в {event.start.strftime('%H:%M')}")
+    return lines
+
+def today_bounds(now):
+    today_start = MINSK_TZ.localize(datetime(now.year, now.month, now.day))
+    return today_start, today_start + timedelta(days=1)
+
+def render_today(today_start, results):
+    if not_linked(results):
+        return LINK_HINT
+    lines = [f"📆 Сегодня: {format_russian_date(today_start)}"]
+    lines.append("\n📝 Задачи:")
+    lines.extend(section_lines(results["tasks"], "Нет задач на сегодня."))
+    lines.append("\n🕒 Встречи:")
+    lines.extend(section_lines(results["events"], "Нет встреч на сегодня."))
+    return "\n".join(lines)
 
 async def today_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    creds = get_credentials()
+    user_id = update.effective_user.id
+    today_start, today_end = today_bounds(datetime.now(MINSK_TZ))
+
+    # Задачи и встречи запрашиваются параллельно
+    jobs = {
+        "tasks": asyncio.create_task(fetch_today_tasks(user_id, today_start, today_end)),
+        "events": asyncio.create_task(fetch_today_events(user_id, today_start, today_end)),
+    }
+
+    await reply_progressively(update.message, jobs, lambda results: render_today(today_start, results))
+
+async def week_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     now = datetime.now(MINSK_TZ)
-    today_str = now.date()
-
-    service = build("tasks", "v1", credentials=creds)
-    result = service.tasks().list(tasklist='@default', showCompleted=False).execute()
-    tasks = result.get('items', [])
-
-    today_tasks = []
-    for task in tasks:
-        due = task.get("due")
-        if due:
-            try:
-                due_dt = datetime.strptime(due, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc).astimezone(MINSK_TZ)
-                if due_dt.date() == today_str:
-                    today_tasks.append(f"✅ {task['title']} (на {due_dt.strftime('%d.%m.%Y')})")
-            except Exception:
-                continue
-
-    calendar_service = build("calendar", "v3", credentials=creds)
-    events_result = calendar_service.events().list(
-        calendarId='primary',
-        timeMin=now.isoformat(),
-        timeMax=(now + timedelta(days=1)).isoformat(),
-        singleEvents=True,
-        orderBy='startTime'
-    ).execute()
-    events = events_result.get('items', [])
-
-    lines = ["📆 Задачи и встречи на сегодня:"]
-    lines.extend(today_tasks or ["Задач нет"])
-
-    if events:
-        lines.append("\n🕒 Встречи:")
-        for event in events:
-            start = event['start'].get('dateTime', event['start'].get('date'))
-            summary = event.get('summary', 'Без названия')
-            if 'T' in start:
-                lines.append(f"• {summary} в {start[11:16]}")
-            else:
-                lines.append(f"• {summary}")
-    else:
-        lines.append("Встреч нет")
-
-    await update.message.reply_text("\n".join(lines))
+    week_start = MINSK_TZ.localize(datetime(now.year, now.month, now.day) - timedelta(days=now.weekday()))
+    week_end = MINSK_TZ.localize(week_start.replace(tzinfo=None) + timedelta(days=7))
+    index = await task_cache.get_index(update.effective_user.id)
+    tasks = index.due_between(week_start, week_end)
+
+    if not tasks:
+        await update.message.reply_text("🎉 На этой неделе задач нет.")
+        return
+
+    lines = [f"🗓 Задачи на неделю ({week_start.strftime('%d.%m')} – {(week_end - timedelta(days=1)).strftime('%d.%m')}):"]
+    for day, day_tasks in index.by_date(tasks):
+        lines.append(f"\n📅 {format_russian_date(day)}:")
+        lines.extend(format_task_line(task) for task in day_tasks)
+
+    await reply_long(update.message, "\n".join(lines))
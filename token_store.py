@@ -0,0 +1,65 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from cryptography.fernet import Fernet
+
+TOKEN_STORE_PATH = os.getenv("TOKEN_STORE_PATH", "tokens.sqlite3")
+# Ключ Fernet (urlsafe base64, 32 байта). Получить новый: python token_store.py
+TOKEN_STORE_KEY = os.getenv("TOKEN_STORE_KEY", "")
+
+
+class TokenStore:
+    # Токены Google каждого пользователя в SQLite, зашифрованные Fernet.
+    # Хранится JSON авторизованного пользователя (Credentials.to_json), а не
+    # pickle. Методы блокирующие — вызываются через asyncio.to_thread.
+    def __init__(self, path=TOKEN_STORE_PATH, key=TOKEN_STORE_KEY):
+        self.path = path
+        self._fernet = Fernet(key) if key else None
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self._fernet is not None
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tokens (user_id INTEGER PRIMARY KEY, token BLOB, updated REAL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def load(self, user_id):
+        with self._lock:
+            row = self._db().execute("SELECT token FROM tokens WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(self._fernet.decrypt(row[0]))
+
+    def save(self, user_id, info):
+        token = self._fernet.encrypt(json.dumps(info).encode())
+        with self._lock, self._db() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO tokens (user_id, token, updated) VALUES (?, ?, ?)",
+                (user_id, token, time.time()),
+            )
+
+    def delete(self, user_id):
+        with self._lock, self._db() as conn:
+            conn.execute("DELETE FROM tokens WHERE user_id = ?", (user_id,))
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+if __name__ == "__main__":
+    print("TOKEN_STORE_KEY=" + Fernet.generate_key().decode())
@@ -0,0 +1,95 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+# Файл для выгрузки спанов (JSON Lines); пусто — спаны только в метриках.
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+# Доля трасс, которые попадают в файл. Решение принимается в корневом спане.
+TRACE_SAMPLE = float(os.getenv("TRACE_SAMPLE", "1"))
+
+_current = contextvars.ContextVar("span", default=None)
+_lock = threading.Lock()
+_file = None
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "sampled", "attributes")
+
+    def __init__(self, parent):
+        self.span_id = f"{random.getrandbits(64):016x}"
+        if parent is None:
+            self.trace_id = f"{random.getrandbits(128):032x}"
+            self.parent_id = None
+            self.sampled = bool(TRACE_FILE) and random.random() < TRACE_SAMPLE
+        else:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+            self.sampled = parent.sampled
+        self.attributes = {}
+
+
+@contextmanager
+def span(name, **labels):
+    # Время блока попадает в гистограмму {name}_seconds, исключения — в
+    # счётчик {name}_errors. Метки должны иметь немного значений; всё
+    # остальное (например, user_id) кладётся в span.attributes и уходит
+    # только в файл трасс. Вложенные спаны (запросы к Google и Telegram
+    # внутри обработчика) связываются с родителем через contextvars.
+    current = Span(_current.get())
+    token = _current.set(current)
+    started_at = time.time()
+    started = time.perf_counter()
+    error = None
+    try:
+        yield current
+    except asyncio.CancelledError:
+        error = "cancelled"
+        raise
+    except BaseException as e:
+        error = type(e).__name__
+        metrics.inc(f"{name}_errors", **labels)
+        raise
+    finally:
+        _current.reset(token)
+        duration = time.perf_counter() - started
+        metrics.observe(f"{name}_seconds", duration, **labels)
+        if current.sampled:
+            _export({
+                "name": name,
+                "trace_id": current.trace_id,
+                "span_id": current.span_id,
+                "parent_id": current.parent_id,
+                "start": started_at,
+                "duration": duration,
+                "labels": labels,
+                "attributes": current.attributes,
+                "error": error,
+            })
+
+
+def _export(record):
+    global _file
+    line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+    with _lock:
+        try:
+            if _file is None:
+                _file = open(TRACE_FILE, "a", encoding="utf-8")
+            _file.write(line)
+        except OSError as e:
+            logging.warning(f"Не удалось записать спан в {TRACE_FILE}: {e}")
+
+
+def close():
+    global _file
+    with _lock:
+        if _file is not None:
+            _file.close()
+            _file = None
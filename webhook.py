@@ -0,0 +1,224 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import queue as queue_module
+import secrets
+import time
+
+import uvicorn
+from telegram import Bot, Update
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", str(os.cpu_count() or 2)))
+PORT = int(os.getenv("PORT", "8000"))
+# Сколько обновлений может ждать в очереди одного обработчика. Когда очередь
+# полна, Telegram получает 503 и сам повторит доставку позже.
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+# Упавший обработчик перезапускается не чаще раза в столько секунд: если он
+# падает сразу при старте, запросы не должны плодить процессы.
+WORKER_RESTART_DELAY = float(os.getenv("WEBHOOK_RESTART_DELAY", "5"))
+# Тот же адрес Bot API, что и в bot.py
+TELEGRAM_BASE_URL = os.getenv("TELEGRAM_BASE_URL", "")
+
+# Схема: один ASGI-процесс принимает webhook от Telegram и раскладывает
+# обновления по очередям процессов-обработчиков. Процесс выбирается по
+# chat_id, поэтому все сообщения одного чата (и состояние его
+# ConversationHandler) всегда обрабатываются одним и тем же процессом.
+#
+# На Heroku это процесс web из Procfile. Webhook и long polling (процесс
+# worker) взаимоисключающие, поэтому при переключении запускается только
+# один из них: heroku ps:scale worker=0 web=1 (и обратно).
+
+
+def chat_id_of(data):
+    for key, value in data.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        for holder in (value, value.get("message") or {}):
+            chat = holder.get("chat")
+            if chat:
+                return chat["id"]
+        user = value.get("from") or value.get("user")
+        if user:
+            return user["id"]
+    return 0
+
+
+def run_worker(index, queue):
+    # Точка входа процесса-обработчика (multiprocessing, метод spawn).
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_worker_loop(index, queue))
+
+
+async def _worker_loop(index, queue):
+    import digest
+    import metrics
+    import outbound
+    import tracing
+    from bot import build_application
+
+    digest.scheduler.shard = (index, WEBHOOK_WORKERS)
+    # Общий лимит Bot API делится между процессами-обработчиками.
+    outbound.GLOBAL_RATE /= WEBHOOK_WORKERS
+    # Метрики и трассы у каждого процесса свои: порт METRICS_PORT + номер
+    # процесса, файл трасс с номером процесса в имени.
+    if metrics.METRICS_PORT:
+        metrics.METRICS_PORT += index
+    if tracing.TRACE_FILE:
+        tracing.TRACE_FILE = f"{tracing.TRACE_FILE}.{index}"
+    app = build_application(updater=False)
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    logging.info(f"Обработчик #{index} запущен")
+
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            body = await loop.run_in_executor(None, queue.get)
+            if body is None:
+                break
+            await app.update_queue.put(Update.de_json(json.loads(body), app.bot))
+    finally:
+        await app.stop()
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+class Workers:
+    # Процессы-обработчики и их очереди. Родитель сам следит за ними:
+    # обновления для мёртвого процесса иначе копились бы в очереди навсегда.
+    def __init__(self, context, count):
+        self.context = context
+        self.queues = [None] * count
+        self.processes = [None] * count
+        self.started_at = [0.0] * count
+        for index in range(count):
+            self._start(index)
+
+    def __len__(self):
+        return len(self.processes)
+
+    def _start(self, index):
+        self.queues[index] = self.context.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+        self.processes[index] = self.context.Process(
+            target=run_worker, args=(index, self.queues[index]), daemon=True,
+        )
+        self.processes[index].start()
+        self.started_at[index] = time.monotonic()
+
+    def alive(self):
+        return all(process.is_alive() for process in self.processes)
+
+    def ensure(self, index):
+        # True, если обработчик жив; упавший перезапускается с новой очередью:
+        # старая могла остаться заблокированной процессом, умершим на get().
+        process = self.processes[index]
+        if process.is_alive():
+            return True
+        if time.monotonic() - self.started_at[index] < WORKER_RESTART_DELAY:
+            return False
+        logging.error(f"Обработчик #{index} завершился (код {process.exitcode}), перезапуск")
+        self._start(index)
+        return True
+
+    def put(self, index, body):
+        if not self.ensure(index):
+            return False
+        try:
+            self.queues[index].put_nowait(body)
+        except queue_module.Full:
+            logging.warning(f"Очередь обработчика #{index} переполнена")
+            return False
+        return True
+
+    def stop(self):
+        for index, process in enumerate(self.processes):
+            try:
+                self.queues[index].put_nowait(None)
+            except queue_module.Full:
+                process.terminate()
+        for process in self.processes:
+            process.join(timeout=10)
+
+
+class WebhookApp:
+    def __init__(self, workers):
+        self.workers = workers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                options = {"base_url": TELEGRAM_BASE_URL} if TELEGRAM_BASE_URL else {}
+                async with Bot(os.getenv("TELEGRAM_TOKEN"), **options) as bot:
+                    await bot.set_webhook(
+                        url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                        secret_token=WEBHOOK_SECRET,
+                        allowed_updates=Update.ALL_TYPES,
+                    )
+                logging.info(f"Webhook установлен, обработчиков: {len(self.workers)}")
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope, receive, send):
+        if scope["path"] == "/healthz":
+            await _respond(send, 200 if self.workers.alive() else 503)
+            return
+        if scope["method"] != "POST" or scope["path"] != WEBHOOK_PATH:
+            await _respond(send, 404)
+            return
+        headers = dict(scope["headers"])
+        if headers.get(b"x-telegram-bot-api-secret-token", b"").decode() != WEBHOOK_SECRET:
+            await _respond(send, 403)
+            return
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        try:
+            data = json.loads(body)
+        except ValueError:
+            await _respond(send, 400)
+            return
+
+        # 503 — Telegram повторит доставку, обновление не потеряется
+        accepted = self.workers.put(chat_id_of(data) % len(self.workers), body)
+        await _respond(send, 200 if accepted else 503)
+
+
+async def _respond(send, status):
+    await send({"type": "http.response.start", "status": status, "headers": [(b"content-length", b"0")]})
+    await send({"type": "http.response.body", "body": b""})
+
+
+def serve():
+    if not WEBHOOK_URL:
+        raise RuntimeError("Для BOT_MODE=webhook нужно задать WEBHOOK_URL")
+
+    workers = Workers(multiprocessing.get_context("spawn"), WEBHOOK_WORKERS)
+    logging.info(f"Бот запущен в режиме webhook на порту {PORT}, обработчиков: {len(workers)}")
+    try:
+        uvicorn.run(WebhookApp(workers), host="0.0.0.0", port=PORT, log_level="info")
+    finally:
+        workers.stop()